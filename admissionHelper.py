@@ -0,0 +1,256 @@
+'''
+admissionHelper.py
+
+This helper file decides whether a command gets to run right now, so one person (or one server) spamming
+/sentimentplot cant make the bot slow for everyone else.
+
+Every command goes through three checks before it runs:
+    - a token bucket per user: VIBECHECK_USER_RATE commands per second, with bursts of up to VIBECHECK_USER_BURST.
+      someone over it gets one "slow down" reply (not one per command, that would be more spam) and their
+      commands are dropped until the bucket refills
+    - a token bucket per server, the same way, so one busy server cant use up the whole bot
+    - for the expensive commands (the ones that fetch lyrics, run VADER or render a plot), a limit on how many run
+      at the same time. past it, commands wait in line and the user is told their place in it. the line takes
+      turns between servers (round robin), so a server with 20 commands waiting doesnt push everyone else to
+      the back. when the line is full, or a command has waited VIBECHECK_QUEUE_SECONDS, the user is told the bot
+      is busy instead of being left waiting forever
+
+Cheap commands (/toptracks, /searchlyrics) only go through the token buckets.
+
+Settings in the 3510.env file:
+    VIBECHECK_ADMISSION=1               set to 0 to turn all of this off
+    VIBECHECK_USER_RATE=0.5             commands per second per user, VIBECHECK_USER_BURST=5
+    VIBECHECK_GUILD_RATE=3              commands per second per server, VIBECHECK_GUILD_BURST=30
+    VIBECHECK_MAX_INFLIGHT=16           expensive commands running at once
+    VIBECHECK_MAX_QUEUED=64             expensive commands waiting in line, VIBECHECK_MAX_QUEUED_PER_GUILD=8 from one server
+    VIBECHECK_QUEUE_SECONDS=30          longest a command waits in line
+
+Load shedding: https://aws.amazon.com/builders-library/using-load-shedding-to-avoid-overload/
+'''
+
+import asyncio # the line of waiting commands is asyncio futures
+import collections # deque and OrderedDict for the round robin line
+import functools # functools.wraps keeps the command's name and arguments so discord.py still understands it
+import os # operating system module for accessing environment variables
+import time # when someone was last told to slow down
+import rateLimitHelper as rl # ApiLimiter is the token bucket
+
+admissionEnabled = os.getenv("VIBECHECK_ADMISSION", "1") == "1"
+userRate = float(os.getenv("VIBECHECK_USER_RATE", "0.5"))
+userBurst = int(os.getenv("VIBECHECK_USER_BURST", "5"))
+guildRate = float(os.getenv("VIBECHECK_GUILD_RATE", "3"))
+guildBurst = int(os.getenv("VIBECHECK_GUILD_BURST", "30"))
+maxInFlight = max(int(os.getenv("VIBECHECK_MAX_INFLIGHT", "16")), 1)
+maxQueued = int(os.getenv("VIBECHECK_MAX_QUEUED", "64"))
+maxQueuedPerGuild = int(os.getenv("VIBECHECK_MAX_QUEUED_PER_GUILD", "8"))
+queueSeconds = float(os.getenv("VIBECHECK_QUEUE_SECONDS", "30"))
+maxTrackedBuckets = 10000 # past this many users/servers, the ones with a full bucket (not doing anything) are forgotten
+
+# the commands that do real work (lyrics fetch, VADER, matplotlib) and go through the in-flight limit
+expensiveCommands = {"lyrics", "sentiment", "sentimentplot", "artistmood"}
+
+userBuckets = {} # user ID -> ApiLimiter
+guildBuckets = {} # server ID -> ApiLimiter
+warnedUntil = {} # user ID -> time.monotonic() until which they have already been told to slow down
+counters = {'admitted': 0, 'queued': 0, 'rejectedUser': 0, 'rejectedGuild': 0, 'rejectedBusy': 0, 'timedOut': 0}
+
+
+
+
+class CommandGate: # lets maxInFlight expensive commands run at once, the rest wait in line taking turns by server
+    '''
+    example:
+        if await gate.enter(serverKey, onQueued):
+            try:
+                ... # the command
+            finally:
+                gate.leave()
+    '''
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.inFlight = 0
+        self.lines = collections.OrderedDict() # server key -> deque of futures, in round robin order
+
+
+    def queuedCount(self): # commands waiting in line right now
+        return sum(len(line) for line in self.lines.values())
+
+
+    def positionOf(self, serverKey, future): # where a waiting command is in line, counting the turns other servers get first
+        line = self.lines.get(serverKey, ())
+        if future not in line:
+            return 0
+        placeInServer = list(line).index(future) + 1
+        return placeInServer + sum(min(len(otherLine), placeInServer) for otherKey, otherLine in self.lines.items() if otherKey != serverKey)
+
+
+    async def enter(self, serverKey, onQueued=None): # waits for a slot. returns False if the line is full or it waited too long
+        '''
+        args:
+            serverKey: which server the command came from, for taking turns
+            onQueued (async function): onQueued(position) is called once if the command has to wait
+
+        returns:
+            bool: True once the command may run (call leave() when it is done), False if it was turned away
+        '''
+        if self.inFlight < self.limit and not self.lines: # free slot and nobody waiting, go straight away
+            self.inFlight += 1
+            return True
+        line = self.lines.get(serverKey)
+        if self.queuedCount() >= maxQueued or (line is not None and len(line) >= maxQueuedPerGuild):
+            counters['rejectedBusy'] += 1
+            return False
+        future = asyncio.get_running_loop().create_future()
+        if line is None:
+            line = self.lines[serverKey] = collections.deque()
+        line.append(future)
+        counters['queued'] += 1
+        try:
+            if onQueued is not None:
+                await onQueued(self.positionOf(serverKey, future))
+            await asyncio.wait_for(future, queueSeconds) # cancels the future if it times out
+        except BaseException as error: # timed out, or the command was cancelled while it waited
+            if future.done() and not future.cancelled(): # a slot was handed to us right as we gave up, pass it on
+                self.leave()
+            else:
+                future.cancel()
+                self.removeWaiter(serverKey, future)
+            if isinstance(error, asyncio.TimeoutError):
+                counters['timedOut'] += 1
+                return False
+            raise
+        return True
+
+
+    def removeWaiter(self, serverKey, future):
+        line = self.lines.get(serverKey)
+        if line is not None and future in line:
+            line.remove(future)
+            if not line:
+                del self.lines[serverKey]
+
+
+    def leave(self): # a command finished: hand its slot to the next server in the round robin, or free it
+        while self.lines:
+            serverKey, line = next(iter(self.lines.items()))
+            future = line.popleft()
+            if line:
+                self.lines.move_to_end(serverKey) # this server had its turn, the next server goes next
+            else:
+                del self.lines[serverKey]
+            if not future.done():
+                future.set_result(None) # the slot goes straight to the waiter, inFlight stays the same
+                return
+        self.inFlight -= 1
+
+
+
+
+gate = CommandGate(maxInFlight)
+
+
+
+
+def getBucket(buckets, key, rate, burst): # the token bucket for one user or server, made the first time they show up
+    bucket = buckets.get(key)
+    if bucket is None:
+        if len(buckets) >= maxTrackedBuckets:
+            forgetIdleBuckets(buckets)
+        bucket = buckets[key] = rl.ApiLimiter(str(key), rate, burst)
+    return bucket
+
+
+
+def forgetIdleBuckets(buckets): # drops the buckets that have refilled all the way, a new one would be the same
+    now = time.monotonic()
+    for key, bucket in list(buckets.items()):
+        bucket.refill(now)
+        if bucket.tokens >= bucket.burst:
+            del buckets[key]
+
+
+
+def checkBuckets(userID, guildID): # takes a token from the user's and the server's bucket
+    '''
+    returns:
+        str or None: None if the command may go ahead, otherwise "user" or "guild" (whose bucket was empty)
+    '''
+    userBucket = getBucket(userBuckets, userID, userRate, userBurst)
+    if not userBucket.tryTake():
+        return "user"
+    if guildID is not None and not getBucket(guildBuckets, guildID, guildRate, guildBurst).tryTake():
+        userBucket.tokens += 1 # the command isnt running, give the user their token back
+        return "guild"
+    return None
+
+
+
+def shouldWarn(userID, waitSeconds): # True the first time a user is over the limit, then not again until it has passed
+    now = time.monotonic()
+    if warnedUntil.get(userID, 0.0) > now:
+        return False
+    if len(warnedUntil) >= maxTrackedBuckets:
+        for key in [key for key, until in warnedUntil.items() if until <= now]:
+            del warnedUntil[key]
+    warnedUntil[userID] = now + waitSeconds
+    return True
+
+
+
+def admitted(commandFunction): # decorator that runs a command only if it gets through the buckets and the in-flight limit
+    '''
+    goes UNDER @mh.timedCommand:
+
+        @bot.command()
+        @mh.timedCommand
+        @ah.admitted
+        async def sentimentplot(ctx, *args):
+    '''
+    expensive = commandFunction.__name__ in expensiveCommands
+
+    @functools.wraps(commandFunction)
+    async def admittedVersion(ctx, *args, **kwargs):
+        if not admissionEnabled:
+            return await commandFunction(ctx, *args, **kwargs)
+        userID = ctx.author.id
+        guildID = ctx.guild.id if ctx.guild is not None else None
+
+        overLimit = checkBuckets(userID, guildID)
+        if overLimit is not None:
+            counters['rejectedUser' if overLimit == "user" else 'rejectedGuild'] += 1
+            bucket = userBuckets[userID] if overLimit == "user" else guildBuckets[guildID]
+            waitSeconds = bucket.secondsUntilToken()
+            if shouldWarn(userID, waitSeconds):
+                if overLimit == "user":
+                    await ctx.send(f"You're sending commands really fast, try again in {waitSeconds:.0f}s!")
+                else:
+                    await ctx.send(f"This server is sending a lot of commands right now, try again in {waitSeconds:.0f}s!")
+            return None
+
+        if not expensive:
+            counters['admitted'] += 1
+            return await commandFunction(ctx, *args, **kwargs)
+
+        async def tellPosition(position): # one reply when the command has to wait
+            await ctx.send(f"Lots of people are using the bot right now, you're number {position} in line...")
+
+        serverKey = guildID if guildID is not None else f"dm {userID}" # DMs take turns like a server of their own
+        if not await gate.enter(serverKey, tellPosition):
+            await ctx.send("The bot is really busy right now, please try again in a minute!")
+            return None
+        counters['admitted'] += 1
+        try:
+            return await commandFunction(ctx, *args, **kwargs)
+        finally:
+            gate.leave()
+
+    return admittedVersion
+
+
+
+def getStats(): # the counters plus how full the in-flight limit and the line are right now
+    stats = dict(counters)
+    stats['inFlight'] = gate.inFlight
+    stats['waiting'] = gate.queuedCount()
+    return stats
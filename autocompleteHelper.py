@@ -0,0 +1,162 @@
+'''
+autocompleteHelper.py
+
+This helper file answers the autocomplete for the slash commands' artist and title boxes.
+
+Discord asks the bot for suggestions on (almost) every key press and drops the answer if it takes longer than
+3 seconds, so the suggestions cant come from Spotify or Genius. Instead they come from the artists and songs
+the bot has already found for someone (and the songs already in the lyrics index when the bot starts), kept in
+memory in prefix tries:
+
+    - one trie of artist names, and one trie of song titles per artist (plus one of every title, for when the
+      artist box is empty or an artist we havent seen)
+    - names are inserted under their normalized form (lowercase, no accents or punctuation, like the cache keys)
+      and also starting at every word, so "mill" finds "Mac Miller"
+    - every node of the trie keeps its own short list of the best suggestions below it (the ones people ask for
+      the most), so a lookup is just walking down the letters typed so far, no matter how many names there are
+
+Trie: https://en.wikipedia.org/wiki/Trie
+Autocomplete: https://discord.com/developers/docs/interactions/application-commands#autocomplete
+'''
+
+import asyncio # loading yields to the event loop between chunks
+import cacheHelper as ch # the same normalized keys as the caches
+
+suggestionsPerNode = 25 # discord shows at most 25 choices
+maxChoiceLength = 100 # discord's limit for a choice's name and value
+maxNames = 50000 # past this many names in one trie, new ones are ignored (the trie would only get slower to update)
+loadChunkSize = 500 # songs added between yields to the event loop when loading
+
+
+
+
+class TrieNode: # one letter of the trie
+    __slots__ = ('children', 'top')
+
+    def __init__(self):
+        self.children = {} # next letter -> TrieNode
+        self.top = [] # the best names below this node, most asked for first
+
+
+
+
+class PrefixIndex: # a trie of names that returns the most asked for names starting with what was typed
+    '''
+    example:
+        artistIndex = PrefixIndex()
+        artistIndex.add("Mac Miller")
+        artistIndex.complete("mac m") # ["Mac Miller"]
+        artistIndex.complete("mill") # ["Mac Miller"]
+    '''
+
+    def __init__(self):
+        self.root = TrieNode()
+        self.weights = {} # display name -> how many times it was added
+        self.displayNames = {} # normalized name -> the display name we show for it
+
+
+    def __len__(self):
+        return len(self.weights)
+
+
+    def add(self, name, weight=1): # adds a name (or makes a name we have already seen rank higher)
+        key = ch.normalizeKey(name)
+        if not key or len(name) > maxChoiceLength:
+            return
+        name = self.displayNames.get(key, name) # "mac miller" and "Mac Miller" are one name, shown the first way we saw it
+        if name not in self.weights and len(self.weights) >= maxNames:
+            return # full, and a name we dont keep shouldnt take up room in displayNames either
+        self.displayNames[key] = name
+        self.weights[name] = self.weights.get(name, 0) + weight
+        words = key.split(" ")
+        for wordNumber in range(len(words)): # the whole name, then starting at the 2nd word, the 3rd word...
+            node = self.root
+            self.updateTop(node, name)
+            for character in " ".join(words[wordNumber:]):
+                node = node.children.setdefault(character, TrieNode())
+                self.updateTop(node, name)
+
+
+    def updateTop(self, node, name): # puts a name in (or moves it up) a node's list of best names
+        top = node.top
+        weight = self.weights[name]
+        if name in top:
+            top.remove(name)
+        elif len(top) >= suggestionsPerNode and weight <= self.weights[top[-1]]:
+            return # not one of the best here
+        position = len(top)
+        while position and self.weights[top[position - 1]] < weight: # the list is already sorted, just find its spot
+            position -= 1
+        top.insert(position, name)
+        del top[suggestionsPerNode:]
+
+
+    def complete(self, prefix, limit=suggestionsPerNode): # the best names with a word starting with prefix
+        node = self.root
+        for character in ch.normalizeKey(prefix):
+            node = node.children.get(character)
+            if node is None:
+                return []
+        return node.top[:limit]
+
+
+
+
+artistIndex = PrefixIndex()
+allTitlesIndex = PrefixIndex()
+titleIndexes = {} # normalized artist name -> PrefixIndex of their song titles
+
+
+
+
+def addArtist(artistName): # remember an artist the bot found, for the artist box
+    artistIndex.add(artistName)
+
+
+
+def addSong(artistName, songTitle): # remember a song the bot found, for the title box (and its artist for the artist box)
+    addArtist(artistName)
+    allTitlesIndex.add(songTitle)
+    artistKey = ch.normalizeKey(artistName)
+    if artistKey not in titleIndexes:
+        titleIndexes[artistKey] = PrefixIndex()
+    titleIndexes[artistKey].add(songTitle)
+
+
+
+def loadSongs(songs): # fills the tries from (song title, artist name) pairs, like the songs already in the lyrics index
+    for songTitle, artistName in songs:
+        addSong(artistName, songTitle)
+
+
+
+async def loadSongsAsync(songs): # async version of loadSongs
+    '''
+    The tries arent safe to change from two threads at once, and commands add to them on the event loop,
+    so a big load runs on the event loop too, a chunk at a time so commands and heartbeats still get their turn.
+
+    example:
+        await ach.loadSongsAsync(await asyncio.to_thread(lih.listSongs))
+    '''
+    songs = list(songs)
+    for start in range(0, len(songs), loadChunkSize):
+        loadSongs(songs[start:start + loadChunkSize])
+        await asyncio.sleep(0) # let everything else waiting on the loop run
+
+
+
+def completeArtists(typed): # artist suggestions for what is typed so far
+    return artistIndex.complete(typed)
+
+
+
+def completeTitles(typed, artistName=None): # title suggestions, from that artist's songs if we know the artist
+    titleIndex = titleIndexes.get(ch.normalizeKey(artistName)) if artistName else None
+    if titleIndex is None:
+        titleIndex = allTitlesIndex
+    return titleIndex.complete(typed)
+
+
+
+def stats():
+    return {'artists': len(artistIndex), 'titles': len(allTitlesIndex)}
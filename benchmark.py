@@ -0,0 +1,419 @@
+'''
+benchmark.py
+
+This file measures how fast the bot's commands are without needing Discord, Spotify or Genius credentials.
+
+It starts a small fake web server on this computer that answers like the Spotify and Genius APIs (and the
+Genius song pages we scrape), points the helper files at it with the SPOTIFY_API_BASE, SPOTIFY_TOKEN_URL,
+GENIUS_API_BASE and GENIUS_PUBLIC_API_BASE environment variables, and then runs the real command functions from musicBot.py with a fake
+Discord context that just records what the bot would have sent. Every command is timed and at the end it
+prints the p50 / p95 / p99 latency for each command and the overall commands per second.
+
+The fake server can be made slow (--latency-ms) and flaky (--error-rate answers some requests with a 429 or
+503), so we can see how the caches, the rate limiter and the worker pools hold up.
+
+    python benchmark.py
+    python benchmark.py --requests 500 --concurrency 50 --latency-ms 120 --error-rate 0.05
+    python benchmark.py --save baseline.json # remember the results
+    python benchmark.py --compare baseline.json # exits with code 1 if any p95 got more than 20% slower
+
+By default the fake server makes up its answers (in the same shape as the real APIs). To replay real
+responses, save them in a JSON file like {"GET /v1/search?q=Mac Miller": {...}, "GET /songs/123": "<html>..."}
+and pass it with --payloads. The keys are the method, the path after the fake server's prefix and, for
+searches, the q parameter.
+
+/searchlyrics searches for a line of a song's made up lyrics. the local lyrics index only knows the songs fetched
+earlier in the run, so the rest go to the fake Genius lyric search.
+
+aiohttp (already installed with discord.py) runs the fake server: https://docs.aiohttp.org/en/stable/web.html
+'''
+
+import argparse # reads the command line options
+import asyncio # runs the fake server and the commands on one event loop
+import hashlib # turns names into stable fake IDs
+import json # for --payloads, --save and --compare
+import os # operating system module for setting environment variables
+import random # for the workload mix, the fake latency and the fake errors
+import socket # to find a free port for the fake server
+import statistics # for the average
+import sys # for the exit code
+import tempfile # an empty cache folder so every run starts cold
+import time # for timing the commands
+
+benchmarkGuilds = 20 # how many servers the fake commands come from
+
+# a few artists and songs to ask about. the lyrics are made up from words VADER knows so the sentiment work is realistic
+benchmarkArtists = ["Mac Miller", "Pearl Jam", "Post Malone", "Taylor Swift", "Kendrick Lamar", "Beyonce", "The Weeknd", "Frank Ocean",
+                    "SZA", "Radiohead", "Fleetwood Mac", "Bon Iver", "Lorde", "Drake", "Adele", "Nirvana"]
+benchmarkSongs = ["Blue World", "Black", "Circles", "Good News", "Halo", "Alive", "Sunflower", "Creep", "Dreams", "Holocene",
+                  "Royals", "Hello", "Lithium", "Yellow", "Self Control", "Kill Bill"]
+lyricWords = ("love hate happy sad good bad cry smile lonely free broken beautiful never always night light dark "
+              "hope fear dream lost found hurt heal alive dead sweet bitter cold warm baby yeah oh no don't can't "
+              "really very so not the a and i you we they my your our in on with without down up away home").split()
+
+commandWeights = {"toptracks": 3, "lyrics": 3, "sentiment": 2, "sentimentplot": 1, "searchlyrics": 1} # how often each command shows up in the mix
+
+
+
+
+def findFreePort(): # asks the operating system for a port nobody is using
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+
+def stableNumber(text, modulo=10**9): # the same text always gives the same number, so fake IDs stay the same between runs
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest(), 16) % modulo
+
+
+
+def fakeLyrics(songKey, lines=40): # makes up a song's lyrics, always the same ones for the same song
+    randomGenerator = random.Random(songKey)
+    verses = []
+    for lineNumber in range(lines):
+        line = " ".join(randomGenerator.choice(lyricWords) for _ in range(randomGenerator.randint(4, 10)))
+        if randomGenerator.random() < 0.1:
+            line += randomGenerator.choice(["!", "?", "!!"])
+        verses.append(line)
+        if lineNumber % 8 == 7:
+            verses.append("") # blank line between verses
+    return "\n".join(verses)
+
+
+
+
+class FakeUpstream: # the fake Spotify + Genius web server
+    '''
+    args:
+        port (int): port to listen on (127.0.0.1 only)
+        latencySeconds (float): average extra time before each answer
+        errorRate (float): chance (0 to 1) that a request gets a 429 or 503 instead of an answer
+        payloads (dict): recorded responses to replay, see the top of this file
+    '''
+
+    def __init__(self, port, latencySeconds=0.05, errorRate=0.0, payloads=None, seed=0):
+        self.port = port
+        self.latencySeconds = latencySeconds
+        self.errorRate = errorRate
+        self.payloads = payloads or {}
+        self.random = random.Random(seed)
+        self.counters = {'requests': 0, 'errors': 0}
+        self.runner = None
+
+
+    def baseUrl(self):
+        return f"http://127.0.0.1:{self.port}"
+
+
+    async def start(self):
+        from aiohttp import web # only needed for the benchmark, so it is imported here
+        self.web = web
+        app = web.Application()
+        app.router.add_post("/spotify/token", self.spotifyToken)
+        app.router.add_get("/spotify/v1/search", self.spotifySearch)
+        app.router.add_get("/spotify/v1/artists/{artistID}/top-tracks", self.spotifyTopTracks)
+        app.router.add_get("/genius/search", self.geniusSearch)
+        app.router.add_get("/genius/songs/{songID}", self.geniusSongPage)
+        app.router.add_get("/genius-public/search/lyric", self.geniusLyricSearch)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", self.port).start()
+
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+    async def delayOrFail(self): # the fake network: waits a bit and sometimes says "too many requests"
+        self.counters['requests'] += 1
+        if self.latencySeconds:
+            await asyncio.sleep(self.random.expovariate(1 / self.latencySeconds)) # most answers are quick, a few are slow, like real APIs
+        if self.random.random() < self.errorRate:
+            self.counters['errors'] += 1
+            if self.random.random() < 0.5:
+                return self.web.json_response({'error': 'rate limited'}, status=429, headers={'Retry-After': "1"})
+            return self.web.json_response({'error': 'unavailable'}, status=503)
+        return None
+
+
+    def recorded(self, request, key): # a recorded payload for this request, if --payloads has one
+        query = request.query.get('q')
+        return self.payloads.get(f"{request.method} {key}?q={query}" if query else f"{request.method} {key}")
+
+
+    async def spotifyToken(self, request):
+        return await self.delayOrFail() or self.web.json_response({'access_token': "benchmark-token", 'token_type': "Bearer", 'expires_in': 3600})
+
+
+    async def spotifySearch(self, request):
+        failure = await self.delayOrFail()
+        if failure:
+            return failure
+        payload = self.recorded(request, "/v1/search")
+        if payload is None:
+            artistName = request.query.get('q', "")
+            payload = {'artists': {'items': [{'id': f"artist{stableNumber(artistName.lower())}", 'name': artistName}]}}
+        return self.web.json_response(payload)
+
+
+    async def spotifyTopTracks(self, request):
+        failure = await self.delayOrFail()
+        if failure:
+            return failure
+        artistID = request.match_info['artistID']
+        payload = self.recorded(request, f"/v1/artists/{artistID}/top-tracks")
+        if payload is None:
+            payload = {'tracks': [
+                {'name': f"Track {number} ({artistID[-4:]})", 'album': {'name': f"Album {number % 3}"}, 'popularity': 90 - number}
+                for number in range(10)
+            ]}
+        return self.web.json_response(payload)
+
+
+    async def geniusSearch(self, request):
+        failure = await self.delayOrFail()
+        if failure:
+            return failure
+        payload = self.recorded(request, "/search")
+        if payload is None:
+            query = request.query.get('q', "")
+            songID = stableNumber(query.lower())
+            payload = {'response': {'hits': [{'type': 'song', 'result': {
+                'id': songID,
+                'title': query,
+                'url': f"{self.baseUrl()}/genius/songs/{songID}",
+                'lyrics_state': 'complete',
+                'primary_artist': {'name': ""},
+            }}]}}
+        return self.web.json_response(payload)
+
+
+    async def geniusLyricSearch(self, request):
+        failure = await self.delayOrFail()
+        if failure:
+            return failure
+        payload = self.recorded(request, "/search/lyric")
+        if payload is None:
+            query = request.query.get('q', "")
+            songID = stableNumber(query.lower())
+            payload = {'response': {'sections': [{'type': 'lyric', 'hits': [{'type': 'song', 'result': {
+                'id': songID,
+                'title': " ".join(query.split()[:3]).title(),
+                'url': f"{self.baseUrl()}/genius/songs/{songID}",
+                'primary_artist': {'name': "Benchmark Artist"},
+            }}]}]}}
+        return self.web.json_response(payload)
+
+
+    async def geniusSongPage(self, request):
+        failure = await self.delayOrFail()
+        if failure:
+            return failure
+        songID = request.match_info['songID']
+        html = self.recorded(request, f"/songs/{songID}")
+        if html is None: # the same layout as a real Genius page, which is what parseLyricsPage looks for
+            lyricsHtml = fakeLyrics(songID).replace("\n", "<br/>")
+            html = f"<html><body><div data-lyrics-container=\"true\">[Verse 1]<br/>{lyricsHtml}</div></body></html>"
+        return self.web.Response(text=html, content_type="text/html")
+
+
+
+
+class FakeMessage: # what ctx.send returns, so commands that edit their message (like /artistmood) work too
+    def __init__(self, context):
+        self.context = context
+
+
+    async def edit(self, content=None, **kwargs): # recorded like another send
+        self.context.sent.append((content, kwargs.get('file')))
+
+
+
+
+class FakeContext: # stands in for discord's ctx so the command functions can run without discord
+    '''
+    Records everything the command sends. Has the few attributes the commands look at.
+    '''
+
+    def __init__(self, commandName, userID=1, guildID=None, channelID=1):
+        self.command = commandName
+        self.sent = [] # (content, file) for every ctx.send
+        self.author = type("FakeAuthor", (), {'id': userID, 'name': f"benchmark{userID}"})()
+        self.channel = type("FakeChannel", (), {'id': channelID, 'name': "general"})()
+        self.guild = type("FakeGuild", (), {'id': guildID})() if guildID is not None else None
+
+
+    async def send(self, content=None, **kwargs): # what ctx.send does, minus discord
+        self.sent.append((content, kwargs.get('file')))
+        return FakeMessage(self)
+
+
+
+
+def percentile(sortedValues, fraction): # the value below which `fraction` of the values fall (nearest rank)
+    if not sortedValues:
+        return 0.0
+    index = min(len(sortedValues) - 1, max(0, int(round(fraction * len(sortedValues) + 0.5)) - 1))
+    return sortedValues[index]
+
+
+
+def buildWorkload(requestCount, uniqueSongs, seed): # a list of (command name, arguments) like a busy server would send
+    randomGenerator = random.Random(seed)
+    songs = [(artist, song) for artist in benchmarkArtists for song in benchmarkSongs]
+    randomGenerator.shuffle(songs)
+    songs = songs[:max(1, uniqueSongs)]
+    commandNames = list(commandWeights)
+    workload = []
+    for _ in range(requestCount):
+        commandName = randomGenerator.choices(commandNames, weights=[commandWeights[name] for name in commandNames])[0]
+        artist, song = songs[min(int(randomGenerator.paretovariate(1.2)) - 1, len(songs) - 1)] # a few songs are much more popular than the rest
+        if commandName == "toptracks":
+            workload.append((commandName, tuple(artist.split())))
+        elif commandName == "searchlyrics":
+            workload.append((commandName, tuple(fakeLyrics(f"{artist} + {song}").split("\n")[0].split())))
+        else:
+            workload.append((commandName, tuple(f"{artist} + {song}".split())))
+    return workload
+
+
+
+async def runWorkload(musicBot, workload, concurrency): # runs the commands with `concurrency` of them going at once
+    queue = asyncio.Queue()
+    for requestNumber, item in enumerate(workload):
+        queue.put_nowait((requestNumber, item))
+    latencies = {} # command name -> list of seconds
+    failures = {} # command name -> count
+
+    async def worker():
+        while not queue.empty():
+            requestNumber, (commandName, arguments) = queue.get_nowait()
+            # a different person (and channel) each time, like a busy bot: so the per-user limits dont kick in, and we time
+            # the bot instead of one channel's line for discord's per channel message limit
+            context = FakeContext(commandName, userID=requestNumber, guildID=requestNumber % benchmarkGuilds, channelID=requestNumber)
+            startedAt = time.perf_counter()
+            try:
+                await getattr(musicBot, commandName).callback(context, *arguments) # .callback is the plain async function behind @bot.command()
+                latencies.setdefault(commandName, []).append(time.perf_counter() - startedAt)
+            except Exception as error:
+                failures[commandName] = failures.get(commandName, 0) + 1
+                print(f"{commandName} {' '.join(arguments)} failed: {error!r}")
+
+    startedAt = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, failures, time.perf_counter() - startedAt
+
+
+
+def summarize(latencies, failures, elapsedSeconds): # turns the raw timings into the report numbers
+    summary = {'commands': {}, 'elapsedSeconds': elapsedSeconds}
+    total = 0
+    for commandName in sorted(set(latencies) | set(failures)):
+        values = sorted(latencies.get(commandName, []))
+        total += len(values)
+        summary['commands'][commandName] = {
+            'count': len(values),
+            'failed': failures.get(commandName, 0),
+            'meanMs': statistics.fmean(values) * 1000 if values else 0.0,
+            'p50Ms': percentile(values, 0.50) * 1000,
+            'p95Ms': percentile(values, 0.95) * 1000,
+            'p99Ms': percentile(values, 0.99) * 1000,
+        }
+    summary['commandsPerSecond'] = total / elapsedSeconds if elapsedSeconds else 0.0
+    return summary
+
+
+
+def printSummary(summary, upstreamCounters, channelWaitSeconds):
+    print(f"\n{'command':<15}{'count':>7}{'failed':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for commandName, numbers in summary['commands'].items():
+        print(f"{commandName:<15}{numbers['count']:>7}{numbers['failed']:>8}{numbers['meanMs']:>10.1f}"
+              f"{numbers['p50Ms']:>10.1f}{numbers['p95Ms']:>10.1f}{numbers['p99Ms']:>10.1f}")
+    print(f"\n{summary['commandsPerSecond']:.1f} commands/sec over {summary['elapsedSeconds']:.2f}s, "
+          f"{upstreamCounters['requests']} upstream requests ({upstreamCounters['errors']} fake errors)")
+    print(f"{channelWaitSeconds:.2f}s spent waiting for discord's per channel message limit (included in the latencies above)")
+
+
+
+def compareToBaseline(summary, baselinePath, tolerance): # returns the list of commands whose p95 got slower than the baseline allows
+    with open(baselinePath) as baselineFile:
+        baseline = json.load(baselineFile)
+    regressions = []
+    for commandName, numbers in summary['commands'].items():
+        before = baseline.get('commands', {}).get(commandName)
+        if before and before['p95Ms'] > 0 and numbers['p95Ms'] > before['p95Ms'] * tolerance:
+            regressions.append(f"{commandName}: p95 {before['p95Ms']:.1f} ms -> {numbers['p95Ms']:.1f} ms")
+    return regressions
+
+
+
+async def main(options):
+    port = findFreePort()
+    # the helper files read these when they are imported, so they have to be set before importing musicBot
+    os.environ["SPOTIFY_API_BASE"] = f"http://127.0.0.1:{port}/spotify/v1"
+    os.environ["SPOTIFY_TOKEN_URL"] = f"http://127.0.0.1:{port}/spotify/token"
+    os.environ["GENIUS_API_BASE"] = f"http://127.0.0.1:{port}/genius"
+    os.environ["GENIUS_PUBLIC_API_BASE"] = f"http://127.0.0.1:{port}/genius-public"
+    os.environ.setdefault("SPOTIFY_CLIENT_ID", "benchmark")
+    os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "benchmark")
+    os.environ.setdefault("GENIUS_CLIENT_ACCESS_TOKEN", "benchmark")
+    if not options.warm_cache: # a fresh empty cache folder so the numbers include the upstream calls
+        os.environ["VIBECHECK_CACHE_DIR"] = tempfile.mkdtemp(prefix="vibecheck-benchmark-")
+
+    payloads = {}
+    if options.payloads:
+        with open(options.payloads) as payloadFile:
+            payloads = json.load(payloadFile)
+
+    upstream = FakeUpstream(port, options.latency_ms / 1000, options.error_rate, payloads, options.seed)
+    await upstream.start()
+
+    import musicBot # imported here, after the environment variables above are set
+    import executorHelper as eh
+    import httpHelper as hh
+    import rateLimitHelper as rl
+
+    try:
+        workload = buildWorkload(options.requests, options.unique_songs, options.seed)
+        latencies, failures, elapsedSeconds = await runWorkload(musicBot, workload, options.concurrency)
+    finally:
+        await hh.closeClient()
+        await upstream.stop()
+        eh.shutdown()
+
+    summary = summarize(latencies, failures, elapsedSeconds)
+    summary['options'] = vars(options)
+    summary['channelWaitSeconds'] = sum(limiter.counters['totalWaitSeconds'] for limiter in rl.channelLimiters.values())
+    printSummary(summary, upstream.counters, summary['channelWaitSeconds'])
+
+    if options.save:
+        with open(options.save, "w") as saveFile:
+            json.dump(summary, saveFile, indent=2)
+    if options.compare:
+        regressions = compareToBaseline(summary, options.compare, options.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 1 if any(failures.values()) and not options.error_rate else 0 # failures only count as a problem if we didnt ask for errors
+
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the bot's commands against fake Spotify/Genius/Discord.")
+    parser.add_argument("--requests", type=int, default=200, help="how many commands to run")
+    parser.add_argument("--concurrency", type=int, default=20, help="how many commands run at the same time")
+    parser.add_argument("--unique-songs", type=int, default=40, help="how many different songs the commands ask about")
+    parser.add_argument("--latency-ms", type=float, default=50, help="average fake upstream latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="chance of a fake 429/503 per upstream request")
+    parser.add_argument("--payloads", help="JSON file of recorded upstream responses to replay")
+    parser.add_argument("--warm-cache", action="store_true", help="use the normal cache folder instead of an empty one")
+    parser.add_argument("--seed", type=int, default=3510, help="random seed for the workload and the fake upstream")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=1.2, help="how much slower a p95 can get before --compare fails (1.2 = 20%%)")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,341 @@
+'''
+bulkScore.py
+
+This file scores the sentiment of a big list of songs from the command line, without Discord. It is for when
+you need numbers for thousands of songs (the analytics side of the project) instead of one song at a time in the
+chat or running cells by hand in functionTestsFinal.ipynb.
+
+It reads (artist, title) rows from a JSONL or CSV file one row at a time (so the list can be as long as you want),
+and for each song:
+    - fetches the lyrics with the same code the bot uses (geniusHelper.getLyricsAsync, the async version of
+      getLyrics), a few songs at a time (--concurrency). it goes through the same lyrics cache and Genius rate
+      limiter as the bot
+    - scores them with vaderHelper.analyzeLyricsBatch (analyzeLyrics for many songs at once) in batches of
+      --batch-size songs on the CPU process pool from executorHelper.py, while the next songs are being fetched
+    - writes one result per song to the output as it goes: a .jsonl file (one JSON object per line), or a
+      .parquet folder of part files if the output name ends in .parquet (needs pyarrow: pip install pyarrow)
+
+The output is also the checkpoint. If a run is stopped (Ctrl+C, a crash, the computer going to sleep), running the
+same command again reads the songs that are already in the output and skips them, so nothing finished gets
+fetched or scored again. Songs that were fetched but not written yet are still in the lyrics cache, so they dont
+go back to Genius either. Songs Genius doesnt have are written too (with "found": false) so they arent searched
+again. Songs that failed (Genius busy after every retry, network errors) are not written, so the next run tries
+them again.
+
+    python bulkScore.py songs.csv results.jsonl
+    python bulkScore.py songs.jsonl results.parquet --concurrency 16 --batch-size 128
+    python bulkScore.py songs.csv results.jsonl --artist-field "Artist Name" --title-field "Track Name" --chunks
+
+The input needs an artist and a title in every row (the columns/keys are "artist" and "title" unless you say
+otherwise). Each result has the song's key (the normalized "artist|title" the caches use), artist, title, found,
+averageCompound, label and chunkCount, plus every chunk's compound score with --chunks.
+
+The settings in the 3510.env file still apply (GENIUS_CLIENT_ACCESS_TOKEN, VIBECHECK_RATE_GENIUS, VIBECHECK_CPU_WORKERS,
+VIBECHECK_CACHE_DIR...).
+
+Parquet: https://arrow.apache.org/docs/python/parquet.html
+'''
+
+import argparse # reads the command line options
+import asyncio # fetches many songs at once
+import csv # reads CSV input
+import glob # finds the parquet part files that are already written
+import json # reads JSONL input and writes JSONL output
+import os # paths, and making sure written results are really on disk
+import sys # exit code
+import time # for the progress lines
+import cacheHelper as ch # the normalized song keys, which are also the checkpoint keys
+import executorHelper as eh # the CPU process pool that runs VADER
+import geniusHelper as ghf # lyrics, through the same cache and rate limiter as the bot
+import httpHelper as hh # closing the pooled HTTP client at the end
+import rateLimitHelper as rl # UpstreamBusyError when genius keeps refusing
+import vaderHelper as vh # the sentiment analysis
+
+progressSeconds = 10 # how often a progress line is printed
+rowsPerPart = 5000 # parquet results are written in part files of this many songs
+
+
+
+
+def readRows(inputPath, artistField, titleField): # generator of (artist, title) from a JSONL or CSV file, one row at a time
+    '''
+    args:
+        inputPath (str): a .csv file with a header row, or a .jsonl file with one JSON object per line
+        artistField (str): the column / key with the artist name
+        titleField (str): the column / key with the song title
+
+    yields:
+        tuple: (artist, title) for every row that has both (rows missing one are skipped with a warning)
+    '''
+    with open(inputPath, newline="", encoding="utf-8") as inputFile:
+        if inputPath.lower().endswith(".csv"):
+            rows = csv.DictReader(inputFile)
+        else:
+            rows = (json.loads(line) for line in inputFile if line.strip())
+        for rowNumber, row in enumerate(rows, start=1):
+            artistName = str(row.get(artistField) or "").strip()
+            songTitle = str(row.get(titleField) or "").strip()
+            if not artistName or not songTitle:
+                print(f"Skipping row {rowNumber}: it needs both {artistField!r} and {titleField!r}")
+                continue
+            yield artistName, songTitle
+
+
+
+def makeRecord(artistName, songTitle, sentimentResults, includeChunks): # one song's line of output
+    record = {
+        'key': ch.normalizeKey(artistName, songTitle),
+        'artist': artistName,
+        'title': songTitle,
+        'found': sentimentResults is not None,
+        'averageCompound': None,
+        'label': None,
+        'chunkCount': 0,
+    }
+    if sentimentResults is not None:
+        record['averageCompound'] = round(float(sentimentResults.averageCompound), 4)
+        record['label'] = vh.getSentimentLabel(sentimentResults.averageCompound)
+        record['chunkCount'] = len(sentimentResults.scores)
+    if includeChunks:
+        record['chunkCompound'] = [] if sentimentResults is None else [round(float(score), 4) for score in sentimentResults.scores[:, 3]]
+    return record
+
+
+
+
+class JsonlResults: # writes results to a .jsonl file, one song per line, and reads it back to resume
+    def __init__(self, outputPath):
+        self.outputPath = outputPath
+        self.outputFile = None
+
+
+    def completedKeys(self): # the songs already in the output. a half written last line (the run was killed mid-write) is cut off
+        keys = set()
+        if not os.path.exists(self.outputPath):
+            return keys
+        goodBytes = 0
+        with open(self.outputPath, "rb") as outputFile:
+            for line in outputFile:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    keys.add(json.loads(line)['key'])
+                except (ValueError, KeyError):
+                    break
+                goodBytes += len(line)
+        if goodBytes < os.path.getsize(self.outputPath):
+            with open(self.outputPath, "r+b") as outputFile:
+                outputFile.truncate(goodBytes)
+        return keys
+
+
+    def write(self, records): # adds a batch of results and makes sure they are on disk before we count them as done
+        if self.outputFile is None:
+            self.outputFile = open(self.outputPath, "a", encoding="utf-8")
+        self.outputFile.write("".join(json.dumps(record) + "\n" for record in records))
+        self.outputFile.flush()
+        os.fsync(self.outputFile.fileno())
+
+
+    def close(self):
+        if self.outputFile is not None:
+            self.outputFile.close()
+            self.outputFile = None
+
+
+
+
+class ParquetResults: # writes results into a folder of parquet part files, and reads their keys back to resume
+    '''
+    A parquet file is only readable once it is closed, so results are kept in memory until there are rowsPerPart
+    of them (or the run ends) and then written as a new part file. Each part is written under a temporary name and
+    renamed when it is complete, so a killed run never leaves a broken part behind. pyarrow and pandas read the
+    whole folder as one table: pandas.read_parquet("results.parquet")
+    '''
+
+    def __init__(self, outputPath, includeChunks):
+        try:
+            import pyarrow # only needed for parquet output, so it stays an optional install
+            import pyarrow.parquet
+        except ImportError:
+            sys.exit("Parquet output needs pyarrow (pip install pyarrow), or use a .jsonl output file instead")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.outputPath = outputPath
+        self.pending = []
+        columns = [
+            ('key', pyarrow.string()),
+            ('artist', pyarrow.string()),
+            ('title', pyarrow.string()),
+            ('found', pyarrow.bool_()),
+            ('averageCompound', pyarrow.float64()),
+            ('label', pyarrow.string()),
+            ('chunkCount', pyarrow.int32()),
+        ]
+        if includeChunks:
+            columns.append(('chunkCompound', pyarrow.list_(pyarrow.float32())))
+        self.schema = pyarrow.schema(columns)
+        os.makedirs(outputPath, exist_ok=True)
+
+
+    def partPaths(self):
+        return sorted(glob.glob(os.path.join(self.outputPath, "part-*.parquet")))
+
+
+    def completedKeys(self):
+        for leftover in glob.glob(os.path.join(self.outputPath, "*.tmp")): # a part that was being written when the run was killed
+            os.remove(leftover)
+        keys = set()
+        for partPath in self.partPaths():
+            keys.update(self.pq.read_table(partPath, columns=['key']).column('key').to_pylist())
+        return keys
+
+
+    def write(self, records):
+        self.pending.extend(records)
+        if len(self.pending) >= rowsPerPart:
+            self.writePart()
+
+
+    def writePart(self):
+        if not self.pending:
+            return
+        partNumber = len(self.partPaths())
+        partPath = os.path.join(self.outputPath, f"part-{partNumber:05d}.parquet")
+        self.pq.write_table(self.pa.Table.from_pylist(self.pending, schema=self.schema), partPath + ".tmp")
+        os.replace(partPath + ".tmp", partPath)
+        self.pending = []
+
+
+    def close(self):
+        self.writePart()
+
+
+
+
+async def scoreBatch(batch, results, counters, options): # scores a batch of fetched songs on the process pool and writes them
+    '''
+    args:
+        batch (list): (artistName, songTitle, lyrics) for each song, lyrics is None for songs genius doesnt have
+    '''
+    sentimentList = [await vh.getCachedSentimentAsync(lyrics, options.chunk_size) if lyrics else None for artistName, songTitle, lyrics in batch]
+    toScore = [position for position, (artistName, songTitle, lyrics) in enumerate(batch) if lyrics and sentimentList[position] is None]
+    if toScore:
+        scored = await eh.runCPU("vader", vh.analyzeLyricsBatch, [batch[position][2] for position in toScore], options.chunk_size) # one trip to a worker process for the whole batch
+        for position, sentimentResults in zip(toScore, scored):
+            if sentimentResults:
+                sentimentResults.lyrics = batch[position][2] # our copy of the lyrics, not the one that came back from the worker
+                await vh.cacheSentimentAsync(batch[position][2], sentimentResults, options.chunk_size)
+            sentimentList[position] = sentimentResults
+
+    records = [makeRecord(artistName, songTitle, sentimentResults, options.chunks) for (artistName, songTitle, lyrics), sentimentResults in zip(batch, sentimentList)]
+    await asyncio.to_thread(results.write, records) # fsync and parquet writes block, keep them off the event loop
+    counters['scored'] += sum(1 for record in records if record['found'])
+    counters['notFound'] += sum(1 for record in records if not record['found'])
+
+
+
+async def scoreAll(options, results): # the whole run: read rows -> fetch lyrics -> score in batches -> write
+    counters = {'skipped': 0, 'scored': 0, 'notFound': 0, 'failed': 0}
+    seenKeys = await asyncio.to_thread(results.completedKeys) # everything already in the output counts as done
+    rowQueue = asyncio.Queue(maxsize=options.concurrency * 2) # the reader stays just ahead of the fetchers, the rest of the file stays on disk
+    batch = [] # fetched songs waiting to be scored
+    scoringTasks = set()
+    scoringSlots = asyncio.Semaphore(max(eh.backendLimits['vader'], 1) * 2) # at most this many batches scored or waiting at once, so fetching cant run far ahead
+    print(f"{len(seenKeys)} songs already done in {options.output}")
+
+    async def readInput():
+        for artistName, songTitle in readRows(options.input, options.artist_field, options.title_field):
+            songKey = ch.normalizeKey(artistName, songTitle)
+            if songKey in seenKeys: # already in the output, or a repeat of a row earlier in this file
+                counters['skipped'] += 1
+                continue
+            seenKeys.add(songKey)
+            await rowQueue.put((artistName, songTitle))
+        for fetcherNumber in range(options.concurrency):
+            await rowQueue.put(None) # tells each fetcher there is nothing left
+
+    async def startScoring(songs):
+        await scoringSlots.acquire()
+        task = asyncio.create_task(scoreBatch(songs, results, counters, options))
+        scoringTasks.add(task)
+        task.add_done_callback(lambda finished: (scoringTasks.discard(finished), scoringSlots.release()))
+
+    async def fetchSongs():
+        while True:
+            row = await rowQueue.get()
+            if row is None:
+                return
+            artistName, songTitle = row
+            try:
+                lyrics = await ghf.getLyricsAsync(artistName, songTitle)
+            except rl.UpstreamBusyError as error:
+                counters['failed'] += 1
+                print(f"Failed {artistName} - {songTitle}: {error} (it will be tried again next run)")
+                continue
+            except Exception as error: # one bad song shouldnt stop the run
+                counters['failed'] += 1
+                print(f"Failed {artistName} - {songTitle}: {error!r} (it will be tried again next run)")
+                continue
+            batch.append((artistName, songTitle, lyrics))
+            if len(batch) >= options.batch_size:
+                songs = batch[:]
+                batch.clear()
+                await startScoring(songs)
+
+    async def reportProgress():
+        startedAt = time.monotonic()
+        while True:
+            await asyncio.sleep(progressSeconds)
+            finished = counters['scored'] + counters['notFound']
+            print(f"{finished} songs written ({counters['scored']} scored, {counters['notFound']} not on genius), "
+                  f"{counters['failed']} failed, {finished / (time.monotonic() - startedAt):.1f} songs/sec")
+
+    reporter = asyncio.create_task(reportProgress())
+    try:
+        await asyncio.gather(readInput(), *(fetchSongs() for fetcherNumber in range(options.concurrency)))
+        if batch:
+            await startScoring(batch[:])
+        while scoringTasks:
+            await asyncio.gather(*scoringTasks) # an error while scoring or writing stops the run (whatever was written stays written)
+    finally:
+        reporter.cancel()
+        if scoringTasks: # stopped early: let the batches already being scored finish so their results get written
+            await asyncio.gather(*scoringTasks, return_exceptions=True)
+    return counters
+
+
+
+async def main(options):
+    if options.output.lower().endswith(".parquet"):
+        results = ParquetResults(options.output, options.chunks)
+    else:
+        results = JsonlResults(options.output)
+    startedAt = time.perf_counter()
+    try:
+        counters = await scoreAll(options, results)
+    finally:
+        results.close() # writes the last parquet part, even when the run is stopped with Ctrl+C
+        await hh.closeClient()
+        eh.shutdown()
+    print(f"Done in {time.perf_counter() - startedAt:.1f}s: {counters['scored']} scored, {counters['notFound']} not on genius, "
+          f"{counters['failed']} failed, {counters['skipped']} skipped (already done or repeated)")
+    return 1 if counters['failed'] else 0 # 1 tells a script to run it again for the failed songs
+
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch lyrics and score the sentiment of every song in a JSONL/CSV file.")
+    parser.add_argument("input", help="a .csv (with a header row) or .jsonl file of songs")
+    parser.add_argument("output", help="results.jsonl, or results.parquet for a folder of parquet files (needs pyarrow)")
+    parser.add_argument("--artist-field", default="artist", help="the input column / key with the artist name")
+    parser.add_argument("--title-field", default="title", help="the input column / key with the song title")
+    parser.add_argument("--concurrency", type=int, default=8, help="how many songs' lyrics are fetched at the same time")
+    parser.add_argument("--batch-size", type=int, default=64, help="how many songs are scored together in one worker process call")
+    parser.add_argument("--chunk-size", type=int, default=10, help="words per chunk, like analyzeLyrics")
+    parser.add_argument("--chunks", action="store_true", help="also write every chunk's compound score")
+    try:
+        sys.exit(asyncio.run(main(parser.parse_args())))
+    except KeyboardInterrupt:
+        sys.exit("Stopped. Run the same command again to pick up where it left off.")
@@ -0,0 +1,558 @@
+'''
+cacheHelper.py
+
+This helper file has a small two tier cache that the other helper files use so we dont keep asking
+Genius and Spotify for the same thing over and over.
+
+    tier 1: an in-memory LRU (least recently used) dictionary. super fast, but it goes away when the bot restarts
+    tier 2: an SQLite file on disk. a little slower, but it survives restarts
+
+When something is looked up we check memory first, then disk, and only if both miss does the caller
+go to the API. Every entry has a TTL (time to live) so old data eventually gets fetched again, and
+both tiers have a size cap so the cache cant grow forever.
+
+We also cache "not found" answers (negative caching) with a shorter TTL, so someone spamming a
+misspelled song doesnt cost a Genius search every single time.
+
+Caches that hold big values (like rendered PNGs) can use a byte budget instead of (or as well as) an item
+count: maxMemoryBytes and maxDiskBytes evict the least recently used entries until the total size fits.
+
+A cache can also keep entries around for a while after they stop being fresh (staleSeconds). lookup()
+hands those back marked as stale, so a caller can answer right away with the old value and refresh it
+in the background (this is called stale-while-revalidate).
+
+When the bot runs as several shard processes (see shardHelper.py) they all share tier 2, so a song one shard
+fetched is a disk hit for every other shard. Tier 2 can be:
+    VIBECHECK_CACHE_BACKEND=sqlite  (default) the SQLite files in the cache folder, in WAL mode so many processes
+                                    can read while one writes
+    VIBECHECK_CACHE_BACKEND=redis   any server that speaks the Redis protocol (Redis, Valkey, KeyDB...), at
+                                    VIBECHECK_REDIS_URL (default redis://127.0.0.1:6379/0). needs: pip install redis
+With the redis backend the disk item and byte caps arent used, set maxmemory and maxmemory-policy allkeys-lru
+on the server instead. Entries still expire on their own TTL.
+
+Shared caches also hand out leases (claim/release), which singleFlightHelper.py uses so that two shards asking
+for the same song at the same moment dont both go to Genius: one fetches, the other waits for it in the cache.
+
+Tier 2 is blocking I/O (a locked SQLite file can make a write wait for seconds, a slow Redis server up to its
+socket timeout), so code running on the event loop uses the async versions of the methods (getAsync, lookupAsync,
+setAsync...): the memory tier is checked right away, and only a memory miss or a write goes to tier 2, in a thread.
+The memory tier has its own lock that is never held during tier 2 I/O, so a slow tier 2 never holds up a memory hit.
+
+Python docs:
+    OrderedDict (for the LRU): https://docs.python.org/3/library/collections.html#collections.OrderedDict
+    sqlite3: https://docs.python.org/3/library/sqlite3.html
+    SQLite WAL mode: https://www.sqlite.org/wal.html
+    Redis SET NX (for the leases): https://redis.io/docs/latest/commands/set/
+'''
+
+import asyncio # the async methods run tier 2 in a thread so the event loop doesnt wait on the disk or redis
+import os # operating system module for making the cache folder
+import pickle # turns python objects into bytes so we can store them in SQLite
+import re # regular expressions for cleaning up keys
+import socket # the host name goes in the lease owner, so shards on different machines dont look the same
+import struct # packs the expiry time in front of values stored in redis
+import sys # sys.getsizeof for rough memory sizes
+import sqlite3 # the on-disk database that comes with python
+import threading # the executor runs helpers from several threads, so the cache needs a lock
+import time # for TTLs
+import unicodedata # for removing accents when normalizing keys
+import uuid # makes the lease owner unique even if a process ID gets reused
+from collections import OrderedDict # a dictionary that remembers order, which makes an LRU easy
+
+# folder where the on-disk caches live, can be changed in the 3510.env file
+cacheDirectory = os.getenv("VIBECHECK_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"))
+
+cacheBackend = os.getenv("VIBECHECK_CACHE_BACKEND", "sqlite") # where tier 2 lives: "sqlite" or "redis"
+redisUrl = os.getenv("VIBECHECK_REDIS_URL", "redis://127.0.0.1:6379/0")
+# True when other processes use the same tier 2 (shardHelper.py sets this for every shard), turns on the leases
+sharedAcrossProcesses = os.getenv("VIBECHECK_SHARED_CACHE", "1" if cacheBackend == "redis" else "0") == "1"
+sqliteBusySeconds = 5.0 # how long a write waits for another process to finish its write before giving up
+lruTouchSeconds = 60.0 # a disk read only writes the row's new lastUsed if the old one is older than this (so most reads dont write)
+
+leaseOwner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}" # who holds a lease, so we only ever release our own
+
+allCaches = [] # every TwoTierCache that has been made, so metricsHelper.py can report all of their hit rates
+
+
+
+
+def normalizeKey(*parts): # turns something like ("Mac Miller ", "Blue World!") into "mac miller|blue world"
+    '''
+    Build a cache key from any number of strings so small differences in how a user types
+    an artist or song (capital letters, accents, extra spaces, punctuation) still hit the same entry.
+
+    args:
+        *parts (str): the pieces of the key, for example artistName and songTitle
+
+    returns:
+        str: the normalized key with each part joined by "|"
+
+    example:
+        normalizeKey("Beyoncé", "  Halo ") == normalizeKey("beyonce", "HALO")
+    '''
+    cleanedParts = []
+    for part in parts: # loop through each piece of the key
+        text = unicodedata.normalize("NFKD", str(part)) # splits letters like é into e + an accent mark
+        text = "".join(character for character in text if not unicodedata.combining(character)) # drops the accent marks
+        text = re.sub(r"[^\w\s]", "", text.casefold()) # lowercases (casefold also handles things like ß) and removes punctuation
+        cleanedParts.append(" ".join(text.split())) # collapses repeated spaces and trims the ends
+    return "|".join(cleanedParts)
+
+
+
+
+def sizeOf(value): # rough size of a cached value in bytes, exact for bytes and strings which is what the byte budgets are for
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+
+
+class SqliteBackend: # tier 2 as one SQLite file per cache in the cache folder
+    '''
+    Every backend has the same methods, so TwoTierCache doesnt care where tier 2 lives:
+        read(key, now) -> (value bytes or None, expiresAt) or None if the key isnt there
+        write(key, blob, expiresAt, keepUntil, now, maxItems, maxBytes) -> how many entries were evicted
+        claim(key, owner, seconds) -> True if we got the lease
+        release(key, owner)
+        clear()
+    TwoTierCache holds its backendLock around all of these (never the memory tier's lock).
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.connection = None # the SQLite connection is opened the first time we need it
+
+
+    def getConnection(self): # opens the SQLite file the first time it is needed
+        if self.connection is None:
+            os.makedirs(cacheDirectory, exist_ok=True) # make the cache folder if it isnt there yet
+            path = os.path.join(cacheDirectory, f"{self.name}.sqlite3")
+            self.connection = sqlite3.connect(path, check_same_thread=False, timeout=sqliteBusySeconds) # we guard it with our own lock so other threads can use it
+            self.connection.execute("PRAGMA journal_mode=WAL") # readers in other shard processes dont block on our writes (and the other way around)
+            self.connection.execute("PRAGMA synchronous=NORMAL") # safe with WAL, and a lot fewer fsyncs. a power cut can lose the last few cache writes, which is fine
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expiresAt REAL, lastUsed REAL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS cacheLastUsed ON cache (lastUsed)") # makes finding the least recently used rows fast
+            self.connection.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT, expiresAt REAL)")
+            self.connection.commit()
+        return self.connection
+
+
+    def read(self, key, now):
+        connection = self.getConnection()
+        row = connection.execute("SELECT value, expiresAt, lastUsed FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if now - row[2] > lruTouchSeconds: # keeps the disk LRU order up to date, to the minute (a write on every read would queue behind other shards' writes)
+            connection.execute("UPDATE cache SET lastUsed = ? WHERE key = ?", (now, key))
+            connection.commit()
+        return row[0], row[1]
+
+
+    def write(self, key, blob, expiresAt, keepUntil, now, maxItems, maxBytes):
+        connection = self.getConnection()
+        evictions = 0
+        connection.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expiresAt, lastUsed) VALUES (?, ?, ?, ?)",
+            (key, blob, expiresAt, now),
+        )
+        # size cap for the disk tier: delete the least recently used rows that go over the limit
+        cursor = connection.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY lastUsed DESC LIMIT -1 OFFSET ?)",
+            (maxItems,),
+        )
+        evictions += max(cursor.rowcount, 0)
+        if maxBytes is not None: # byte budget: keep the most recently used rows whose running total fits
+            cursor = connection.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM (SELECT key, SUM(IFNULL(LENGTH(value), 0)) "
+                "OVER (ORDER BY lastUsed DESC, key) AS runningBytes FROM cache) WHERE runningBytes > ?)",
+                (maxBytes,),
+            )
+            evictions += max(cursor.rowcount, 0)
+        connection.commit()
+        return evictions
+
+
+    def claim(self, key, owner, seconds): # takes the lease on key unless someone else holds one that hasnt run out
+        connection = self.getConnection()
+        now = time.time()
+        connection.execute("DELETE FROM leases WHERE key = ? AND expiresAt <= ?", (key, now)) # a lease whose owner died
+        cursor = connection.execute("INSERT OR IGNORE INTO leases (key, owner, expiresAt) VALUES (?, ?, ?)", (key, owner, now + seconds))
+        connection.commit()
+        return cursor.rowcount == 1
+
+
+    def release(self, key, owner):
+        connection = self.getConnection()
+        connection.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner))
+        connection.commit()
+
+
+    def clear(self):
+        connection = self.getConnection()
+        connection.execute("DELETE FROM cache")
+        connection.commit()
+
+
+
+
+class RedisBackend: # tier 2 on a server that speaks the Redis protocol, shared by every shard (even on other machines)
+    '''
+    Each entry is one redis string, "vibecheck:<cache name>:<key>", holding the expiry time and then the pickled
+    value. Redis deletes it by itself once it is too old even to be stale. Leases are "vibecheck:lease:<cache name>:<key>".
+    '''
+
+    headerFormat = "<d?" # expiresAt, then whether there is a value (False = a "not found" entry)
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.client = None # connected the first time we need it
+
+
+    def getClient(self):
+        if self.client is None:
+            import redis # only needed for this backend, so it stays an optional install
+            self.client = redis.Redis.from_url(self.url, socket_timeout=2, socket_connect_timeout=2)
+        return self.client
+
+
+    def read(self, key, now):
+        data = self.getClient().get(f"vibecheck:{self.name}:{key}")
+        if data is None:
+            return None
+        expiresAt, hasValue = struct.unpack_from(self.headerFormat, data)
+        return (data[struct.calcsize(self.headerFormat):] if hasValue else None), expiresAt
+
+
+    def write(self, key, blob, expiresAt, keepUntil, now, maxItems, maxBytes): # the size caps are the server's job (maxmemory)
+        data = struct.pack(self.headerFormat, expiresAt, blob is not None) + (blob or b"")
+        self.getClient().set(f"vibecheck:{self.name}:{key}", data, px=max(int((keepUntil - now) * 1000), 1))
+        return 0
+
+
+    def claim(self, key, owner, seconds):
+        return bool(self.getClient().set(f"vibecheck:lease:{self.name}:{key}", owner, nx=True, px=int(seconds * 1000)))
+
+
+    def release(self, key, owner):
+        leaseKey = f"vibecheck:lease:{self.name}:{key}"
+        if self.getClient().get(leaseKey) == owner.encode("utf-8"): # only our own lease (if it ran out, someone else may have it now)
+            self.getClient().delete(leaseKey)
+
+
+    def clear(self):
+        client = self.getClient()
+        for redisKey in client.scan_iter(match=f"vibecheck:{self.name}:*", count=500):
+            client.delete(redisKey)
+
+
+
+
+def makeBackend(name): # the tier 2 backend picked by VIBECHECK_CACHE_BACKEND
+    if cacheBackend == "redis":
+        return RedisBackend(name, redisUrl)
+    if cacheBackend != "sqlite":
+        raise ValueError(f"VIBECHECK_CACHE_BACKEND should be sqlite or redis, not {cacheBackend!r}")
+    return SqliteBackend(name)
+
+
+
+def backendErrorTypes(): # errors from tier 2 that shouldnt break a command (the cache just acts like it missed)
+    errorTypes = (sqlite3.OperationalError,) # "database is locked" if another shard held the write lock for too long
+    if cacheBackend == "redis":
+        import redis
+        errorTypes += (redis.RedisError,) # server down, timeouts
+    return errorTypes
+
+
+
+
+class TwoTierCache: # the cache object, one per kind of data (lyrics, artist ids, etc.)
+    '''
+    In-memory LRU in front of a shared tier 2 (an SQLite table, or a Redis server, see the top of this file).
+
+    args:
+        name (str): name of the cache, also used as the SQLite file name (for example "lyrics")
+        ttlSeconds (float): how long a found value stays fresh
+        negativeTtlSeconds (float): how long a "not found" answer is remembered
+        maxMemoryItems (int): size cap for the in-memory tier
+        maxDiskItems (int): size cap for the on-disk tier
+        persist (bool): set to False for a memory only cache
+        staleSeconds (float): how long an entry is kept after its TTL runs out so lookup() can still return it as stale
+        maxMemoryBytes (int): optional byte budget for the in-memory tier
+        maxDiskBytes (int): optional byte budget for the on-disk tier
+
+    example:
+        lyricsCache = TwoTierCache("lyrics", ttlSeconds=30 * 24 * 3600)
+        found, lyrics = lyricsCache.get(normalizeKey(artistName, songTitle))
+    '''
+
+    def __init__(self, name, ttlSeconds=3600, negativeTtlSeconds=600, maxMemoryItems=500, maxDiskItems=20000, persist=True, staleSeconds=0,
+                 maxMemoryBytes=None, maxDiskBytes=None):
+        self.name = name
+        self.ttlSeconds = ttlSeconds
+        self.staleSeconds = staleSeconds
+        self.negativeTtlSeconds = negativeTtlSeconds
+        self.maxMemoryItems = maxMemoryItems
+        self.maxDiskItems = maxDiskItems
+        self.persist = persist
+        self.maxMemoryBytes = maxMemoryBytes
+        self.maxDiskBytes = maxDiskBytes
+        self.memory = OrderedDict() # key -> (value, expiresAt, size in bytes), the most recently used keys are at the end
+        self.memoryBytes = 0 # total size of everything in the memory tier
+        self.lock = threading.Lock() # guards the memory tier and the counters, never held during tier 2 I/O
+        self.backendLock = threading.Lock() # one tier 2 call at a time (the SQLite connection is shared between threads)
+        self.backend = makeBackend(name) if persist else None # tier 2, nothing is connected until the first lookup
+        self.counters = {'memoryHits': 0, 'diskHits': 0, 'misses': 0, 'negativeHits': 0, 'staleHits': 0, 'evictions': 0, 'sets': 0, 'backendErrors': 0}
+        allCaches.append(self)
+
+
+    def count(self, counterName, amount=1): # bumps a counter from outside the memory lock
+        with self.lock:
+            self.counters[counterName] += amount
+
+
+    def readBackend(self, key, now): # tier 2 read that counts an error as a miss (blocking, the async methods run it in a thread)
+        try:
+            with self.backendLock:
+                return self.backend.read(key, now)
+        except backendErrorTypes() as error:
+            self.count('backendErrors')
+            print(f"{self.name} cache: tier 2 read failed ({error})")
+            return None
+
+
+    def writeBackend(self, key, blob, expiresAt, now): # tier 2 write, an error just means the other shards wont see it (blocking)
+        try:
+            with self.backendLock:
+                evictions = self.backend.write(key, blob, expiresAt, expiresAt + self.staleSeconds, now, self.maxDiskItems, self.maxDiskBytes)
+            self.count('evictions', evictions)
+        except backendErrorTypes() as error: # the value is still in memory
+            self.count('backendErrors')
+            print(f"{self.name} cache: tier 2 write failed ({error})")
+
+
+    def get(self, key): # looks a key up in memory, then on disk
+        '''
+        returns:
+            tuple: (found, value). found is False on a miss or when the entry expired.
+                   value can be None when found is True, which means "we already know this doesnt exist"
+        '''
+        found, value, isStale = self.lookup(key)
+        if isStale: # get() only hands out fresh values
+            return False, None
+        return found, value
+
+
+    async def getAsync(self, key): # get() for code on the event loop
+        found, value, isStale = await self.lookupAsync(key)
+        if isStale:
+            return False, None
+        return found, value
+
+
+    def lookup(self, key): # like get(), but also returns entries that are stale (past their TTL but inside staleSeconds)
+        '''
+        returns:
+            tuple: (found, value, isStale). isStale is True when the value is past its TTL and should be refreshed
+        '''
+        now = time.time()
+        answer = self.lookupMemory(key, now)
+        if answer is not None:
+            return answer
+        row = self.readBackend(key, now) if self.persist else None
+        return self.finishLookup(key, row, now)
+
+
+    async def lookupAsync(self, key): # lookup() for code on the event loop: a memory hit answers right away, tier 2 is read in a thread
+        now = time.time()
+        answer = self.lookupMemory(key, now)
+        if answer is not None:
+            return answer
+        row = await asyncio.to_thread(self.readBackend, key, now) if self.persist else None
+        return self.finishLookup(key, row, now)
+
+
+    def lookupMemory(self, key, now): # tier 1 part of lookup(), returns lookup()'s answer on a hit or None to go on to tier 2
+        with self.lock:
+            if key in self.memory:
+                value, expiresAt, size = self.memory[key]
+                if expiresAt + self.staleSeconds > now: # fresh, or stale but still usable
+                    self.memory.move_to_end(key) # mark it as most recently used
+                    return self.countHit('memoryHits', value, expiresAt, now)
+                del self.memory[key] # too old even to be stale, throw it away
+                self.memoryBytes -= size
+        return None
+
+
+    def finishLookup(self, key, row, now): # tier 2 part of lookup(), row is what readBackend found (or None)
+        value = None
+        if row and row[1] + self.staleSeconds > now: # found and still usable
+            value = pickle.loads(row[0]) if row[0] is not None else None # None is stored as NULL for negative entries
+        with self.lock:
+            if key in self.memory and self.memory[key][1] + self.staleSeconds > now: # someone stored it while we were reading tier 2, theirs is newer
+                self.memory.move_to_end(key)
+                return self.countHit('memoryHits', self.memory[key][0], self.memory[key][1], now)
+            if row and row[1] + self.staleSeconds > now:
+                self.rememberInMemory(key, value, row[1]) # promote it so the next lookup is a memory hit
+                return self.countHit('diskHits', value, row[1], now)
+            self.counters['misses'] += 1
+            return False, None, False
+
+
+    def set(self, key, value, ttlSeconds=None): # stores a found value
+        self.store(key, value, ttlSeconds if ttlSeconds is not None else self.ttlSeconds)
+
+
+    async def setAsync(self, key, value, ttlSeconds=None): # set() for code on the event loop
+        await self.storeAsync(key, value, ttlSeconds if ttlSeconds is not None else self.ttlSeconds)
+
+
+    def setMissing(self, key): # stores a "not found" answer with the shorter negative TTL
+        self.store(key, None, self.negativeTtlSeconds)
+
+
+    async def setMissingAsync(self, key):
+        await self.storeAsync(key, None, self.negativeTtlSeconds)
+
+
+    def store(self, key, value, ttlSeconds): # writes to both tiers
+        blob, expiresAt, now = self.storeInMemory(key, value, ttlSeconds)
+        if self.persist:
+            self.writeBackend(key, blob, expiresAt, now)
+
+
+    async def storeAsync(self, key, value, ttlSeconds): # store() for code on the event loop, the tier 2 write happens in a thread
+        blob, expiresAt, now = self.storeInMemory(key, value, ttlSeconds)
+        if self.persist:
+            await asyncio.to_thread(self.writeBackend, key, blob, expiresAt, now)
+
+
+    def storeInMemory(self, key, value, ttlSeconds): # the memory part of store(), returns what the tier 2 write needs
+        now = time.time()
+        expiresAt = now + ttlSeconds
+        with self.lock:
+            self.counters['sets'] += 1
+            self.rememberInMemory(key, value, expiresAt)
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL) if self.persist and value is not None else None
+        return blob, expiresAt, now
+
+
+    def peek(self, key): # get() without touching the hit/miss counters, used while waiting for another shard to fill a key
+        '''
+        returns:
+            tuple: (found, value) for a fresh entry in memory or tier 2
+        '''
+        now = time.time()
+        answer = self.peekMemory(key, now)
+        if answer is not None:
+            return answer
+        return self.finishPeek(key, self.readBackend(key, now) if self.persist else None, now)
+
+
+    async def peekAsync(self, key): # peek() for code on the event loop
+        now = time.time()
+        answer = self.peekMemory(key, now)
+        if answer is not None:
+            return answer
+        return self.finishPeek(key, await asyncio.to_thread(self.readBackend, key, now) if self.persist else None, now)
+
+
+    def peekMemory(self, key, now):
+        with self.lock:
+            if key in self.memory and self.memory[key][1] > now:
+                return True, self.memory[key][0]
+        return None
+
+
+    def finishPeek(self, key, row, now):
+        if not row or row[1] <= now:
+            return False, None
+        value = pickle.loads(row[0]) if row[0] is not None else None
+        with self.lock:
+            self.rememberInMemory(key, value, row[1])
+        return True, value
+
+
+    def claim(self, key, seconds): # tries to become the one process that fills this key
+        '''
+        returns:
+            bool: True if nobody else holds the lease (or the cache isnt shared), so the caller should do the fetch.
+                  False if another process is fetching it right now, so the caller should wait and peek()
+        '''
+        if not self.persist:
+            return True
+        try:
+            with self.backendLock:
+                return self.backend.claim(key, leaseOwner, seconds)
+        except backendErrorTypes():
+            self.count('backendErrors')
+            return True # cant tell, fetching it twice is better than not at all
+
+
+    async def claimAsync(self, key, seconds): # claim() for code on the event loop
+        if not self.persist:
+            return True
+        return await asyncio.to_thread(self.claim, key, seconds)
+
+
+    def release(self, key): # gives the lease back once the value is stored (or the fetch failed)
+        if not self.persist:
+            return
+        try:
+            with self.backendLock:
+                self.backend.release(key, leaseOwner)
+        except backendErrorTypes(): # it runs out on its own
+            self.count('backendErrors')
+
+
+    async def releaseAsync(self, key): # release() for code on the event loop
+        if self.persist:
+            await asyncio.to_thread(self.release, key)
+
+
+    def rememberInMemory(self, key, value, expiresAt): # puts an entry in the memory tier and enforces its size caps (self.lock must be held)
+        if key in self.memory: # replacing an entry, take the old one out of the byte total
+            self.memoryBytes -= self.memory[key][2]
+        size = sizeOf(value)
+        self.memory[key] = (value, expiresAt, size)
+        self.memoryBytes += size
+        self.memory.move_to_end(key) # newest entries go to the end
+        while len(self.memory) > self.maxMemoryItems or (self.maxMemoryBytes is not None and self.memoryBytes > self.maxMemoryBytes and len(self.memory) > 1):
+            oldKey, (oldValue, oldExpiresAt, oldSize) = self.memory.popitem(last=False) # too big, drop from the front (least recently used)
+            self.memoryBytes -= oldSize
+            self.counters['evictions'] += 1
+
+
+    def countHit(self, counterName, value, expiresAt, now): # bumps the right hit counter and builds lookup()'s answer (lock must be held)
+        isStale = expiresAt <= now # past its TTL
+        if isStale:
+            self.counters['staleHits'] += 1
+        else:
+            self.counters[counterName] += 1
+            if value is None: # it was a "not found" entry
+                self.counters['negativeHits'] += 1
+        return True, value, isStale
+
+
+    def stats(self): # returns a copy of the hit/miss counters plus the hit rate
+        with self.lock:
+            stats = dict(self.counters)
+            stats['memoryItems'] = len(self.memory)
+            stats['memoryBytes'] = self.memoryBytes
+        lookups = stats['memoryHits'] + stats['diskHits'] + stats['staleHits'] + stats['misses']
+        stats['hitRate'] = (stats['memoryHits'] + stats['diskHits']) / lookups if lookups else 0.0 # avoids dividing by zero before the first lookup
+        return stats
+
+
+    def clear(self): # empties both tiers
+        with self.lock:
+            self.memory.clear()
+            self.memoryBytes = 0
+        if self.persist:
+            with self.backendLock:
+                self.backend.clear()
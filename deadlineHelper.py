@@ -0,0 +1,223 @@
+'''
+deadlineHelper.py
+
+This helper file makes sure one slow Spotify or Genius request cant leave someone waiting forever.
+
+Genius song pages have a long tail: most load in well under a second, a few take many seconds, and before this
+nothing put a limit on the whole wait (just a timeout on each single request, and every retry started a new one).
+So now:
+    - every command gets a latency budget (VIBECHECK_BUDGET_SECONDS, or its own VIBECHECK_BUDGET_<COMMAND>).
+      it is set when the command starts (after the admission line in admissionHelper.py) and follows the command
+      into every helper it calls, the same way the priority in rateLimitHelper.py does: each HTTP request's
+      timeout shrinks to the time that is left, rateLimitHelper doesnt start a retry it has no time to wait for,
+      and the slow steps of a command are cut off with within() when the budget runs out
+    - hedged requests: a Genius or Spotify GET that is still running after that API's recent p95 latency gets a
+      second copy sent. whichever answers first wins and the other one is cancelled. a hedge is only sent if the
+      rate limiter has a token free right now, and hedges are kept to VIBECHECK_HEDGE_FRACTION of the requests
+    - stale fallback: when the budget runs out (or the API is busy), the commands answer with lyrics cached
+      earlier that are past their TTL, with a note that they might be out of date, instead of waiting. the lyrics
+      and sentiment caches keep entries around after they expire for this (LYRICS_CACHE_STALE_SECONDS,
+      SENTIMENT_CACHE_STALE_SECONDS)
+
+The shared fetches keep going after a command gives up on them (singleFlightHelper shields them and runs them
+without the deadline of the command that started them), so the next person to ask usually gets a fresh answer
+from the cache. Background refreshes are started the same way.
+
+Settings in the 3510.env file:
+    VIBECHECK_DEADLINES=1               set to 0 to turn the budgets off
+    VIBECHECK_BUDGET_SECONDS=12         the budget for commands without their own, VIBECHECK_BUDGET_ARTISTMOOD=30 and so on
+    VIBECHECK_HEDGE=1                   set to 0 to turn hedged requests off
+    VIBECHECK_HEDGE_PERCENTILE=0.95     a request slower than this share of recent ones gets a hedge
+    VIBECHECK_HEDGE_FRACTION=0.1        at most this share of an API's requests can be hedges
+
+The Tail at Scale (hedged requests): https://research.google/pubs/the-tail-at-scale/
+'''
+
+import asyncio # the budgets and hedges are asyncio timeouts and tasks
+import collections # deque for the recent latencies
+import contextlib # for the deadline() context manager
+import contextvars # the deadline follows a command through every function it calls (and tasks it starts)
+import functools # functools.wraps keeps the command's name and arguments so discord.py still understands it
+import math # inf for "no deadline"
+import os # operating system module for accessing environment variables
+import time # deadlines are time.monotonic() values
+
+deadlinesEnabled = os.getenv("VIBECHECK_DEADLINES", "1") == "1"
+defaultBudgetSeconds = float(os.getenv("VIBECHECK_BUDGET_SECONDS", "12"))
+hedgingEnabled = os.getenv("VIBECHECK_HEDGE", "1") == "1"
+hedgePercentile = float(os.getenv("VIBECHECK_HEDGE_PERCENTILE", "0.95"))
+hedgeFraction = float(os.getenv("VIBECHECK_HEDGE_FRACTION", "0.1"))
+minimumHedgeSamples = 20 # no hedges until an API has this many timed requests to take the p95 of
+minimumHedgeSeconds = 0.05 # never hedge sooner than this, even if the API is usually faster
+graceSeconds = 2.0 # local work (VADER) still gets this long after the budget is gone, so stale lyrics can be scored
+
+# the commands that usually take longer get more time. VIBECHECK_BUDGET_<COMMAND> overrides any of these
+commandBudgets = {"toptracks": 8.0, "searchlyrics": 10.0, "sentimentplot": 15.0, "artistmood": 30.0}
+
+# when the current command has to be done by (a time.monotonic() value), None outside of a command
+currentDeadline = contextvars.ContextVar("vibecheckDeadline", default=None)
+counters = {'budgetsRunOut': 0, 'staleServed': 0, 'hedgesSent': 0, 'hedgesWon': 0}
+
+
+
+
+class DeadlineExceeded(Exception): # raised by within() when the command's budget runs out before the step finishes
+    def __init__(self, stage):
+        super().__init__(f"ran out of time waiting for {stage}")
+        self.stage = stage # "genius", "spotify", "vader"...
+
+
+
+
+class LatencyTracker: # the latencies of an API's most recent requests, for the hedge delay
+    '''
+    example:
+        tracker = LatencyTracker()
+        tracker.observe(0.21)
+        tracker.percentile(0.95) # None until there are minimumHedgeSamples
+    '''
+
+    def __init__(self, size=500):
+        self.samples = collections.deque(maxlen=size)
+        self.sortedSamples = [] # a sorted copy, made again every `recomputeEvery` new samples instead of on every request
+        self.newSamples = 0
+        self.recomputeEvery = 25
+
+
+    def observe(self, seconds):
+        self.samples.append(seconds)
+        self.newSamples += 1
+
+
+    def percentile(self, fraction): # the latency `fraction` of recent requests were faster than, or None if we dont know yet
+        if len(self.samples) < minimumHedgeSamples:
+            return None
+        if self.newSamples >= self.recomputeEvery or not self.sortedSamples:
+            self.sortedSamples = sorted(self.samples)
+            self.newSamples = 0
+        return self.sortedSamples[min(int(fraction * len(self.sortedSamples)), len(self.sortedSamples) - 1)]
+
+
+
+
+def budgetFor(commandName): # how many seconds a command gets
+    return float(os.getenv(f"VIBECHECK_BUDGET_{commandName.upper()}", commandBudgets.get(commandName, defaultBudgetSeconds)))
+
+
+
+def remaining(): # seconds left in the current command's budget (inf outside of a command, like the prewarmer or bulkScore.py)
+    deadlineAt = currentDeadline.get()
+    if deadlineAt is None:
+        return math.inf
+    return deadlineAt - time.monotonic()
+
+
+
+def requestTimeout(defaultSeconds): # the timeout for one HTTP request: the normal one, or less if the budget is almost gone
+    return min(defaultSeconds, max(remaining(), minimumHedgeSeconds))
+
+
+
+@contextlib.contextmanager
+def deadline(seconds): # everything inside has to be done within `seconds` (or sooner, if an outer deadline ends first)
+    '''
+    example:
+        with dh.deadline(12):
+            lyrics = await dh.within(ghf.getLyricsAsync(artistName, songTitle), "genius")
+    '''
+    deadlineAt = time.monotonic() + seconds
+    outerDeadline = currentDeadline.get()
+    if outerDeadline is not None:
+        deadlineAt = min(deadlineAt, outerDeadline)
+    token = currentDeadline.set(deadlineAt)
+    try:
+        yield
+    finally:
+        currentDeadline.reset(token)
+
+
+
+def budgeted(commandFunction): # decorator that gives a command its latency budget
+    '''
+    goes UNDER @ah.admitted, so waiting in the admission line doesnt use up the budget:
+
+        @bot.command()
+        @mh.timedCommand
+        @ah.admitted
+        @dh.budgeted
+        async def lyrics(ctx, *args):
+    '''
+    budgetSeconds = budgetFor(commandFunction.__name__)
+
+    @functools.wraps(commandFunction)
+    async def budgetedVersion(ctx, *args, **kwargs):
+        if not deadlinesEnabled:
+            return await commandFunction(ctx, *args, **kwargs)
+        with deadline(budgetSeconds):
+            return await commandFunction(ctx, *args, **kwargs)
+
+    return budgetedVersion
+
+
+
+async def within(awaitable, stage, atLeast=0.0): # waits for a step, but only until the budget runs out
+    '''
+    args:
+        awaitable: the step, like ghf.getLyricsAsync(artistName, songTitle)
+        stage (str): what we were waiting for, for the error ("genius", "spotify", "vader"...)
+        atLeast (float): give the step at least this long even if the budget is (nearly) gone
+
+    returns:
+        whatever the step returns. raises DeadlineExceeded if the budget ran out first (the step is cancelled,
+        shared fetches keep going in the background and fill the cache)
+    '''
+    seconds = max(remaining(), atLeast)
+    if math.isinf(seconds):
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, max(seconds, 0.0))
+    except asyncio.TimeoutError:
+        counters['budgetsRunOut'] += 1
+        raise DeadlineExceeded(stage) from None
+
+
+
+async def hedge(makeAttempt, hedgeAfterSeconds, mayHedge): # runs a request, and a second copy of it if the first is slow. first answer wins
+    '''
+    args:
+        makeAttempt (function): makeAttempt() returns a new coroutine that makes the request once
+        hedgeAfterSeconds (float): how long the first try gets before a hedge is considered, None to never hedge
+        mayHedge (function): called when the first try is slow, returns True if a hedge may be sent (and takes its rate limit token)
+
+    returns:
+        the result of whichever try finished first without an error (the other one is cancelled).
+        if both fail, the first error is raised
+    '''
+    firstTry = asyncio.ensure_future(makeAttempt())
+    if not hedgingEnabled or hedgeAfterSeconds is None:
+        return await firstTry
+    try:
+        done, pending = await asyncio.wait({firstTry}, timeout=max(hedgeAfterSeconds, minimumHedgeSeconds))
+    except asyncio.CancelledError:
+        firstTry.cancel()
+        raise
+    if done or not mayHedge():
+        return await firstTry
+
+    counters['hedgesSent'] += 1
+    hedgeTry = asyncio.ensure_future(makeAttempt())
+    pending = {firstTry, hedgeTry}
+    firstError = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for finishedTry in done:
+                if finishedTry.exception() is None:
+                    if finishedTry is hedgeTry:
+                        counters['hedgesWon'] += 1
+                    return finishedTry.result()
+                firstError = firstError or finishedTry.exception()
+        raise firstError
+    finally:
+        for unfinishedTry in pending: # the loser (or both, if we were cancelled)
+            unfinishedTry.cancel()
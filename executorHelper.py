@@ -0,0 +1,153 @@
+'''
+executorHelper.py
+
+This helper file moves CPU heavy work off of the bot's event loop. Every command in musicBot.py used
+to call spotifyHelper, geniusHelper and vaderHelper functions directly inside the async handlers, so
+one slow Genius scrape froze the whole bot (heartbeats, other servers, everything).
+
+VADER scoring and matplotlib rendering run in a process pool here, since the GIL would serialize them in threads.
+
+Spotify and Genius requests dont need a pool: the async functions in spotifyHelper.py and geniusHelper.py wait
+on the network without blocking the event loop, and send every request through rl.call, which takes one rate
+limit token per request and retries 429s. The sync spotipy / lyricsgenius functions make several requests per
+call with their own retries, so they would get around the rate limiter. they are only for scripts and the notebook.
+
+Each backend ("vader", "plot") also gets its own concurrency limit so one busy backend can't eat every
+worker, and we keep simple counters (queued, running, completed, failed, wait time) so we can see how
+deep the queues are getting.
+
+Pool sizes and limits can be changed with environment variables in the 3510.env file:
+    VIBECHECK_CPU_WORKERS=4
+    VIBECHECK_LIMIT_VADER=4 (and VIBECHECK_LIMIT_PLOT)
+
+Python docs for the executors: https://docs.python.org/3/library/concurrent.futures.html
+'''
+
+import asyncio # lets us await work that is running in another thread or process
+import functools # functools.partial lets us pass keyword arguments through run_in_executor
+import os # operating system module for accessing environment variables
+import time # for timing how long work waits in the queue and how long it runs
+from concurrent.futures import ProcessPoolExecutor # the worker pool
+
+# how many worker processes the pool gets
+cpuWorkerCount = int(os.getenv("VIBECHECK_CPU_WORKERS", str(os.cpu_count() or 2))) # one process per core is plenty for CPU work
+
+# how many calls each backend is allowed to have running at the same time
+backendLimits = {
+    "vader": int(os.getenv("VIBECHECK_LIMIT_VADER", str(cpuWorkerCount))), # never more vader jobs than cpu workers
+    "plot": int(os.getenv("VIBECHECK_LIMIT_PLOT", str(cpuWorkerCount))), # same for matplotlib renders
+}
+defaultBackendLimit = 4 # used for any backend name that isnt in the dictionary above
+
+# the pool is made the first time it is needed so importing this file is cheap
+cpuPool = None # ProcessPoolExecutor for CPU work
+
+backendSemaphores = {} # backend name -> asyncio.Semaphore that enforces backendLimits
+backendStats = {} # backend name -> dictionary of counters (see newStats below)
+
+
+
+
+def newStats(): # makes an empty set of counters for one backend
+    return {
+        'queued': 0, # calls waiting for a free slot right now (the queue depth)
+        'running': 0, # calls running right now
+        'completed': 0, # calls that finished without an error
+        'failed': 0, # calls that raised an exception
+        'maxQueued': 0, # the deepest the queue has ever been
+        'totalWaitSeconds': 0.0, # total time calls spent waiting for a slot
+        'totalRunSeconds': 0.0, # total time calls spent actually running
+    }
+
+
+
+def getCPUPool(): # returns the shared process pool, making it if needed
+    global cpuPool # we are changing the module level variable, not making a local one
+    if cpuPool is None: # first time anyone asked for it
+        cpuPool = ProcessPoolExecutor(max_workers=cpuWorkerCount)
+    return cpuPool
+
+
+
+def getSemaphore(backend): # returns the semaphore that limits how many calls a backend can run at once
+    if backend not in backendSemaphores: # first call for this backend
+        limit = backendLimits.get(backend, defaultBackendLimit) # use the configured limit or the default one
+        backendSemaphores[backend] = asyncio.Semaphore(limit) # only `limit` calls can hold the semaphore at a time
+        backendStats.setdefault(backend, newStats()) # make the counters for this backend too
+    return backendSemaphores[backend]
+
+
+
+async def runInPool(pool, backend, func, *args, **kwargs): # the logic behind runCPU
+    '''
+    Wait for a free slot for this backend, then run func(*args, **kwargs) in the given pool.
+
+    args:
+        pool (Executor): the pool to run the work in
+        backend (str): name of the backend, used for the concurrency limit and the counters
+        func (callable): the blocking function to run
+        *args, **kwargs: passed straight through to func
+
+    returns:
+        whatever func returns (exceptions raised by func are raised here too)
+    '''
+    semaphore = getSemaphore(backend) # the limit for this backend
+    stats = backendStats[backend] # the counters for this backend
+
+    stats['queued'] += 1 # we are waiting in line now
+    stats['maxQueued'] = max(stats['maxQueued'], stats['queued']) # remember the worst queue depth we have seen
+    queuedAt = time.perf_counter() # start the wait timer
+    try:
+        await semaphore.acquire() # waits here (without blocking the event loop) until a slot frees up
+    finally:
+        stats['queued'] -= 1 # we are out of the line either way (even if the command got cancelled)
+
+    startedAt = time.perf_counter() # start the run timer
+    stats['totalWaitSeconds'] += startedAt - queuedAt # add how long we waited in line
+    stats['running'] += 1
+    try:
+        loop = asyncio.get_running_loop() # the bot's event loop
+        result = await loop.run_in_executor(pool, functools.partial(func, *args, **kwargs)) # runs the function in the pool and lets the loop do other things meanwhile
+        stats['completed'] += 1
+        return result
+    except Exception:
+        stats['failed'] += 1
+        raise # let the command decide what to tell the user
+    finally:
+        stats['running'] -= 1
+        stats['totalRunSeconds'] += time.perf_counter() - startedAt # add how long it ran
+        semaphore.release() # give the slot to the next call in line
+
+
+
+async def runCPU(backend, func, *args, **kwargs): # use this for CPU heavy calls (vader, matplotlib)
+    '''
+    Run a CPU heavy function (like vh.analyzeLyrics) in the process pool.
+    The function and its arguments have to be picklable, so pass module level functions and plain data.
+
+    example:
+        sentimentResults = await eh.runCPU("vader", vh.analyzeLyrics, lyrics)
+    '''
+    return await runInPool(getCPUPool(), backend, func, *args, **kwargs)
+
+
+
+def getMetrics(): # returns a copy of the counters for every backend
+    '''
+    returns:
+        dict: backend name -> dictionary with 'queued', 'running', 'completed', 'failed', 'maxQueued',
+              'totalWaitSeconds', 'totalRunSeconds' and the backend's 'limit'
+    '''
+    metrics = {}
+    for backend, stats in backendStats.items(): # loop through every backend that has been used so far
+        metrics[backend] = dict(stats) # copy so callers cant change our counters by accident
+        metrics[backend]['limit'] = backendLimits.get(backend, defaultBackendLimit)
+    return metrics
+
+
+
+def shutdown(): # stops the pool, call this when the bot is closing
+    global cpuPool
+    if cpuPool is not None:
+        cpuPool.shutdown(wait=False, cancel_futures=True)
+        cpuPool = None
@@ -9,23 +9,89 @@ and search for songs.
 '''
 
 import os # operating system module for accessing environment variables
+import array # the token stream is packed arrays of offsets instead of lists of tuples
+import bisect # finds the last line that fits on a page
+import itertools # works out the word offsets from the word lengths
+import operator # operator.add for the word end offsets
+import asyncio # for the async version of getLyrics
+import re # regular expressions for cleaning scraped lyrics
 from dotenv import load_dotenv # loads environment variables from .env file
-from lyricsgenius import Genius # imports the LyricsGenius library which is a wrapper for the Genius API
+from bs4 import BeautifulSoup, NavigableString # HTML parser (installed with lyricsgenius), used to scrape lyrics in the async version
+import cacheHelper as ch # our two tier (memory + disk) cache
+import httpHelper as hh # shared pooled async HTTP client
+import singleFlightHelper as sfh # shares one fetch between identical requests that arrive at the same time
+import lyricsIndexHelper as lih # local search index that /searchlyrics checks before asking genius
+import metricsHelper as mh # times the genius search, page download and parsing for the latency histograms
+import rateLimitHelper as rl # keeps our requests under genius's rate limit and retries 429s
+import startupHelper as suh # times the lazy lyricsgenius setup when the startup profile is turned on
+import threading # the executor can ask for the client from several threads at once
 
 # load up the 3510.env file, has all my access tokens etc
 load_dotenv("3510.env") # loads our Genius access token from the 3510.env file
 
-# initialize Genius API client with access token
-genius = Genius(os.getenv("GENIUS_CLIENT_ACCESS_TOKEN")) # creates the Genius API client object using our access token 
+# the lyricsgenius client is only made the first time a sync function needs it (see getGenius below),
+# so starting the bot doesnt wait on it
+genius = None
+geniusLock = threading.Lock()
 
 # exclude remixes and live versions from search results
 # this helps clean up results and get original versions
 # snippet from: https://lyricsgenius.readthedocs.io/en/master/examples/snippets.html#searching-for-a-song-by-lyrics
-genius.excluded_terms = ["(Remix)", "(Live)"] # tells Genius to skip songs with these terms in the title, so we get original versions
+excludedTerms = ["(Remix)", "(Live)"] # tells Genius to skip songs with these terms in the title, so we get original versions
+
+# cache for lyrics so /lyrics, /sentiment and /sentimentplot on the same song only hit Genius once
+# lyrics basically never change so they can live for a long time, "not found" answers are only kept for a bit
+# in case the song gets added to Genius later. all of these can be changed in the 3510.env file
+lyricsCache = ch.TwoTierCache(
+    "lyrics",
+    ttlSeconds=float(os.getenv("LYRICS_CACHE_TTL", 30 * 24 * 3600)), # 30 days
+    negativeTtlSeconds=float(os.getenv("LYRICS_CACHE_NEGATIVE_TTL", 3600)), # 1 hour
+    maxMemoryItems=int(os.getenv("LYRICS_CACHE_MEMORY_ITEMS", 500)), # about a few MB of lyrics in memory
+    maxDiskItems=int(os.getenv("LYRICS_CACHE_DISK_ITEMS", 50000)),
+    staleSeconds=float(os.getenv("LYRICS_CACHE_STALE_SECONDS", 60 * 24 * 3600)), # kept 60 more days after that, for when genius is too slow to wait for (getStaleLyricsAsync)
+)
+
+# the async functions call the Genius API and song pages directly through httpHelper instead of through lyricsgenius
+geniusApiBase = os.getenv("GENIUS_API_BASE", "https://api.genius.com") # can point at a local stand-in for testing
+geniusPublicApiBase = os.getenv("GENIUS_PUBLIC_API_BASE", "https://genius.com/api") # the website's own API, where the lyric search lives (same one lyricsgenius uses)
+
+# genius song ID -> the lyricsCache key its lyrics are under, so a /searchlyrics result (which comes with its ID)
+# can go straight to the lyrics without searching genius again. tiny entries, and a song's ID never changes
+songKeyCache = ch.TwoTierCache(
+    "genius_song_keys",
+    ttlSeconds=float(os.getenv("LYRICS_CACHE_TTL", 30 * 24 * 3600)), # as long as the lyrics they point at
+    maxMemoryItems=5000,
+    maxDiskItems=200000,
+)
+
+# if 30 people ask for the same song before the first fetch finishes, they all wait on that one fetch
+lyricsFlight = sfh.SingleFlight("lyrics", cache=lyricsCache) # with shards, the other processes wait on it too
+
+# all the page junk normalizeLyrics takes out, in one regular expression so the raw lyrics are only searched once.
+# section headers (group 1) just disappear, everything else becomes a line break (the junk is often glued between two lines)
+lyricsJunkPattern = re.compile(r"""
+    \A[^\n]*?Contributors?[^\n]*?Lyrics                # "12 ContributorsTranslationsBlue World Lyrics" at the very start
+  | You\ might\ also\ like                             # the related songs box
+  | See\ [^\n]*?LiveGet\ tickets\ as\ low\ as\ \$\d+     # the concert tickets ad
+  | \d*Embed\s*\Z                                      # "123Embed" at the very end
+  | (\[[^\]\n]*\])                                     # [Chorus], [Verse 1: Mac Miller]
+""", re.VERBOSE)
+
+
+def getGenius(): # returns the lyricsgenius client, making it the first time
+    global genius # we are changing the module level variable, not making a local one
+    with geniusLock:
+        if genius is None:
+            with suh.timed("lyricsgenius client"):
+                from lyricsgenius import Genius # imports the LyricsGenius library which is a wrapper for the Genius API
+                # initialize Genius API client with access token
+                genius = Genius(os.getenv("GENIUS_CLIENT_ACCESS_TOKEN")) # creates the Genius API client object using our access token 
+                genius.excluded_terms = excludedTerms
+                # remove section headers like [Chorus], [Verse 1], etc. from lyrics
+                # makes the lyrics cleaner for sentiment analysis
+                genius.remove_section_headers = True # removes the [Chorus], [Verse 1] tags from lyrics to make them cleaner for analysis
+    return genius
 
-# remove section headers like [Chorus], [Verse 1], etc. from lyrics
-# makes the lyrics cleaner for sentiment analysis
-genius.remove_section_headers = True # removes the [Chorus], [Verse 1] tags from lyrics to make them cleaner for analysis
 
 
 def getLyrics(artistName, songTitle): # defines function that takes artist name and song title as inputs
@@ -34,27 +100,318 @@ def getLyrics(artistName, songTitle): # defines function that takes artist name
     
     * this uses the Genius.search_song() method to find and retrieve lyrics.
     * this is documented at: https://lyricsgenius.readthedocs.io/en/master/examples/snippets.html#searching-for-a-song
+    * results (including "not found") are cached in lyricsCache, so asking for the same song again doesnt hit Genius
     
     args:
         artistName (str): The name of the artist
         songTitle (str): The title of the song
     
     returns:
-        str: the lyrics as a string, or None if the song is not found or an error comes up
+        LyricsText: the lyrics as a string (with their token stream, see normalizeLyrics), or None if the song is not found or an error comes up
     
     Example:
         lyrics = getLyrics("Mac Miller", "Blue World")
     '''
+    cacheKey = ch.normalizeKey(artistName, songTitle) # "Mac Miller", "Blue World" and "mac miller", "blue world" share an entry
+    found, cachedLyrics = lyricsCache.get(cacheKey) # checks memory, then the disk cache
+    if found: # we already know the answer (cachedLyrics is None if we already know the song isnt on Genius)
+        return upgradeCachedLyrics(cacheKey, cachedLyrics)
    
-    song = genius.search_song(songTitle, artistName) # searches Genius for the song, returns a song object or None if not found
+    song = getGenius().search_song(songTitle, artistName) # searches Genius for the song, returns a song object or None if not found
+    lyrics = normalizeLyrics(song.lyrics) if song else None # drops the page junk and splits it into words, once
     
-    if song: # checks if a song was found (song will be None if not found)
-        return song.lyrics # returns the lyrics as a string from the song object
+    if lyrics: # checks if a song was found (song will be None if not found)
+        lyricsCache.set(cacheKey, lyrics) # remember the lyrics (and their token stream) for next time
+        lih.addSong(song.artist, song.title, lyrics) # and make them searchable for /searchlyrics
+        return lyrics # returns the cleaned lyrics, still a string
     else: # if no song was found
+        lyricsCache.setMissing(cacheKey) # remember that it wasnt found so we dont search again right away
         return None # returns None so we can handle this error in the main bot file
 
 
 
+class LyricsText(str): # lyrics that carry the token stream normalizeLyrics made for them
+    '''
+    A normal string, so everything that already used lyrics as a string keeps working, with two extras:
+        tokenSpans: array of start, end, start, end... for every word (split on whitespace, like str.split())
+        lineEnds: array of where each line ends (there are no blank lines)
+
+    It gets cached and pickled (to the CPU worker processes) with the lyrics, so the sentiment analysis, the
+    lyrics search index and the discord pages all use these instead of splitting the text again.
+    '''
+
+    def spans(self): # the (start, end) of every word
+        return list(zip(self.tokenSpans[0::2], self.tokenSpans[1::2]))
+
+
+    def words(self): # every word. normalized lyrics have exactly one space or line break between words, so this is just split()
+        return self.split()
+
+
+    def __sizeof__(self): # so the cache's memory budget counts the token stream too
+        return super().__sizeof__() + sum(offsets.itemsize * len(offsets) for offsets in (self.tokenSpans, self.lineEnds))
+
+
+
+
+class SongHit(tuple): # a search result: (song title, artist name) like before, plus where genius keeps the song
+    '''
+    Still a 2 item tuple, so "for title, artist in results" keeps working, with two extras:
+        songID: the genius song ID (None for results from the local lyrics index)
+        url: the song page the lyrics are scraped from
+
+    example:
+        songTitle, artistName = hit
+        lyrics = await ghf.getLyricsByIDAsync(hit.songID, artistName, songTitle, hit.url)
+    '''
+
+    def __new__(cls, songTitle, artistName, songID=None, url=None):
+        hit = super().__new__(cls, (songTitle, artistName))
+        hit.songID = songID
+        hit.url = url
+        return hit
+
+
+    def __reduce__(self): # tuple subclasses need this to pickle (or copy) with their extras
+        return (SongHit, (self[0], self[1], self.songID, self.url))
+
+
+
+
+def normalizeLyrics(rawLyrics): # cleans scraped lyrics and makes their token stream
+    '''
+    Genius lyrics come with junk from the page: the "X Contributors ... Lyrics" header, "You might also like",
+    a ticket ad, "123Embed" at the end, and section headers like [Chorus]. This drops all of it (one pass of
+    lyricsJunkPattern), puts one space between words and one line break between lines (no blank lines), and
+    records where every word and line is. Because there is exactly one character between words, the offsets
+    are worked out from the word lengths instead of searching the text again.
+
+    args:
+        rawLyrics (str): lyrics from lyricsgenius or the song page
+
+    returns:
+        LyricsText: the cleaned lyrics with their token stream, or None if nothing is left
+
+    example:
+        normalizeLyrics("3 ContributorsBlue World Lyrics[Verse 1]\\nIt's a blue world\\n\\nYou might also like12Embed") == "It's a blue world"
+    '''
+    if rawLyrics is None:
+        return None
+    text = lyricsJunkPattern.sub(lambda match: " " if match.group(1) else "\n", rawLyrics)
+    lines = [" ".join(line.split()) for line in text.split("\n")] # one space between words, no spaces at the ends
+    lines = [line for line in lines if line] # no blank lines
+    if not lines:
+        return None
+    lyrics = LyricsText("\n".join(lines))
+    offsetType = "H" if len(lyrics) < 65536 else "I" # 2 byte offsets are enough for pretty much every song
+    wordLengths = [len(word) for word in lyrics.split()]
+    wordStarts = list(itertools.accumulate([length + 1 for length in wordLengths[:-1]], initial=0)) # each word starts one past the end of the last one
+    lyrics.tokenSpans = array.array(offsetType, itertools.chain.from_iterable(zip(wordStarts, map(operator.add, wordStarts, wordLengths))))
+    lyrics.lineEnds = array.array(offsetType, itertools.islice(itertools.accumulate([len(line) + 1 for line in lines], initial=-1), 1, None)) # the same for lines, minus the line break at the end
+    return lyrics
+
+
+
+def upgradeCachedLyrics(cacheKey, lyrics): # lyrics cached before the normalizer get cleaned up (and their token stream made) once, then cached again
+    if lyrics is None or isinstance(lyrics, LyricsText):
+        return lyrics
+    lyrics = normalizeLyrics(lyrics)
+    if lyrics:
+        lyricsCache.set(cacheKey, lyrics)
+    return lyrics
+
+
+
+async def upgradeCachedLyricsAsync(cacheKey, lyrics): # async version of upgradeCachedLyrics
+    if lyrics is None or isinstance(lyrics, LyricsText):
+        return lyrics
+    lyrics = normalizeLyrics(lyrics)
+    if lyrics:
+        await lyricsCache.setAsync(cacheKey, lyrics)
+    return lyrics
+
+
+
+async def getStaleLyricsAsync(artistName, songTitle, songID=None): # lyrics cached earlier even if they are past their TTL, for when genius is too slow to wait for
+    '''
+    returns:
+        LyricsText: the lyrics we had for this song (maybe out of date), or None if we never had them
+    '''
+    found, cacheKey = await songKeyCache.getAsync(str(songID)) if songID is not None else (False, None)
+    if not found or cacheKey is None:
+        cacheKey = ch.normalizeKey(artistName, songTitle)
+    found, lyrics, isStale = await lyricsCache.lookupAsync(cacheKey)
+    if not found or lyrics is None:
+        return None
+    return lyrics if isinstance(lyrics, LyricsText) else normalizeLyrics(lyrics) # not cached again, they are still stale
+
+
+
+def cleanForMatching(text): # same idea as lyricsgenius's clean_str: lowercase with no punctuation, for comparing names
+    return ch.normalizeKey(text).replace(" ", "")
+
+
+
+def isLyricsResult(result): # False for search hits that arent real songs with lyrics (tracklists, instrumentals, remixes...)
+    if result.get('lyrics_state', 'complete') != 'complete' or result.get('instrumental'): # unreleased songs and instrumentals have no lyrics
+        return False
+    title = result.get('title', '').lower()
+    return not any(term.lower() in title for term in excludedTerms) # same excluded terms as the lyricsgenius client
+
+
+
+def pickSongFromHits(hits, artistName, songTitle): # picks the best search hit, like genius.search_song does
+    '''
+    Prefer a hit where both the title and the artist match, then one where just the artist matches,
+    then the top hit. Hits that arent songs with lyrics are skipped.
+
+    returns:
+        dict: the song result from the Genius API, or None
+    '''
+    songs = [hit['result'] for hit in hits if hit.get('type', 'song') == 'song' and isLyricsResult(hit['result'])]
+    wantedArtist = cleanForMatching(artistName)
+    wantedTitle = cleanForMatching(songTitle)
+    for song in songs: # exact match first
+        if cleanForMatching(song['title']) == wantedTitle and cleanForMatching(song['primary_artist']['name']) == wantedArtist:
+            return song
+    for song in songs: # then anything by the right artist
+        if cleanForMatching(song['primary_artist']['name']) == wantedArtist:
+            return song
+    return songs[0] if songs else None # otherwise the top hit, if there is one
+
+
+
+def parseLyricsPage(html): # pulls the lyrics text out of a Genius song page, the same way lyricsgenius's Genius.lyrics() does
+    '''
+    args:
+        html (str): the song page HTML
+
+    returns:
+        LyricsText: the lyrics (with section headers and page junk removed by normalizeLyrics), or None
+    '''
+    soup = BeautifulSoup(html, "html.parser")
+    for header in soup.find_all("div", class_=re.compile("LyricsHeader")): # the "X Contributors" header inside the lyrics box
+        header.decompose()
+    containers = soup.find_all("div", attrs={"data-lyrics-container": "true"}) # genius splits the lyrics over several of these
+    if not containers:
+        return None
+    for br in soup.find_all("br"): # line breaks are <br> tags in the HTML
+        br.replace_with(NavigableString("\n"))
+    lyrics = ""
+    for container in containers:
+        if not container.contents:
+            lyrics += "\n"
+        for element in container.contents:
+            if isinstance(element, NavigableString):
+                lyrics += str(element)
+            elif element.get("data-exclude-from-selection") != "true": # skips the little annotation widgets
+                lyrics += element.get_text()
+    return normalizeLyrics(lyrics) # removes [Chorus], [Verse 1], the gaps between verses and the rest of the junk, and splits it into words
+
+
+
+async def searchSongAsync(artistName, songTitle): # async search against the Genius API
+    with mh.span("genius_search"):
+        response = await rl.call(
+            "genius",
+            hh.getJSON,
+            f"{geniusApiBase}/search",
+            params={'q': f"{songTitle} {artistName}".strip()}, # same search term lyricsgenius uses
+            headers={'Authorization': f"Bearer {os.getenv('GENIUS_CLIENT_ACCESS_TOKEN')}"},
+        )
+    return pickSongFromHits(response['response']['hits'], artistName, songTitle)
+
+
+
+async def getLyricsAsync(artistName, songTitle): # async version of getLyrics
+    '''
+    Same as getLyrics, but awaitable and running on the shared pooled HTTP client in httpHelper.py.
+    Uses the same lyricsCache, so sync and async callers share results, and identical requests that
+    arrive while a fetch is already running share that fetch (lyricsFlight).
+
+    returns:
+        LyricsText: the lyrics (a string with its token stream), or None if the song is not found
+
+    example:
+        lyrics = await ghf.getLyricsAsync("Mac Miller", "Blue World")
+    '''
+    cacheKey = ch.normalizeKey(artistName, songTitle)
+    found, cachedLyrics = await lyricsCache.getAsync(cacheKey)
+    if found:
+        return await upgradeCachedLyricsAsync(cacheKey, cachedLyrics)
+    return await lyricsFlight.do(cacheKey, fetchLyricsAsync, cacheKey, artistName, songTitle)
+
+
+
+async def fetchLyricsAsync(cacheKey, artistName, songTitle): # the actual Genius search + scrape behind getLyricsAsync
+    song = await searchSongAsync(artistName, songTitle)
+    lyrics = None
+    if song:
+        with mh.span("genius_page"):
+            html = await rl.call("genius", hh.getText, song['url']) # the lyrics arent in the API, we have to scrape the song page
+        with mh.span("lyrics_parse"):
+            lyrics = await asyncio.to_thread(parseLyricsPage, html) # parsing a big page takes a moment, so do it off the event loop
+
+    if lyrics:
+        await lyricsCache.setAsync(cacheKey, lyrics)
+        await songKeyCache.setAsync(str(song['id']), cacheKey) # a later lookup by this song's ID finds these lyrics
+        await asyncio.to_thread(lih.addSong, song['primary_artist']['name'], song['title'], lyrics) # genius's spelling of the names, for /searchlyrics results
+    else:
+        await lyricsCache.setMissingAsync(cacheKey)
+    return lyrics
+
+
+
+async def getLyricsByIDAsync(songID, artistName, songTitle, url=None): # getLyricsAsync for a song we already know the genius ID of
+    '''
+    For picking a /searchlyrics result: the search already told us exactly which song it is, so this skips the
+    fuzzy search (which can even land on a different song) and goes straight to the song page. Same lyricsCache
+    and lyricsFlight as getLyricsAsync, so a song fetched either way is found the other way too.
+
+    args:
+        songID (int): the genius song ID (SongHit.songID)
+        artistName (str), songTitle (str): the names from the search result, the cache key if we havent seen this ID
+        url (str): the song page (SongHit.url). without it we ask the API for the song first
+
+    returns:
+        LyricsText: the lyrics, or None if the page has no lyrics
+
+    example:
+        lyrics = await ghf.getLyricsByIDAsync(hit.songID, hit[1], hit[0], hit.url)
+    '''
+    found, cacheKey = await songKeyCache.getAsync(str(songID))
+    if not found or cacheKey is None:
+        cacheKey = ch.normalizeKey(artistName, songTitle)
+    found, cachedLyrics = await lyricsCache.getAsync(cacheKey)
+    if found and cachedLyrics is not None: # a cached "not found" came from a name search, the ID can still work
+        return await upgradeCachedLyricsAsync(cacheKey, cachedLyrics)
+    return await lyricsFlight.do(cacheKey, fetchLyricsByIDAsync, cacheKey, songID, artistName, songTitle, url, acceptMissing=False) # a "not found" from a name search isnt our answer
+
+
+
+async def fetchLyricsByIDAsync(cacheKey, songID, artistName, songTitle, url): # the song page scrape behind getLyricsByIDAsync (no search)
+    if url is None:
+        with mh.span("genius_song"):
+            response = await rl.call(
+                "genius",
+                hh.getJSON,
+                f"{geniusApiBase}/songs/{songID}",
+                headers={'Authorization': f"Bearer {os.getenv('GENIUS_CLIENT_ACCESS_TOKEN')}"},
+            )
+        url = response['response']['song']['url']
+    with mh.span("genius_page"):
+        html = await rl.call("genius", hh.getText, url)
+    with mh.span("lyrics_parse"):
+        lyrics = await asyncio.to_thread(parseLyricsPage, html)
+
+    if lyrics:
+        await lyricsCache.setAsync(cacheKey, lyrics)
+        await songKeyCache.setAsync(str(songID), cacheKey)
+        await asyncio.to_thread(lih.addSong, artistName, songTitle, lyrics)
+    return lyrics # a page with no lyrics isnt cached as "not found", that would hide the song from a later name search too
+
+
+
 def searchByLyrics(lyricSnippet, maxResults=5): # defines function that takes a lyric snippet and optional max results (default is 5)
     '''
     Search for songs by a snippet of lyrics.
@@ -67,7 +424,8 @@ def searchByLyrics(lyricSnippet, maxResults=5): # defines function that takes a
         maxResults (int): Maximum number of results to return (default: 5)
     
     returns:
-        list: A list of tuples containing (song_title, artist_name), or None if no results found
+        list: A list of SongHit tuples containing (song_title, artist_name), with the genius song ID and page URL
+              as hit.songID and hit.url, or None if no results found
     
     example:
         results = searchByLyrics("Jeremy can we talk a minute?")
@@ -83,8 +441,29 @@ def searchByLyrics(lyricSnippet, maxResults=5): # defines function that takes a
     # for hit in request['sections'][0]['hits']:
     #     print(hit['result']['title'])
     
-    request = genius.search_lyrics(lyricSnippet) # searches Genius for songs containing the lyric snippet, returns a complex nested dictionary
-    
+    request = getGenius().search_lyrics(lyricSnippet) # searches Genius for songs containing the lyric snippet, returns a complex nested dictionary
+    return songHitsFromLyricSearch(request, maxResults)
+
+
+
+async def searchByLyricsAsync(lyricSnippet, maxResults=5): # async version of searchByLyrics
+    '''
+    Same search as searchByLyrics (genius.search_lyrics), but awaitable and sent through rl.call, so it waits for a
+    genius token like every other request and retries 429s and 5xx errors. lyricsgenius makes its own requests with
+    its own retries, which the rate limiter cant see.
+
+    returns:
+        list: SongHit tuples like searchByLyrics, or None if no results found
+
+    example:
+        results = await ghf.searchByLyricsAsync("Jeremy can we talk a minute?")
+    '''
+    response = await rl.call("genius", hh.getJSON, f"{geniusPublicApiBase}/search/lyric", params={'q': lyricSnippet, 'per_page': maxResults})
+    return songHitsFromLyricSearch(response.get('response', response), maxResults) # lyricsgenius unwraps the 'response' key for us, here we do it
+
+
+
+def songHitsFromLyricSearch(request, maxResults): # turns a lyric search response into SongHits (shared by searchByLyrics and searchByLyricsAsync)
     # Check if we got anything back
     if not request: # checks if request is None or empty (search failed)
         return None # returns None to indicate no results
@@ -95,7 +474,7 @@ def searchByLyrics(lyricSnippet, maxResults=5): # defines function that takes a
     for hit in request['sections'][0]['hits'][:maxResults]: # navigates to the hits list in the response, [:maxResults] slices to only get first 5 results
         title = hit['result']['title'] # extracts the song title from the nested dictionary
         artist = hit['result']['primary_artist']['name'] # navigates through the dict to get the artist name
-        songs.append((title, artist)) # creates a tuple with title and artist, adds it to the songs list
+        songs.append(SongHit(title, artist, hit['result'].get('id'), hit['result'].get('url'))) # a (title, artist) tuple that also keeps the song ID and page, so picking it later skips the search
     
     # Return songs if we found any, otherwise None
     if songs: # checks if the songs list has any items in it
@@ -120,33 +499,97 @@ def discordMessageSlicer(message): # defines function that takes a message strin
         message (str): The message to split
     
     returns:
-        list: A list of message chunks, each under 2000 characters, or None if input is not a string
+        list: A list of message chunks, each under 2000 characters and cut at line breaks, or None if input is not a string
     
     example:
         lyrics = getLyrics("Mac Miller", "Blue World")
         for chunk in discordMessageSlicer(lyrics):
             await ctx.send(chunk)
     '''
-    pageSizeLimit = 2000 # Discord's character limit per message
-    
     # Validate input is a string
     if type(message) != str: # checks if the input is a string
         print("discordMessageSlicer can only paginate strings") # prints error message to terminal
         return None # returns None to indicate error
     
-    messagePieces = [] # creates empty list to store the message chunks
-    
-    # Calculate number of chunks needed
-    # If message is 6000 chars: 6000//2000 = 3 full chunks
-    for i in range(0, 1 + len(message) // pageSizeLimit): # calculates how many chunks we need, // is integer division, +1 accounts for partial chunks
-        # Check if this is the last chunk
-        if len(message) < i * pageSizeLimit + pageSizeLimit: # checks if the remaining message is shorter than 2000 characters (last chunk)
-            # Last chunk: take everything from current position to end
-            currentPiece = message[i * pageSizeLimit:] # string slicing that takes from current position to the end
-        else: # if not the last chunk
-            # Not last chunk: take exactly 2000 characters
-            currentPiece = message[i * pageSizeLimit:(i * pageSizeLimit) + pageSizeLimit] # takes exactly 2000 characters using string slicing
-        
-        messagePieces.append(currentPiece) # adds the chunk to our list
-    
-    return messagePieces # returns the list of chunks, each under 2000 characters
\ No newline at end of file
+    # this used to cut every 2000 characters exactly, which split words and lines in half. now it uses the same
+    # line aware cutting as iterPageOffsets below (/lyrics itself uses iterBundleOffsets to send fewer messages)
+    return [message[pageStart:pageEnd] for pageStart, pageEnd in iterPageOffsets(message)]
+
+
+
+def findPageEnd(text, start, limit): # where a page that starts at `start` should end so it is at most `limit` long
+    end = start + limit
+    if end >= len(text): # the rest fits
+        return len(text)
+    lineEnds = getattr(text, "lineEnds", None)
+    if lineEnds is not None: # normalized lyrics already know where their lines end
+        lineNumber = bisect.bisect_right(lineEnds, end) - 1
+        lineBreak = lineEnds[lineNumber] if lineNumber >= 0 else -1
+    else:
+        lineBreak = text.rfind("\n", start, end + 1) # the last line break that fits (a line break right at the limit is fine, it isnt included)
+    if lineBreak > start:
+        return lineBreak
+    space = text.rfind(" ", start, end + 1) # one really long line, cut between words at least
+    if space > start:
+        return space
+    return end # one really long word, nothing else we can do
+
+
+
+def skipSeparators(text, position): # skips the line breaks and spaces between two pages so a page never starts with them
+    while position < len(text) and text[position] in "\n ":
+        position += 1
+    return position
+
+
+
+def iterPageOffsets(text, pageSizeLimit=2000, start=0): # generator of (start, end) offsets of each page, cutting at line breaks
+    '''
+    Works out the pages one at a time while they are being sent, and only hands back where each page starts
+    and ends in the original string. the caller slices out just the page it is about to send, so there is
+    never a list of every page sitting in memory.
+    
+    args:
+        text (str): the message to split (usually lyrics)
+        pageSizeLimit (int): the most characters in one page (Discord's message limit is 2000)
+        start (int): where in the text the first page starts
+    
+    example:
+        for pageStart, pageEnd in iterPageOffsets(lyrics):
+            await ctx.send(lyrics[pageStart:pageEnd])
+    '''
+    position = skipSeparators(text, start)
+    while position < len(text):
+        pageEnd = findPageEnd(text, position, pageSizeLimit)
+        yield position, pageEnd
+        position = skipSeparators(text, pageEnd)
+
+
+
+def iterBundleOffsets(text, embedLimit=4096, messageLimit=6000, embedsPerMessage=10, smallestEmbed=500): # groups pages into as few Discord messages as possible
+    '''
+    One Discord message can hold up to 10 embeds, each embed's text can be 4096 characters, and all the embeds
+    in one message together can be 6000 characters. so with embeds, one message carries 3 times the lyrics
+    of a plain 2000 character message. this yields the pages for one message at a time.
+    
+    args:
+        text (str): the message to split
+        embedLimit (int): most characters in one embed
+        messageLimit (int): most characters across all the embeds of one message
+        embedsPerMessage (int): most embeds in one message
+        smallestEmbed (int): dont start another embed in a message with less room left than this,
+                             a new message reads better than a tiny sliver of text
+    
+    returns:
+        generator of lists of (start, end) offsets, one list per message
+    '''
+    position = skipSeparators(text, 0)
+    while position < len(text):
+        bundle = []
+        roomLeft = messageLimit
+        while position < len(text) and len(bundle) < embedsPerMessage and (not bundle or roomLeft >= smallestEmbed):
+            pageEnd = findPageEnd(text, position, min(embedLimit, roomLeft))
+            bundle.append((position, pageEnd))
+            roomLeft -= pageEnd - position
+            position = skipSeparators(text, pageEnd)
+        yield bundle
@@ -0,0 +1,94 @@
+'''
+httpHelper.py
+
+This helper file holds one shared async HTTP client that spotifyHelper.py and geniusHelper.py use for
+their async functions (getTopTracksAsync and getLyricsAsync).
+
+spotipy and lyricsgenius are synchronous, so even in a thread pool every request in flight needs its
+own OS thread. With an async client, hundreds of lookups can wait on the network at the same time on the
+bot's one event loop thread. The client also keeps connections open between requests (keep-alive) and
+uses HTTP/2 when the optional "h2" package is installed, so we skip the TCP + TLS handshake most of the time.
+
+    pip install httpx
+    pip install h2   (optional, turns on HTTP/2)
+
+httpx documentation: https://www.python-httpx.org/async/
+'''
+
+import os # operating system module for accessing environment variables
+import httpx # async HTTP client library
+import deadlineHelper as dh # a request never waits longer than the command's latency budget has left
+
+try: # HTTP/2 support is optional, httpx needs the h2 package for it
+    import h2 # noqa: F401 (only imported to check that it is installed)
+    http2Available = True
+except ImportError: # without h2 we still get pooled HTTP/1.1 keep-alive connections
+    http2Available = False
+
+# connection pool settings, can be changed in the 3510.env file
+maxConnections = int(os.getenv("HTTP_MAX_CONNECTIONS", "100")) # total open connections across spotify and genius
+maxKeepAliveConnections = int(os.getenv("HTTP_MAX_KEEPALIVE", "20")) # idle connections kept open for the next request
+requestTimeoutSeconds = float(os.getenv("HTTP_TIMEOUT_SECONDS", "10")) # give up on a request after this long (or sooner, when the command's budget is nearly gone)
+
+client = None # the shared httpx.AsyncClient, made the first time it is needed
+
+
+
+
+def getClient(): # returns the shared client, making it if needed
+    '''
+    returns:
+        httpx.AsyncClient: the pooled client shared by every async helper function
+    '''
+    global client # we are changing the module level variable, not making a local one
+    if client is None or client.is_closed: # first use, or someone closed it
+        client = httpx.AsyncClient(
+            http2=http2Available, # HTTP/2 lets many requests share one connection to the same host
+            limits=httpx.Limits(
+                max_connections=maxConnections,
+                max_keepalive_connections=maxKeepAliveConnections,
+                keepalive_expiry=30, # close idle connections after 30 seconds
+            ),
+            timeout=httpx.Timeout(requestTimeoutSeconds),
+            follow_redirects=True, # genius song pages sometimes redirect
+            headers={"User-Agent": "VibeCheck music bot (INFO 3510)"},
+        )
+    return client
+
+
+
+async def getJSON(url, params=None, headers=None): # GET request that returns the parsed JSON body
+    '''
+    args:
+        url (str): the URL to request
+        params (dict): query string parameters
+        headers (dict): extra headers (like Authorization)
+
+    returns:
+        dict: the JSON response. raises httpx.HTTPStatusError for 4xx/5xx responses
+    '''
+    response = await getClient().get(url, params=params, headers=headers, timeout=dh.requestTimeout(requestTimeoutSeconds))
+    response.raise_for_status() # turns error status codes into exceptions
+    return response.json()
+
+
+
+async def getText(url, params=None, headers=None): # GET request that returns the body as text (for HTML pages)
+    response = await getClient().get(url, params=params, headers=headers, timeout=dh.requestTimeout(requestTimeoutSeconds))
+    response.raise_for_status()
+    return response.text
+
+
+
+async def postJSON(url, data=None, auth=None): # POST a form and return the parsed JSON body (used for the spotify token)
+    response = await getClient().post(url, data=data, auth=auth, timeout=dh.requestTimeout(requestTimeoutSeconds))
+    response.raise_for_status()
+    return response.json()
+
+
+
+async def closeClient(): # closes every pooled connection, call this when the bot shuts down
+    global client
+    if client is not None:
+        await client.aclose()
+        client = None
@@ -0,0 +1,498 @@
+'''
+lyricsIndexHelper.py
+
+This helper file is a small search engine for lyrics, so /searchlyrics can usually answer without asking Genius.
+
+Every time the bot fetches lyrics (for /lyrics, /sentiment or /sentimentplot), the song gets added to a local
+index. /searchlyrics looks there first and only goes to Genius (genius.search_lyrics) when the index doesnt
+have a good match.
+
+How it works:
+    - an inverted index: for every word, the list of songs it appears in and at which positions. so finding the
+      songs with "jeremy" in them is one dictionary lookup instead of reading every song
+    - BM25 ranking (the standard search engine formula): songs that use the snippet's rarer words, and use them a
+      lot, rank higher. "jeremy" counts for more than "the"
+    - phrase matching: songs that contain the snippet's words right next to each other in the same order rank
+      above songs that just have the words somewhere
+
+On disk (in the cache folder, under lyrics_index/):
+    - segment-N.bin: the song IDs, counts and positions of every word in a group of songs, as packed 32-bit numbers.
+      it is memory mapped, so it is not read into memory up front, and numpy reads a word's list straight out of it
+      without copying. a segment never changes once it is written
+    - segment-N.pickle: that segment's word -> where-its-list-starts dictionary and its songs
+    - journal-N.jsonl: songs added since the last merge. they live in memory (the "delta") until there are enough
+      of them, then they are written out as a new segment
+    - manifest.pickle: which segments and which journal make up the index right now
+    - index.lock: a file lock, so only one process writes at a time
+
+Merging: writing the delta out only writes the new songs, not the whole index again. when the newest segment has
+grown as big as the one before it, the two are combined (like adding 1 to a binary number), so there are only
+about log2(songs / LYRICS_INDEX_MERGE_EVERY) segments and each song gets rewritten about that many times in total.
+
+Shard processes (see shardHelper.py) all share the one index: a song that one shard fetched can be found with
+/searchlyrics on every shard. every process appends to the same journal (holding the lock) and reads the lines the
+others added before it searches. the song IDs come out the same in every process because they all read the same
+journal in the same order. on windows there are no file locks (fcntl), so there each shard process keeps its own
+index under lyrics_index/process-N/ and /searchlyrics only knows the songs its own shard fetched
+
+BM25: https://en.wikipedia.org/wiki/Okapi_BM25
+Inverted index: https://en.wikipedia.org/wiki/Inverted_index
+mmap: https://docs.python.org/3/library/mmap.html
+'''
+
+import contextlib # for the file lock's with block
+import itertools # joins the per-word terms back together
+import json # the journal is one JSON line per added song
+import mmap # memory maps the postings file
+import os # operating system module for paths and environment variables
+import pickle # stores the dictionary and song list
+import re # splits lyrics into words
+import threading # songs get added from worker threads and the event loop
+import unicodedata # removes accents like the cache keys do
+from collections import OrderedDict # small LRU for repeated searches
+import cacheHelper as ch # for the cache folder and normalized song keys
+try:
+    import fcntl # file locks, so the shard processes can share one index
+except ImportError: # windows
+    fcntl = None
+
+indexDirectory = os.path.join(ch.cacheDirectory, "lyrics_index")
+if fcntl is None and os.getenv("VIBECHECK_PROCESS_INDEX") is not None: # a shard process without file locks: the index can only have one writer, so each process keeps its own
+    indexDirectory = os.path.join(indexDirectory, f"process-{os.getenv('VIBECHECK_PROCESS_INDEX')}")
+mergeEvery = int(os.getenv("LYRICS_INDEX_MERGE_EVERY", "200")) # songs in the in-memory delta before they get written out as a segment
+minimumMatch = float(os.getenv("LYRICS_INDEX_MINIMUM_MATCH", "0.7")) # a song has to contain this fraction of the snippet's words (unless it matches the phrase)
+bm25K1 = 1.2 # how quickly repeating a word stops adding to the score
+bm25B = 0.75 # how much long songs get penalized
+phraseBonus = 1000.0 # added to the score of songs with the exact phrase, so they always come first
+phraseCandidates = 50 # only the best scoring songs get the (slower) phrase check
+
+
+
+
+def tokenize(text): # "Don't stop me now!" -> ["dont", "stop", "me", "now"]
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(character for character in text if not unicodedata.combining(character)) # drops accents
+    text = text.casefold().replace("'", "").replace("’", "") # "don't" and "don’t" both become "dont"
+    return re.findall(r"\w+", text)
+
+
+
+def tokenizeStream(lyrics): # tokenize() for lyrics with a token stream (see geniusHelper.normalizeLyrics): each different word is only normalized once
+    words = lyrics.words()
+    termsOfWord = {word: tokenize(word) for word in set(words)} # songs repeat their words a lot
+    return list(itertools.chain.from_iterable(map(termsOfWord.__getitem__, words)))
+
+
+
+
+class Segment: # one segment-N.bin/segment-N.pickle pair. read only, merges write new segments instead of changing this one
+    '''
+    args:
+        directory (str): the index folder
+        name (str): "segment-N"
+
+    example:
+        segment = Segment(indexDirectory, "segment-3")
+        songIDs, counts, positions = segment.read("jeremy")
+    '''
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        with open(os.path.join(directory, f"{name}.pickle"), "rb") as segmentFile:
+            saved = pickle.load(segmentFile)
+        self.dictionary = saved['dictionary'] # word -> (byte offset in the .bin file, number of songs, number of positions)
+        self.songs = saved['songs'] # (song key, title, artist, number of words) for every song in this segment, in song ID order
+        self.postingsFile = None
+        self.postings = None # the mmap of the .bin file
+        path = os.path.join(directory, f"{name}.bin")
+        if os.path.getsize(path) > 0: # mmap cant map an empty file
+            self.postingsFile = open(path, "rb")
+            self.postings = mmap.mmap(self.postingsFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+    def read(self, word): # a word's (song IDs, counts, positions) in this segment, as numpy arrays that point into the mmap
+        import numpy as np # only needed once someone searches
+        entry = self.dictionary.get(word)
+        if entry is None or self.postings is None:
+            empty = np.zeros(0, dtype=np.uint32)
+            return empty, empty, empty
+        offset, songCount, positionCount = entry
+        songIDs = np.frombuffer(self.postings, dtype=np.uint32, count=songCount, offset=offset)
+        counts = np.frombuffer(self.postings, dtype=np.uint32, count=songCount, offset=offset + 4 * songCount)
+        positions = np.frombuffer(self.postings, dtype=np.uint32, count=positionCount, offset=offset + 8 * songCount)
+        return songIDs, counts, positions
+
+
+    def size(self):
+        return len(self.postings) if self.postings is not None else 0
+
+
+    def close(self):
+        if self.postings is not None:
+            self.postings.close()
+            self.postingsFile.close()
+        self.postings = None
+        self.postingsFile = None
+
+
+    def remove(self): # closes the segment and deletes its files (lock held). other processes that still have it mapped can keep reading it
+        self.close()
+        for extension in (".bin", ".pickle"):
+            path = os.path.join(self.directory, self.name + extension)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+
+
+class LyricsIndex: # the index, one per bot
+    '''
+    args:
+        directory (str): folder for the segments, the journal, manifest.pickle and index.lock
+
+    example:
+        lyricsIndex = LyricsIndex(indexDirectory)
+        lyricsIndex.addSong("Pearl Jam", "Jeremy", lyrics)
+        lyricsIndex.search("jeremy spoke in class today") # [("Jeremy", "Pearl Jam")]
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock() # the threads of this process. take it before fileLock()
+        self.lockFile = None # index.lock, for fileLock()
+        self.segments = [] # the Segments, oldest songs first
+        self.songs = [] # song ID -> (song key, title, artist, number of words). segment songs first, then delta songs
+        self.songKeys = set() # keys of every song in the index, so the same song isnt added twice
+        self.baseSongCount = 0 # how many songs are in the segments (the rest are in the delta)
+        self.delta = {} # word -> {song ID: [positions]} for songs added since the last merge
+        self.totalWords = 0 # sum of every song's length, for BM25's average length
+        self.nextSegment = 0 # the N of the next segment-N / journal-N file
+        self.journalName = "journal-0.jsonl" # the journal the manifest points to
+        self.journalOffset = 0 # how far into the journal we have read
+        self.manifestStamp = None # (inode, modified time, size) of manifest.pickle when we last loaded it
+        self.recentSearches = OrderedDict() # (query, maxResults) -> results, cleared whenever a song is added
+        self.songLengths = None # numpy array of every song's length for BM25, rebuilt after songs are added
+        self.load()
+
+
+    def load(self): # opens the segments and replays the journal
+        os.makedirs(self.directory, exist_ok=True)
+        self.lockFile = open(os.path.join(self.directory, "index.lock"), "a+")
+        with self.lock, self.fileLock(exclusive=False):
+            self.refresh()
+
+
+    @contextlib.contextmanager
+    def fileLock(self, exclusive): # holds index.lock: shared while reading the files, exclusive while writing them
+        if fcntl is None: # windows: each process has its own folder, so there is nobody to lock out
+            yield
+            return
+        fcntl.flock(self.lockFile, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lockFile, fcntl.LOCK_UN)
+
+
+    def refresh(self): # catches up with what other processes wrote: a new manifest after a merge, and new journal lines (both locks held)
+        manifestPath = os.path.join(self.directory, "manifest.pickle")
+        try:
+            stat = os.stat(manifestPath)
+            stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError: # nothing has been merged yet
+            stamp = None
+        if stamp != self.manifestStamp:
+            self.reload(manifestPath, stamp)
+        self.readJournal()
+
+
+    def reload(self, manifestPath, stamp): # switches to the segments and journal in the manifest (both locks held)
+        manifest = {'segments': [], 'journal': "journal-0.jsonl", 'nextSegment': 0}
+        if stamp is not None:
+            with open(manifestPath, "rb") as manifestFile:
+                manifest = pickle.load(manifestFile)
+        openSegments = {segment.name: segment for segment in self.segments}
+        self.segments = [openSegments.pop(name, None) or Segment(self.directory, name) for name in manifest['segments']] # segments never change, so ones we already have open are kept
+        for segment in openSegments.values(): # merged away by another process
+            segment.close()
+        self.songs = [song for segment in self.segments for song in segment.songs]
+        self.songKeys = {song[0] for song in self.songs}
+        self.baseSongCount = len(self.songs)
+        self.totalWords = sum(song[3] for song in self.songs)
+        self.delta = {}
+        self.nextSegment = manifest['nextSegment']
+        self.journalName = manifest['journal']
+        self.journalOffset = 0
+        self.manifestStamp = stamp
+        self.recentSearches.clear()
+        self.songLengths = None
+
+
+    def readJournal(self): # adds the journal lines we havent read yet to the delta (both locks held)
+        journalPath = os.path.join(self.directory, self.journalName)
+        if not os.path.exists(journalPath):
+            return
+        with open(journalPath, "rb") as journalFile:
+            journalFile.seek(self.journalOffset)
+            unread = journalFile.read()
+        complete = unread.rfind(b"\n") + 1 # only whole lines. a line without its newline is from a crash (we hold the lock, so nobody is still writing it)
+        for line in unread[:complete].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError: # a half written line from a crash
+                continue
+            self.addToDelta(entry['key'], entry['title'], entry['artist'], entry['words'])
+        self.journalOffset += complete
+
+
+    def addSong(self, artistName, songTitle, lyrics): # adds a song (does nothing if it is already in the index)
+        '''
+        args:
+            artistName (str): the artist, as it should be shown in /searchlyrics results
+            songTitle (str): the title, same
+            lyrics (str): the lyrics
+        '''
+        if not lyrics:
+            return
+        key = ch.normalizeKey(artistName, songTitle)
+        if key in self.songKeys: # quick check without the lock, checked again below
+            return
+        words = tokenizeStream(lyrics) if hasattr(lyrics, "words") else tokenize(lyrics) # the fetched lyrics come already split into words
+        with self.lock, self.fileLock(exclusive=True):
+            self.refresh() # another process might have added it, or merged and started a new journal
+            if key in self.songKeys:
+                return
+            with open(os.path.join(self.directory, self.journalName), "ab") as journalFile:
+                if journalFile.tell() > self.journalOffset: # the last line is missing its newline (a crash), dont glue ours onto it
+                    journalFile.write(b"\n")
+                journalFile.write((json.dumps({'key': key, 'title': songTitle, 'artist': artistName, 'words': words}) + "\n").encode("utf-8"))
+            self.readJournal() # adds it to the delta the same way the other processes will
+            if len(self.songs) - self.baseSongCount >= mergeEvery:
+                self.merge()
+
+
+    def addToDelta(self, key, songTitle, artistName, words): # puts a song in the in-memory part of the index (lock held)
+        if key in self.songKeys:
+            return
+        songID = len(self.songs)
+        self.songs.append((key, songTitle, artistName, len(words)))
+        self.songKeys.add(key)
+        self.totalWords += len(words)
+        for position, word in enumerate(words):
+            self.delta.setdefault(word, {}).setdefault(songID, []).append(position)
+        self.recentSearches.clear() # old search results might be missing this song
+        self.songLengths = None
+
+
+    def basePostings(self, word): # a word's (song IDs, counts, positions) in all the segments
+        import numpy as np # only needed once someone searches
+        parts = [segment.read(word) for segment in self.segments if word in segment.dictionary]
+        if len(parts) == 1: # the usual case for rare words, straight out of the mmap without copying
+            return parts[0]
+        if not parts:
+            empty = np.zeros(0, dtype=np.uint32)
+            return empty, empty, empty
+        return tuple(np.concatenate(column) for column in zip(*parts)) # segments hold consecutive song IDs, so this keeps them sorted
+
+
+    def deltaPostings(self, word): # a word's (song IDs, counts, positions) in the delta, as numpy arrays
+        import numpy as np
+        deltaPostings = self.delta.get(word, {})
+        songIDs = sorted(deltaPostings)
+        return (np.array(songIDs, dtype=np.uint32), np.array([len(deltaPostings[songID]) for songID in songIDs], dtype=np.uint32),
+                np.array([position for songID in songIDs for position in deltaPostings[songID]], dtype=np.uint32))
+
+
+    def songPositions(self, word, songID, basePostings): # every position of a word in one song
+        import numpy as np
+        if songID >= self.baseSongCount:
+            return self.delta.get(word, {}).get(songID, [])
+        songIDs, counts, positions, starts = basePostings[word]
+        index = int(np.searchsorted(songIDs, songID)) # song IDs are sorted, so this is a binary search
+        if index >= len(songIDs) or songIDs[index] != songID:
+            return []
+        return positions[starts[index]:starts[index + 1]].tolist()
+
+
+    def hasPhrase(self, words, songID, basePostings): # True if the words show up next to each other, in order, in this song
+        positionSets = [set(self.songPositions(word, songID, basePostings)) for word in words]
+        return any(all(start + offset in positionSets[offset] for offset in range(1, len(words))) for start in positionSets[0])
+
+
+    def search(self, query, maxResults=5): # finds the songs that best match a lyric snippet
+        '''
+        args:
+            query (str): the lyric snippet
+            maxResults (int): most results to return
+
+        returns:
+            list: (song title, artist name) tuples, best first. empty if nothing in the index is a good match
+        '''
+        import numpy as np
+        words = tokenize(query)
+        if not words:
+            return []
+        cacheKey = (" ".join(words), maxResults)
+        with self.lock:
+            with self.fileLock(exclusive=False): # only while reading the files: the segments we have mapped stay readable even if another process merges them away
+                self.refresh()
+            if cacheKey in self.recentSearches: # same snippet as a recent search
+                self.recentSearches.move_to_end(cacheKey)
+                return self.recentSearches[cacheKey]
+
+            songCount = len(self.songs)
+            if songCount == 0:
+                return []
+            if self.songLengths is None:
+                self.songLengths = np.fromiter((song[3] for song in self.songs), dtype=np.float64, count=songCount)
+            averageLength = self.totalWords / songCount or 1.0
+            lengthNorm = bm25K1 * (1 - bm25B + bm25B * self.songLengths / averageLength)
+            scores = np.zeros(songCount)
+            matchedWords = np.zeros(songCount, dtype=np.int32) # how many of the distinct query words each song has
+            distinctWords = list(dict.fromkeys(words))
+            basePostings = {} # word -> (song IDs, counts, positions, where each song's positions start), reused by the phrase check
+            for word in distinctWords:
+                songIDs, counts, positions = self.basePostings(word)
+                basePostings[word] = (songIDs, counts, positions, np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]))
+                deltaPostings = self.delta.get(word, {})
+                if deltaPostings:
+                    songIDs = np.concatenate([songIDs, np.fromiter(deltaPostings.keys(), dtype=np.uint32, count=len(deltaPostings))])
+                    counts = np.concatenate([counts, np.fromiter((len(found) for found in deltaPostings.values()), dtype=np.uint32, count=len(deltaPostings))])
+                if not len(songIDs):
+                    continue
+                inverseFrequency = np.log(1 + (songCount - len(songIDs) + 0.5) / (len(songIDs) + 0.5))
+                counts = counts.astype(np.float64)
+                scores[songIDs] += inverseFrequency * counts * (bm25K1 + 1) / (counts + lengthNorm[songIDs])
+                matchedWords[songIDs] += 1
+
+            needed = max(1, int(np.ceil(minimumMatch * len(distinctWords))))
+            candidates = np.flatnonzero(matchedWords > 0)
+            candidates = candidates[np.argsort(-scores[candidates], kind="stable")][:phraseCandidates]
+            results = []
+            for songID in candidates.tolist():
+                if len(words) > 1 and matchedWords[songID] == len(distinctWords) and self.hasPhrase(words, songID, basePostings):
+                    results.append((scores[songID] + phraseBonus, songID))
+                elif matchedWords[songID] >= needed:
+                    results.append((scores[songID], songID))
+            results.sort(key=lambda result: -result[0])
+            answer = [(self.songs[songID][1], self.songs[songID][2]) for score, songID in results[:maxResults]]
+
+            self.recentSearches[cacheKey] = answer
+            if len(self.recentSearches) > 1000:
+                self.recentSearches.popitem(last=False)
+            return answer
+
+
+    def merge(self): # writes the delta out as a new segment, combines segments of the same size and starts a new journal (both locks held, exclusive)
+        segments = self.segments + [self.writeSegment(self.delta.keys(), self.deltaPostings, self.songs[self.baseSongCount:])]
+        replaced = []
+        while len(segments) > 1 and len(segments[-2].songs) <= len(segments[-1].songs): # the newest segment caught up with the one before it
+            older, newer = segments[-2:]
+            words = older.dictionary.keys() | newer.dictionary.keys()
+            segments[-2:] = [self.writeSegment(words, lambda word: self.combinedPostings(word, older, newer), older.songs + newer.songs)]
+            replaced += [older, newer]
+
+        oldJournalPath = os.path.join(self.directory, self.journalName)
+        journalName = f"journal-{self.nextSegment}.jsonl"
+        open(os.path.join(self.directory, journalName), "wb").close()
+        manifestPath = os.path.join(self.directory, "manifest.pickle")
+        temporaryPath = manifestPath + ".tmp"
+        with open(temporaryPath, "wb") as manifestFile:
+            pickle.dump({'segments': [segment.name for segment in segments], 'journal': journalName, 'nextSegment': self.nextSegment + 1}, manifestFile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporaryPath, manifestPath) # the switch to the new segments happens all at once
+
+        for segment in replaced: # only the new segments point at these songs now
+            segment.remove()
+        if os.path.exists(oldJournalPath): # those songs are in a segment now
+            os.remove(oldJournalPath)
+        stat = os.stat(manifestPath)
+        self.manifestStamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        self.segments = segments
+        self.baseSongCount = len(self.songs)
+        self.delta = {}
+        self.nextSegment += 1
+        self.journalName = journalName
+        self.journalOffset = 0
+
+
+    def combinedPostings(self, word, older, newer): # a word's postings in two neighbouring segments
+        import numpy as np
+        return tuple(np.concatenate(column) for column in zip(older.read(word), newer.read(word)))
+
+
+    def writeSegment(self, words, postingsOf, songs): # writes segment-N.bin and segment-N.pickle and opens them (both locks held, exclusive)
+        import numpy as np
+        # this is its own function so the numpy arrays pointing into the old mmaps are gone before merge() closes them
+        name = f"segment-{self.nextSegment}"
+        self.nextSegment += 1
+        dictionary = {}
+        offset = 0
+        with open(os.path.join(self.directory, f"{name}.bin"), "wb") as postingsFile:
+            for word in sorted(words):
+                songIDs, counts, positions = postingsOf(word)
+                postingsFile.write(songIDs.astype(np.uint32).tobytes())
+                postingsFile.write(counts.astype(np.uint32).tobytes())
+                postingsFile.write(positions.astype(np.uint32).tobytes())
+                dictionary[word] = (offset, len(songIDs), len(positions))
+                offset += 4 * (2 * len(songIDs) + len(positions))
+        with open(os.path.join(self.directory, f"{name}.pickle"), "wb") as segmentFile:
+            pickle.dump({'dictionary': dictionary, 'songs': songs}, segmentFile, protocol=pickle.HIGHEST_PROTOCOL)
+        return Segment(self.directory, name)
+
+
+    def flush(self): # writes whatever is in the delta out as a segment, call this when the bot shuts down
+        with self.lock, self.fileLock(exclusive=True):
+            self.refresh() # another process might have merged these songs already
+            if len(self.songs) > self.baseSongCount:
+                self.merge()
+
+
+    def stats(self):
+        return {'songs': len(self.songs), 'deltaSongs': len(self.songs) - self.baseSongCount, 'segments': len(self.segments),
+                'words': len(set().union(*(segment.dictionary for segment in self.segments), self.delta)),
+                'postingsBytes': sum(segment.size() for segment in self.segments)}
+
+
+
+
+lyricsIndex = None # the shared index, opened the first time it is needed (see getIndex)
+lyricsIndexLock = threading.Lock()
+
+
+
+def getIndex(): # returns the shared index, opening it if needed
+    global lyricsIndex
+    with lyricsIndexLock:
+        if lyricsIndex is None:
+            lyricsIndex = LyricsIndex(indexDirectory)
+    return lyricsIndex
+
+
+
+def addSong(artistName, songTitle, lyrics): # adds fetched lyrics to the shared index
+    getIndex().addSong(artistName, songTitle, lyrics)
+
+
+
+def search(lyricSnippet, maxResults=5): # searches the shared index, same return format as ghf.searchByLyrics
+    '''
+    returns:
+        list: (song title, artist name) tuples, or None if the index has no good match (so the caller can ask Genius)
+    '''
+    return getIndex().search(lyricSnippet, maxResults) or None
+
+
+
+def listSongs(): # every song in the shared index as (song title, artist name), for the slash command autocomplete
+    songIndex = getIndex()
+    with songIndex.lock: # songs can be added from worker threads while we copy the list
+        with songIndex.fileLock(exclusive=False):
+            songIndex.refresh()
+        return [(songTitle, artistName) for key, songTitle, artistName, wordCount in songIndex.songs]
+
+
+
+def flush(): # writes the delta out as a segment if the index was ever opened
+    if lyricsIndex is not None:
+        lyricsIndex.flush()
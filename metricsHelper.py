@@ -0,0 +1,254 @@
+'''
+metricsHelper.py
+
+This helper file keeps track of where the bot spends its time, so when a /sentimentplot takes 8 seconds we
+can tell if it was the Genius search, the lyrics scrape, VADER, matplotlib or the upload to Discord.
+
+    - spans: `with mh.span("genius_search"):` times whatever is inside and adds it to a histogram for that stage
+    - commands: `@mh.timedCommand` under `@bot.command()` times the whole command
+    - counters: cache hits/misses, upstream errors and retries, worker pool queue depth. these already live in
+      cacheHelper, rateLimitHelper and executorHelper, so we just read them when someone asks for the metrics
+
+Everything is served in the Prometheus text format on a small local web server, so Prometheus (or just a
+browser) can read it. Turn it on in the 3510.env file:
+    VIBECHECK_METRICS_PORT=9108     then open http://127.0.0.1:9108/metrics
+
+Slow commands can also be profiled with cProfile. A sample of the commands (VIBECHECK_PROFILE_SAMPLE_RATE,
+0.01 = 1 in 100) run with the profiler on, and if one of those takes longer than VIBECHECK_SLOW_COMMAND_SECONDS
+its profile is saved to the profiles/ folder. Open it with: python -m pstats profiles/<file>.prof
+(the profiler sees everything the event loop does while it is on, so other commands running at the same time
+show up in it too)
+
+Prometheus text format: https://prometheus.io/docs/instrumenting/exposition_formats/
+cProfile: https://docs.python.org/3/library/profile.html
+'''
+
+import bisect # finds the right histogram bucket
+import contextlib # for the span() context manager
+import cProfile # the profiler for slow commands
+import functools # functools.wraps keeps the command's name and arguments so discord.py still understands it
+import os # operating system module for accessing environment variables
+import random # decides which commands get profiled
+import threading # spans can finish on worker threads, so the histograms need a lock
+import time # perf_counter for timing
+import cacheHelper as ch # for the cache hit/miss counters
+import executorHelper as eh # for the worker pool queue depths
+import admissionHelper as ah # for the admitted/queued/rejected command counters
+import rateLimitHelper as rl # for the upstream error and retry counters
+import deadlineHelper as dh # for the budget, stale answer and hedge counters
+
+metricsPort = int(os.getenv("VIBECHECK_METRICS_PORT", "0")) # 0 = dont start the metrics web server
+profileSampleRate = float(os.getenv("VIBECHECK_PROFILE_SAMPLE_RATE", "0")) # chance a command runs with cProfile on
+slowCommandSeconds = float(os.getenv("VIBECHECK_SLOW_COMMAND_SECONDS", "5")) # profiled commands slower than this get saved
+profileDirectory = os.getenv("VIBECHECK_PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+
+# histogram buckets in seconds, from a cache hit (a millisecond) up to a really slow command
+bucketBounds = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+histograms = {} # (metric name, labels) -> Histogram
+counters = {} # (metric name, labels) -> number
+metricsLock = threading.Lock()
+activeProfiler = None # only one cProfile can run at a time
+metricsServer = None # the aiohttp runner for the /metrics page
+
+
+
+
+class Histogram: # counts how many observations landed in each bucket, like a Prometheus histogram
+    def __init__(self):
+        self.bucketCounts = [0] * (len(bucketBounds) + 1) # the last one is for anything slower than the biggest bound
+        self.total = 0.0
+        self.count = 0
+
+
+    def observe(self, seconds):
+        self.bucketCounts[bisect.bisect_left(bucketBounds, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+
+
+def labelKey(labels): # dictionaries cant be dictionary keys, so turn the labels into a sorted tuple
+    return tuple(sorted(labels.items()))
+
+
+
+def observe(metricName, seconds, **labels): # adds one timing to a histogram
+    with metricsLock:
+        key = (metricName, labelKey(labels))
+        if key not in histograms:
+            histograms[key] = Histogram()
+        histograms[key].observe(seconds)
+
+
+
+def increment(metricName, amount=1, **labels): # adds to a counter
+    with metricsLock:
+        key = (metricName, labelKey(labels))
+        counters[key] = counters.get(key, 0) + amount
+
+
+
+@contextlib.contextmanager
+def span(stage): # times one stage of a command
+    '''
+    example:
+        with mh.span("genius_search"):
+            response = await rl.call("genius", hh.getJSON, url)
+    '''
+    startedAt = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        increment("vibecheck_stage_errors_total", stage=stage) # includes cancelled commands
+        raise
+    finally:
+        observe("vibecheck_stage_seconds", time.perf_counter() - startedAt, stage=stage)
+
+
+
+def timedCommand(commandFunction): # decorator that times a whole command, and profiles a sample of them
+    '''
+    goes UNDER @bot.command() so discord.py registers the timed version:
+
+        @bot.command()
+        @mh.timedCommand
+        async def lyrics(ctx, *args):
+    '''
+    commandName = commandFunction.__name__
+
+    @functools.wraps(commandFunction)
+    async def timedVersion(*args, **kwargs):
+        global activeProfiler
+        profiler = None
+        if profileSampleRate and activeProfiler is None and random.random() < profileSampleRate:
+            profiler = activeProfiler = cProfile.Profile()
+            profiler.enable()
+        startedAt = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await commandFunction(*args, **kwargs)
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            seconds = time.perf_counter() - startedAt
+            observe("vibecheck_command_seconds", seconds, command=commandName)
+            increment("vibecheck_commands_total", command=commandName, outcome=outcome)
+            if profiler is not None:
+                profiler.disable()
+                activeProfiler = None
+                if seconds >= slowCommandSeconds:
+                    saveProfile(profiler, commandName, seconds)
+
+    return timedVersion
+
+
+
+def saveProfile(profiler, commandName, seconds): # writes a slow command's profile to the profiles folder
+    os.makedirs(profileDirectory, exist_ok=True)
+    path = os.path.join(profileDirectory, f"{commandName}-{time.strftime('%Y%m%d-%H%M%S')}-{seconds:.1f}s.prof")
+    profiler.dump_stats(path)
+    increment("vibecheck_slow_profiles_total", command=commandName)
+    print(f"Saved a profile of a slow /{commandName} ({seconds:.1f}s) to {path}")
+
+
+
+def formatLabels(labels): # ('stage', 'vader') pairs -> {stage="vader"}
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in labels) + "}"
+
+
+
+def collectGauges(): # reads the counters that other helper files already keep, as (name, labels, value, type)
+    samples = []
+    for cache in ch.allCaches:
+        stats = cache.stats()
+        for counterName in ('memoryHits', 'diskHits', 'staleHits', 'negativeHits', 'misses', 'evictions', 'sets', 'backendErrors'):
+            samples.append(("vibecheck_cache_events_total", (("cache", cache.name), ("event", counterName)), stats[counterName], "counter"))
+        samples.append(("vibecheck_cache_memory_items", (("cache", cache.name),), stats['memoryItems'], "gauge"))
+        samples.append(("vibecheck_cache_memory_bytes", (("cache", cache.name),), stats['memoryBytes'], "gauge"))
+    for backend, stats in eh.getMetrics().items():
+        labels = (("backend", backend),)
+        samples.append(("vibecheck_pool_queued", labels, stats['queued'], "gauge"))
+        samples.append(("vibecheck_pool_running", labels, stats['running'], "gauge"))
+        samples.append(("vibecheck_pool_failed_total", labels, stats['failed'], "counter"))
+        samples.append(("vibecheck_pool_wait_seconds_total", labels, stats['totalWaitSeconds'], "counter"))
+        samples.append(("vibecheck_pool_run_seconds_total", labels, stats['totalRunSeconds'], "counter"))
+    for api, stats in rl.getStats().items():
+        labels = (("api", api),)
+        for counterName in ('sent', 'backgroundSent', 'throttled', 'retries', 'errors', 'gaveUp', 'hedged'):
+            samples.append(("vibecheck_upstream_events_total", labels + (("event", counterName),), stats[counterName], "counter"))
+        samples.append(("vibecheck_upstream_waiting", labels, stats['waiting'], "gauge"))
+    admissionStats = ah.getStats()
+    for counterName in ('admitted', 'queued', 'rejectedUser', 'rejectedGuild', 'rejectedBusy', 'timedOut'):
+        samples.append(("vibecheck_admission_events_total", (("event", counterName),), admissionStats[counterName], "counter"))
+    samples.append(("vibecheck_admission_in_flight", (), admissionStats['inFlight'], "gauge"))
+    samples.append(("vibecheck_admission_waiting", (), admissionStats['waiting'], "gauge"))
+    for counterName, value in dh.counters.items(): # budgetsRunOut, staleServed, hedgesSent, hedgesWon
+        samples.append(("vibecheck_deadline_events_total", (("event", counterName),), value, "counter"))
+    return samples
+
+
+
+def renderPrometheus(): # builds the /metrics page
+    '''
+    returns:
+        str: every histogram, counter and gauge in the Prometheus text format
+    '''
+    lines = []
+    seenTypes = set()
+
+    def addType(metricName, metricType): # each metric gets one "# TYPE" line before its first sample
+        if metricName not in seenTypes:
+            seenTypes.add(metricName)
+            lines.append(f"# TYPE {metricName} {metricType}")
+
+    with metricsLock:
+        histogramItems = sorted(histograms.items())
+        counterItems = sorted(counters.items())
+        for (metricName, labels), histogram in histogramItems:
+            addType(metricName, "histogram")
+            runningCount = 0
+            for bound, bucketCount in zip(bucketBounds + (float("inf"),), histogram.bucketCounts):
+                runningCount += bucketCount # prometheus buckets are cumulative
+                bucketLabels = labels + (("le", "+Inf" if bound == float("inf") else repr(bound)),)
+                lines.append(f"{metricName}_bucket{formatLabels(bucketLabels)} {runningCount}")
+            lines.append(f"{metricName}_sum{formatLabels(labels)} {histogram.total}")
+            lines.append(f"{metricName}_count{formatLabels(labels)} {histogram.count}")
+        for (metricName, labels), value in counterItems:
+            addType(metricName, "counter")
+            lines.append(f"{metricName}{formatLabels(labels)} {value}")
+    for metricName, labels, value, metricType in collectGauges():
+        addType(metricName, metricType)
+        lines.append(f"{metricName}{formatLabels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+
+async def startServer(port=None): # starts the local /metrics web server (does nothing if no port is set)
+    global metricsServer
+    port = port or metricsPort
+    if not port or metricsServer is not None:
+        return
+    from aiohttp import web # installed with discord.py, only needed when the metrics server is on
+
+    async def metricsPage(request):
+        return web.Response(text=renderPrometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metricsPage)
+    metricsServer = web.AppRunner(app, access_log=None)
+    await metricsServer.setup()
+    await web.TCPSite(metricsServer, "127.0.0.1", port).start() # 127.0.0.1 so only this computer can see it
+    print(f"Metrics at http://127.0.0.1:{port}/metrics")
+
+
+
+async def stopServer():
+    global metricsServer
+    if metricsServer is not None:
+        await metricsServer.cleanup()
+        metricsServer = None
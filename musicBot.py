@@ -1,18 +1,41 @@
+import startupHelper as suh # imported first so it can time every other import when VIBECHECK_PROFILE_IMPORTS=1
+suh.startImportProfiling() # does nothing unless the profile mode is turned on
 import discord # discord python library for interacting with Discord's API
 from discord.ext import commands # commands extension, which makes it easier to create bot commands with decorators like @bot.command()
+from discord import app_commands # real discord slash commands (with separate artist and title boxes and autocomplete)
 import asyncio # lets the bot handle multiple tasks at once without blocking (like waiting for discord responses)
+import collections # OrderedDict for each channel's recent /searchlyrics results
+import hashlib # fingerprints the slash command list, so it is only sent to discord when it changed
+import json # the slash command list as text, for the fingerprint
 import os # operating system module that lets us access environment variables
+import io # BytesIO wraps the plot PNG bytes so discord can upload them like a file
+import time # paces the progress edits in /artistmood
 from dotenv import load_dotenv 
 import spotifyHelper as shf 
 import geniusHelper as ghf 
 import vaderHelper as vh 
+import executorHelper as eh # runs the blocking helper calls in thread/process pools so the bot never freezes
+import httpHelper as hh # shared pooled HTTP client used by the async spotify and genius helpers
+import cacheHelper as ch # for building normalized artist/song keys
+import singleFlightHelper as sfh # lets identical requests that arrive together share one piece of work
+import rateLimitHelper as rl # spotify/genius rate limiting, we catch its UpstreamBusyError below
+import metricsHelper as mh # latency histograms and the /metrics page
+import lyricsIndexHelper as lih # local lyrics search index, checked before genius in /searchlyrics
+import shardHelper as shh # runs the bot as several shard processes when VIBECHECK_SHARDS is set
+import prewarmHelper as pwh # fills the caches ahead of time for the artists people ask about the most
+import admissionHelper as ah # keeps one user or server from spamming the bot slow for everyone else
+import autocompleteHelper as ach # artist/title suggestions for the slash commands, from what the bot has already found
+import deadlineHelper as dh # latency budgets per command, so a slow genius or spotify request cant hang a command
+suh.stopImportProfiling() # the imports are done
 
 '''
 musicBot.py 
 
 This bot retrieves the top tracks for any artist from Spotify.
 
-Upon firing up the bot, you can say anything in the chat and it will give you a bulleted list of the following commands. 
+Upon firing up the bot, @mention it in the chat and it will give you a bulleted list of the following commands. They are
+real discord slash commands (type / and pick one, the artist and title boxes autocomplete from songs the bot has already
+found), and the old way of typing them out (/lyrics Mac Miller + Blue World) still works too.
 
 COMMANDS:
 
@@ -34,11 +57,15 @@ and if the artist is spelt wrong or isnt found itll send an error back.
 2. /lyrics [artist name] + [song title]: retrieves lyrics for a specific song. Example: /lyrics Mac Miller + Blue World
 
 3. /searchlyrics [lyric snippet]: searches for songs containing a lyric snippet. Example: /searchlyrics "Jeremy can we talk a minute"
+   The results are numbered, and for a while after /lyrics 2 (or /sentiment 2, /sentimentplot 2) in the same channel picks result 2
+   without searching genius again.
 
 4. /sentiment [artist] + [song title] - Analyze sentiment of song lyrics. Example: /lyrics Mac Miller + Blue World
 
 5. /sentimentplot [artist] + [song title] - Visualize the songs sentiment progression. Example: /sentimentplot Pearl Jam + Black 
 
+6. /artistmood [artist] - The overall mood of an artist's top tracks, with a score for each one. Example: /artistmood Mac Miller
+
 '''
 
 
@@ -59,7 +86,158 @@ intents = discord.Intents().all() # gives discord permission for bot to access e
 
 # from Dr. Zietz's class bot.py file
 # bot object instantiated from discord module
-bot = commands.Bot(command_prefix="/", intents=intents) # creates the bot and tells it a command starts with a "/" and passes the permissions we just set up above ^^
+bot = shh.makeBot(command_prefix="/", intents=intents) # creates the bot (a commands.Bot, or an AutoShardedBot when VIBECHECK_SHARDS is set) and tells it a command starts with a "/" and passes the permissions we just set up above ^^
+
+# when lots of people run /sentiment or /sentimentplot on the same song at once, they share one VADER run
+# (the genius and spotify helpers have their own single flights for the fetches)
+sentimentFlight = sfh.SingleFlight("vader")
+
+
+
+async def analyzeSongLyrics(artistName, songTitle, lyrics): # runs VADER on the lyrics, once per song no matter how many people ask at the same time
+    cachedResults = await vh.getCachedSentimentAsync(lyrics) # already scored these exact lyrics before
+    if cachedResults is not None:
+        return cachedResults
+    songKey = ch.normalizeKey(artistName, songTitle) # same key the lyrics cache uses, so same key = same lyrics
+    with mh.span("vader"): # includes waiting for a free CPU worker
+        try:
+            # runs in the CPU process pool. VADER is local so it gets a little time even if genius used up the budget
+            sentimentResults = await dh.within(sentimentFlight.do(songKey, eh.runCPU, "vader", vh.analyzeLyrics, lyrics), "vader", atLeast=dh.graceSeconds)
+        except dh.DeadlineExceeded: # the CPU workers are backed up, an expired score for these exact lyrics is still the right score
+            staleResults = await vh.getStaleSentimentAsync(lyrics)
+            if staleResults is None:
+                raise
+            dh.counters['staleServed'] += 1
+            return staleResults
+    if sentimentResults:
+        sentimentResults.lyrics = lyrics # point at our copy of the lyrics instead of the one that came back from the worker process
+        await vh.cacheSentimentAsync(lyrics, sentimentResults)
+    return sentimentResults
+
+
+
+
+async def prewarmSong(artistName, songTitle): # fills the lyrics, sentiment and plot caches for one song, the prewarmer calls this
+    if await vh.getCachedPlotAsync(artistName, songTitle) is not None: # already warm, the plot is the last thing we make
+        return
+    lyrics = await ghf.getLyricsAsync(artistName, songTitle)
+    if not lyrics:
+        return
+    sentimentResults = await analyzeSongLyrics(artistName, songTitle, lyrics)
+    if not sentimentResults:
+        return
+    plotBytes = await eh.runCPU("plot", vh.renderSentimentPlot, sentimentResults, artistName, songTitle)
+    await vh.cachePlotAsync(artistName, songTitle, plotBytes)
+    ach.addSong(artistName, songTitle) # a hot artist's top tracks are good suggestions too
+
+
+
+
+artistMoodParallelism = int(os.getenv("VIBECHECK_ARTISTMOOD_PARALLEL", "8")) # how many of an artist's songs /artistmood fetches lyrics for at once
+progressEditSeconds = 1.0 # /artistmood edits its progress message at most this often (discord rate limits edits too)
+syncCommands = os.getenv("VIBECHECK_SYNC_COMMANDS", "1") == "1" # set to 0 to never send the slash command list to discord on startup
+syncFingerprintPath = os.path.join(ch.cacheDirectory, "slash_commands.sha256") # the last list we sent (delete it to make the bot sync again)
+staleLyricsNote = "(Genius is being slow right now, so these are the lyrics I saved last time, they might be a little out of date)"
+deadlineMessage = "That's taking way longer than it should (Genius or Spotify is being slow right now), please try again in a moment!"
+recentResultsSeconds = float(os.getenv("VIBECHECK_RECENT_RESULTS_SECONDS", "900")) # how long "/lyrics 2" can still pick result 2 of a channel's last /searchlyrics
+maxRecentChannels = 5000 # past this many channels, the oldest results are forgotten
+recentResults = collections.OrderedDict() # channel ID -> (time.monotonic() they run out, that channel's last /searchlyrics results), oldest first
+
+
+
+
+def rememberResults(ctx, results): # keeps a channel's /searchlyrics results for a while so people can pick one by number
+    channelID = getattr(ctx.channel, "id", None)
+    recentResults.pop(channelID, None) # so it moves to the newest end
+    recentResults[channelID] = (time.monotonic() + recentResultsSeconds, list(results))
+    while len(recentResults) > maxRecentChannels:
+        recentResults.popitem(last=False)
+
+
+
+def pickRecentResult(ctx, resultNumber): # result number `resultNumber` (from 1) of this channel's last /searchlyrics, or None
+    expiresAt, results = recentResults.get(getattr(ctx.channel, "id", None), (0.0, []))
+    if expiresAt < time.monotonic() or not 1 <= resultNumber <= len(results):
+        return None
+    return results[resultNumber - 1]
+
+
+
+def parseSongInput(ctx, fullInput): # "artist + song title", or the number of one of this channel's recent /searchlyrics results
+    '''
+    returns:
+        tuple: (artistName, songTitle, pickedResult), pickedResult is the /searchlyrics result (ghf.SongHit) that was
+               picked by number or None if the names were typed. None if the input is neither
+    '''
+    if fullInput.strip().isdigit():
+        pickedResult = pickRecentResult(ctx, int(fullInput))
+        if pickedResult is None:
+            return None
+        songTitle, artistName = pickedResult
+        return artistName, songTitle, pickedResult
+    if "+" not in fullInput: # need the separator otherwise where does the artist name start and song begin?
+        return None
+    parts = fullInput.split("+") # splits the string at the "+" into a list with 2 items
+    return parts[0].strip(), parts[1].strip(), None # .strip() removes extra spaces
+
+
+
+async def getSongLyrics(artistName, songTitle, pickedResult=None): # lyrics by name, or straight from the song page for a picked genius result
+    '''
+    Only waits as long as the command's latency budget (deadlineHelper.py). If genius doesnt answer in time, or is
+    too busy, we answer with the lyrics we had cached before (past their TTL) instead of making the user wait.
+
+    returns:
+        tuple: (lyrics, isStale). isStale is True for those older cached lyrics, so the command can say so.
+               raises dh.DeadlineExceeded / rl.UpstreamBusyError if there is nothing older to fall back on
+    '''
+    songID = getattr(pickedResult, "songID", None) # results from the local index are plain tuples, their lyrics are already cached
+    if songID is not None:
+        fetch = ghf.getLyricsByIDAsync(songID, artistName, songTitle, pickedResult.url) # no search, the result already said which song it is
+    else:
+        fetch = ghf.getLyricsAsync(artistName, songTitle)
+    try:
+        return await dh.within(fetch, "genius"), False
+    except (dh.DeadlineExceeded, rl.UpstreamBusyError):
+        staleLyrics = await ghf.getStaleLyricsAsync(artistName, songTitle, songID)
+        if staleLyrics is None:
+            raise
+        dh.counters['staleServed'] += 1
+        return staleLyrics, True
+
+
+
+
+useLyricsEmbeds = os.getenv("VIBECHECK_LYRICS_EMBEDS", "1") == "1" # set to 0 to always send lyrics as plain messages
+
+
+
+async def sendLongText(ctx, text): # sends long text (lyrics) in as few messages as possible, in order
+    '''
+    Sends the text as embeds, which fit 6000 characters per message instead of 2000, and cuts it at line breaks.
+    While one message is uploading the next one is already being put together, and the channel's rate limiter
+    paces the sends. If the bot isnt allowed to post embeds in this channel it switches to plain messages.
+    '''
+    channelLimiter = rl.getChannelLimiter(getattr(ctx.channel, "id", None)) # paces us to discord's per channel limit
+    pendingSend = None # the send that is uploading right now
+    resumeAt = 0 # where the plain message fallback should pick up from
+    try:
+        if useLyricsEmbeds:
+            for bundle in ghf.iterBundleOffsets(text): # the pages are worked out one message at a time, while the last one uploads
+                embeds = [discord.Embed(description=text[pageStart:pageEnd]) for pageStart, pageEnd in bundle]
+                if pendingSend is not None:
+                    await pendingSend # messages have to arrive in order, so the last one has to finish first
+                resumeAt = bundle[0][0]
+                await channelLimiter.acquire()
+                pendingSend = asyncio.ensure_future(ctx.send(embeds=embeds))
+            if pendingSend is not None:
+                await pendingSend
+            return
+    except discord.Forbidden: # no "Embed Links" permission in this channel
+        pass
+    for pageStart, pageEnd in ghf.iterPageOffsets(text, start=resumeAt): # plain 2000 character messages, cut at line breaks
+        await channelLimiter.acquire()
+        await ctx.send(text[pageStart:pageEnd])
 
 
 
@@ -71,48 +249,71 @@ async def on_ready(): # this function is asynchronous (can handle multiple thing
     if channel: # check to make sure the channel exists, if you try to send a message to None, bot will crash
         await channel.send("Music bot is online!") # await means "wait for this to finish before continuing"
     print(f"{bot.user.id} {bot.user.name} has connected to Discord.") # prints to the terminal (not discord) confirming the bot connected
+    if getattr(bot, "shard_ids", None): # sharded, say which shards this process runs
+        print(f"Running shards {bot.shard_ids} of {bot.shard_count}")
+    if suh.profileImports: # VIBECHECK_PROFILE_IMPORTS=1, show which imports made startup slow
+        print(suh.report())
 
 # all bot code needs to come before asyncio.run
 
 
 
+# Event: a command raised an error
+@bot.event
+async def on_command_error(ctx, error):
+    originalError = getattr(error, "original", error) # discord.py wraps errors from inside commands in CommandInvokeError
+    if isinstance(originalError, rl.UpstreamBusyError): # spotify or genius kept saying "too many requests", that is not the user's fault
+        await ctx.send(f"{originalError.api.capitalize()} is getting a lot of requests right now, please try again in a moment!")
+        return
+    if isinstance(originalError, dh.DeadlineExceeded): # the command's latency budget ran out and there was nothing saved to answer with
+        await ctx.send(deadlineMessage)
+        return
+    await commands.Bot.on_command_error(bot, ctx, error) # anything else: discord.py's normal handling (prints the error to the terminal)
+
+
+
+
+# the list of commands, sent when someone @mentions the bot
+helpMenu = (
+    "Want to learn about some music?\n\n"
+    "1. /toptracks [artist name] - Get top 10 tracks for any artist\n"
+    "2. /lyrics [artist] + [song title] - Get lyrics for a specific song\n"
+    "3. /searchlyrics [lyric snippet] - Search for songs by lyrics, then /lyrics [number] to pick one\n"
+    "4. /sentiment [artist] + [song title] - Analyze sentiment of song lyrics\n"
+    "5. /sentimentplot [artist] + [song title] - Visualize sentiment throughout song\n"
+    "6. /artistmood [artist] - Get the overall mood of an artist's top tracks\n\n"
+    "Type / to use them as slash commands, the artist and song boxes autocomplete!"
+)
+
+
+
 
 # Event: respond to messages
 # adapted from class bot.py file
 @bot.event # decorator that registers this as an event handler
 async def on_message(message): # runs everytime ANY message is sent in the channel 
-    # Ignore messages from the bot itself so that we dont end up in an infinate loop
-    if message.author == bot.user: # checks if the bot sent the message
-        await bot.process_commands(message)
-        return # exits the function early 
-    
     if message.content.startswith("/"):
         # If it IS a command, just process it
         await bot.process_commands(message)
-    else:
-        # If it's NOT a command, send the help message
-        await message.channel.send(
-            "Want to learn about some music?\n\n"
-            "1. /toptracks [artist name] - Get top 10 tracks for any artist\n"
-            "2. /lyrics [artist] + [song title] - Get lyrics for a specific song\n"
-            "3. /searchlyrics [lyric snippet] - Search for songs by lyrics\n"
-            "4. /sentiment [artist] + [song title] - Analyze sentiment of song lyrics\n"
-            "5. /sentimentplot [artist] + [song title] - Visualize sentiment throughout song\n"
-            "6. /sayhello [names] - Say hello to the bot!\n\n"
-        )    
+    elif bot.user in message.mentions and message.author != bot.user: # someone @mentioned the bot, send the help menu
+        # (this used to answer EVERY message that wasnt a command, which in a busy channel was a discord API call per chat line)
+        await message.channel.send(helpMenu)
 
 
 
 # command: get top tracks for an artist from spotify using spotifyHelper.py file functions 
 # modified from Dr. Zietz's class bot.py file
 @bot.command() # decorator that registers this as a bot command (no brief or description needed since we made our own help menu)
+@mh.timedCommand # times the whole command for the metrics page (has to go under @bot.command)
+@ah.admitted # per-user/per-server rate limits and the in-flight limit (has to go under @mh.timedCommand)
+@dh.budgeted # the command's latency budget, starts once it is admitted (has to go under @ah.admitted)
 async def toptracks(ctx, *args): # ctx is context object with info about who sent the command, *args captures ALL words after /toptracks as a tuple. the * allows for it to be more than one argument or one word 
     # Join the artist name
     artistName = " ".join(args) # join the artist name... turns ('Mac', 'Miller') into "Mac Miller"
     
     # Get the track data (just a set of tuples!) call my helper function to get track data from Spotify
     #A tuple is like a list, but immutable (can't be changed after its created)
-    result = shf.getTopTracks(artistName) # calls the getTopTracks function from spotifyHelper.py
+    result = await dh.within(shf.getTopTracksAsync(artistName), "spotify") # calls the async getTopTracks function from spotifyHelper.py, the bot keeps running while spotify answers (stale top tracks come back right away)
     
     # check if artist was found... if not, send error message and exit
     if result is None: # if the function returned None, that means the artist wasn't found
@@ -121,6 +322,10 @@ async def toptracks(ctx, *args): # ctx is context object with info about who sen
 
     # unpack the result into two variables: the track data set and the proper artist name
     trackData, artistActualName = result # unpacks the tuple returned by getTopTracks into two separate variables
+    pwh.recordRequest(artistActualName) # counts towards this artist being "hot" for the prewarmer
+    ach.addArtist(artistActualName) # suggested in the slash commands' artist box from now on
+    for trackName, albumName, popularity in trackData:
+        ach.addSong(artistActualName, pwh.cleanTrackTitle(trackName)) # and their songs in the title box
     
     # the message we build to return to the user, and two new lines 
     message = f"Top Tracks by {artistActualName}\n\n" # starts building the message string with the artist name
@@ -144,27 +349,35 @@ async def toptracks(ctx, *args): # ctx is context object with info about who sen
 
 # command: get lyrics for a specific song using geniusHelper.py file functions
 @bot.command() # decorator that registers this as a bot command
+@mh.timedCommand # times the whole command for the metrics page (has to go under @bot.command)
+@ah.admitted # per-user/per-server rate limits and the in-flight limit (has to go under @mh.timedCommand)
+@dh.budgeted # the command's latency budget, starts once it is admitted (has to go under @ah.admitted)
 async def lyrics(ctx, *args): # *args captures all words after /lyrics
     # Join all arguments into one string
     fullInput = " ".join(args) # combines all the words into one string so we can search for the "+" separator
     
-    # Check if there's a separator. need the separator otherwise where does teh artist name start and song begin?
-    if "+" not in fullInput: # checks if the user included the "+" separator we need
-        await ctx.send("Please use format: /lyrics [artist] + [song title]\nExample: /lyrics Post Malone + Circles") # sends error message with example
+    # "artist + song title", or a number to pick one of the last /searchlyrics results in this channel
+    songInput = parseSongInput(ctx, fullInput)
+    if songInput is None: # no "+" separator, and not the number of a recent result either
+        await ctx.send("Please use format: /lyrics [artist] + [song title] (or /lyrics 2 for result 2 of a /searchlyrics)\nExample: /lyrics Post Malone + Circles") # sends error message with example
         return # exits early
-    
-    # Split by the + separator
-    parts = fullInput.split("+") # splits the string at the "+" into a list with 2 items
-    artistName = parts[0].strip() # takes the first part (artist name) and .strip() removes extra spaces
-    songTitle = parts[1].strip() # takes the second part (song title) and removes extra spaces
-    
+    artistName, songTitle, pickedResult = songInput
+    await sendLyrics(ctx, artistName, songTitle, pickedResult)
+
+
+
+async def sendLyrics(ctx, artistName, songTitle, pickedResult=None): # the rest of /lyrics once we know which song (the slash command starts here, its boxes are already split)
     await ctx.send(f"Searching for lyrics to '{songTitle}' by {artistName}...") # sends a "processing" message to let user know bot is working
     
-    lyrics = ghf.getLyrics(artistName, songTitle) # calls the getLyrics function from geniusHelper.py
+    lyrics, lyricsAreStale = await getSongLyrics(artistName, songTitle, pickedResult) # the async getLyrics from geniusHelper.py (by ID for a picked search result)
     
     if lyrics: # checks if lyrics were found (lyrics will be None if not found)
-        for page in ghf.discordMessageSlicer(lyrics): # splits lyrics into chunks under 2000 characters since discord has a limit
-            await ctx.send(page) # sends each chunk as a separate message
+        pwh.recordRequest(artistName) # counts towards this artist being "hot" for the prewarmer
+        ach.addSong(artistName, songTitle) # suggested in the slash commands' artist and title boxes from now on
+        if lyricsAreStale: # genius was too slow, these are the lyrics we saved last time
+            await ctx.send(staleLyricsNote)
+        with mh.span("discord_send"):
+            await sendLongText(ctx, lyrics) # splits the lyrics at line breaks into as few messages as discord allows and sends them in order
     else: # if no lyrics were found
         await ctx.send(f" Could not find lyrics for '{songTitle}' by {artistName}. Try checking the spelling!") # sends error message
 
@@ -174,6 +387,9 @@ async def lyrics(ctx, *args): # *args captures all words after /lyrics
 
 # command: search for songs by a lyric snippet using geniusHelper.py file functions
 @bot.command() # decorator that registers this as a bot command
+@mh.timedCommand # times the whole command for the metrics page (has to go under @bot.command)
+@ah.admitted # per-user/per-server rate limits and the in-flight limit (has to go under @mh.timedCommand)
+@dh.budgeted # the command's latency budget, starts once it is admitted (has to go under @ah.admitted)
 async def searchlyrics(ctx, *args): # *args captures the lyric snippet the user wants to search for
     # Join all the words into the lyric snippet
     lyricSnippet = " ".join(args) # combines all words into one string
@@ -186,7 +402,12 @@ async def searchlyrics(ctx, *args): # *args captures the lyric snippet the user
     await ctx.send(f"Searching for songs with lyrics: '{lyricSnippet}'...") # lets user know the bot is working on it
     
     # Search for songs using our helper function
-    results = ghf.searchByLyrics(lyricSnippet, maxResults=5) # calls the searchByLyrics function, asks for max 5 results
+    # every song the bot has fetched lyrics for is in the local index, so try that first (no network at all)
+    with mh.span("local_lyric_search"):
+        results = await asyncio.to_thread(lih.search, lyricSnippet, maxResults=5) # opening the index the first time reads from disk, so not on the event loop
+    if not results: # nothing good locally, ask genius
+        with mh.span("genius_lyric_search"):
+            results = await dh.within(ghf.searchByLyricsAsync(lyricSnippet, maxResults=5), "genius") # asks for max 5 results, one rate limited request with the same 429 retries as the other genius calls
     
     # Check if we found any songs
     if results: # checks if any songs were found (results will be None if nothing found)
@@ -196,8 +417,10 @@ async def searchlyrics(ctx, *args): # *args captures the lyric snippet the user
         # Loop through results and add them to the message
         for i, (songTitle, artistName) in enumerate(results, 1): # enumerate gives us counter starting at 1, unpacks each tuple
             message += f"{i}. {songTitle} by {artistName}\n" # adds formatted line for each song. f strings vs. old string concatenation 
+            ach.addSong(artistName, songTitle) # so picking it in /lyrics is a couple of key presses
+        rememberResults(ctx, results) # so "/lyrics 2" in this channel means the 2nd one (and skips searching genius again)
         
-        message += f"\nUse /lyrics [artist] [song title] to see full lyrics!" # adds helpful tip at the end
+        message += f"\nUse /lyrics [number] to see full lyrics (or /sentiment, /sentimentplot [number])!" # adds helpful tip at the end
         
         await ctx.send(message) # sends the complete message
     else: # if no songs were found
@@ -209,32 +432,38 @@ async def searchlyrics(ctx, *args): # *args captures the lyric snippet the user
 
 # command: analyze sentiment of a song's lyrics
 @bot.command() # decorator that registers this as a bot command
+@mh.timedCommand # times the whole command for the metrics page (has to go under @bot.command)
+@ah.admitted # per-user/per-server rate limits and the in-flight limit (has to go under @mh.timedCommand)
+@dh.budgeted # the command's latency budget, starts once it is admitted (has to go under @ah.admitted)
 async def sentiment(ctx, *args): # *args captures all words after /sentiment
     # Join all arguments into one string
     fullInput = " ".join(args) # combines all words into one string so we can look for the "+" separator
     
-    # Check if there's a separator
-    if "+" not in fullInput: # checks if user included the "+" we need to separate artist and song
-        await ctx.send("Please use format: /sentiment [artist] + [song title]\nExample: /sentiment Mac Miller + Good News") # error message with example
+    # "artist + song title", or a number to pick one of the last /searchlyrics results in this channel
+    songInput = parseSongInput(ctx, fullInput)
+    if songInput is None: # no "+" separator, and not the number of a recent result either
+        await ctx.send("Please use format: /sentiment [artist] + [song title] (or /sentiment 2 for result 2 of a /searchlyrics)\nExample: /sentiment Mac Miller + Good News") # error message with example
         return # exits early
-    
-    # split by the + separator
-    parts = fullInput.split("+") # splits string at "+" into a list
-    artistName = parts[0].strip() # gets first part (the artist) and strip removes extra spaces
-    songTitle = parts[1].strip() # gets second part (the song) and strip removes extra spaces
-    
+    artistName, songTitle, pickedResult = songInput
+    await sendSentiment(ctx, artistName, songTitle, pickedResult)
+
+
+
+async def sendSentiment(ctx, artistName, songTitle, pickedResult=None): # the rest of /sentiment once we know which song (the slash command starts here)
     # Send a processing message
     await ctx.send(f"Analyzing sentiment for '{songTitle}' by {artistName}...") # lets user know bot is working
     
     # Get the lyrics from Genius
-    lyrics = ghf.getLyrics(artistName, songTitle) # calls getLyrics function to get the song lyrics
+    lyrics, lyricsAreStale = await getSongLyrics(artistName, songTitle, pickedResult) # calls the async getLyrics function to get the song lyrics (by ID for a picked search result)
     
     if not lyrics: # checks if lyrics is None (not found)
         await ctx.send(f"Could not find lyrics for '{songTitle}' by {artistName}. Try checking the spelling!") # error message
         return # exits early
+    pwh.recordRequest(artistName) # counts towards this artist being "hot" for the prewarmer
+    ach.addSong(artistName, songTitle) # suggested in the slash commands' artist and title boxes from now on
     
     # Analyze the sentiment using VADER
-    sentimentResults = vh.analyzeLyrics(lyrics) # calls analyzeLyrics function which uses VADER to analyze sentiment
+    sentimentResults = await analyzeSongLyrics(artistName, songTitle, lyrics) # calls analyzeLyrics function which uses VADER to analyze sentiment, in the CPU process pool
     
     if not sentimentResults: # checks if analysis failed
         await ctx.send("Could not analyze sentiment for this song.") # error message
@@ -242,6 +471,8 @@ async def sentiment(ctx, *args): # *args captures all words after /sentiment
     
     # Format and send the results
     formattedResults = vh.formatSentimentResults(sentimentResults) # calls function to format results into readable text
+    if lyricsAreStale: # genius was too slow, so this is the sentiment of the lyrics we saved last time
+        formattedResults = f"{staleLyricsNote}\n\n{formattedResults}"
     await ctx.send(formattedResults) # sends the formatted sentiment analysis
 
 
@@ -250,56 +481,294 @@ async def sentiment(ctx, *args): # *args captures all words after /sentiment
 
 # command: create sentiment visualization
 @bot.command() # decorator that registers this as a bot command
+@mh.timedCommand # times the whole command for the metrics page (has to go under @bot.command)
+@ah.admitted # per-user/per-server rate limits and the in-flight limit (has to go under @mh.timedCommand)
+@dh.budgeted # the command's latency budget, starts once it is admitted (has to go under @ah.admitted)
 async def sentimentplot(ctx, *args): # *args captures all words after /sentimentplot
     # Join all arguments into one string
     fullInput = " ".join(args) # combines all words into one string
     
-    # Check if there's a separator
-    if "+" not in fullInput: # checks if user included the "+" separator
-        await ctx.send("Please use format: /sentimentplot [artist] + [song title]\nExample: /sentimentplot Mac Miller + Good News") # error with example
+    # "artist + song title", or a number to pick one of the last /searchlyrics results in this channel
+    songInput = parseSongInput(ctx, fullInput)
+    if songInput is None: # no "+" separator, and not the number of a recent result either
+        await ctx.send("Please use format: /sentimentplot [artist] + [song title] (or /sentimentplot 2 for result 2 of a /searchlyrics)\nExample: /sentimentplot Mac Miller + Good News") # error with example
         return # exits early
-    
-    # Split by the + separator
-    parts = fullInput.split("+") # splits at "+" into a list
-    artistName = parts[0].strip() # gets artist name and removes spaces
-    songTitle = parts[1].strip() # gets song title and removes spaces
+    artistName, songTitle, pickedResult = songInput
+    await sendSentimentPlot(ctx, artistName, songTitle, pickedResult)
+
+
+
+async def sendSentimentPlot(ctx, artistName, songTitle, pickedResult=None): # the rest of /sentimentplot once we know which song (the slash command starts here)
+    # if this plot has been made before, just upload the saved PNG. no genius, no vader, no matplotlib
+    cachedPlot = await vh.getCachedPlotAsync(artistName, songTitle) # the PNG bytes, or None if we havent made this plot yet
+    if cachedPlot:
+        pwh.recordRequest(artistName) # counts towards this artist being "hot" for the prewarmer
+        ach.addSong(artistName, songTitle) # suggested in the slash commands' artist and title boxes from now on
+        with mh.span("discord_upload"):
+            await ctx.send(f"Sentiment progression for '{songTitle}' by {artistName}:", file=discord.File(io.BytesIO(cachedPlot), filename="sentiment_plot.png"))
+        return # all done
     
     # Send a processing message
     await ctx.send(f"Creating sentiment visualization for '{songTitle}' by {artistName}...") # lets user know bot is creating the plot
     
     # Get the lyrics from Genius
-    lyrics = ghf.getLyrics(artistName, songTitle) # gets the lyrics
+    lyrics, lyricsAreStale = await getSongLyrics(artistName, songTitle, pickedResult) # gets the lyrics (async, by ID for a picked search result)
     
     if not lyrics: # checks if lyrics weren't found
         await ctx.send(f"Could not find lyrics for '{songTitle}' by {artistName}. Try checking the spelling!") # error message
         return # exits early
+    pwh.recordRequest(artistName) # counts towards this artist being "hot" for the prewarmer
+    ach.addSong(artistName, songTitle) # suggested in the slash commands' artist and title boxes from now on
     
     # Analyze the sentiment using VADER
-    sentimentResults = vh.analyzeLyrics(lyrics) # analyzes sentiment using VADER
+    sentimentResults = await analyzeSongLyrics(artistName, songTitle, lyrics) # analyzes sentiment using VADER in the CPU process pool
     
     if not sentimentResults: # checks if analysis failed
         await ctx.send("Could not analyze sentiment for this song.") # error message
         return # exits early
     
     # Create the visualization
-    savedVisualizationFilename = vh.sentimentViz(sentimentResults, artistName, songTitle) # creates the plot and saves it as a PNG, returns the filename
+    with mh.span("plot_render"):
+        plotBytes = await eh.runCPU("plot", vh.renderSentimentPlot, sentimentResults, artistName, songTitle) # draws the plot in memory in the CPU process pool, returns the PNG as bytes (no shared file on disk)
     
-    if not savedVisualizationFilename: # checks if visualization creation failed
+    if not plotBytes: # checks if visualization creation failed
         await ctx.send("Could not create visualization.") # error message
         return # exits early
+    if not lyricsAreStale: # a plot of old lyrics shouldnt be the one everyone gets for the next month
+        await vh.cachePlotAsync(artistName, songTitle, plotBytes) # remember the PNG so the next request for this song skips all of the above
     
     # create a file object to send to Discord
-    visualizationFileObject = discord.File(savedVisualizationFilename, filename=savedVisualizationFilename) # creates a Discord file object from the saved PNG
+    visualizationFileObject = discord.File(io.BytesIO(plotBytes), filename="sentiment_plot.png") # creates a Discord file object straight from the PNG bytes in memory
     
     # Send the file to Discord
-    await ctx.send(f"Sentiment progression for '{songTitle}' by {artistName}:", file=visualizationFileObject) # sends message with the image file attached
+    with mh.span("discord_upload"):
+        caption = f"Sentiment progression for '{songTitle}' by {artistName}:" + (f"\n{staleLyricsNote}" if lyricsAreStale else "")
+        await ctx.send(caption, file=visualizationFileObject) # sends message with the image file attached
+
+
+
+
+# command: the overall mood of an artist's top tracks
+@bot.command() # decorator that registers this as a bot command
+@mh.timedCommand # times the whole command for the metrics page (has to go under @bot.command)
+@ah.admitted # per-user/per-server rate limits and the in-flight limit (has to go under @mh.timedCommand)
+@dh.budgeted # the command's latency budget, starts once it is admitted (has to go under @ah.admitted)
+async def artistmood(ctx, *args): # *args captures the artist name
+    artistName = " ".join(args) # turns ('Mac', 'Miller') into "Mac Miller"
+    
+    if not artistName: # nothing after /artistmood
+        await ctx.send("Please provide an artist. Example: /artistmood Mac Miller") # error message with example
+        return # exits early
+    
+    result = await dh.within(shf.getTopTracksAsync(artistName), "spotify") # the same top tracks /toptracks shows
+    if result is None: # artist wasnt found
+        await ctx.send(f"Could not find artist: {artistName}")
+        return # exits early
+    trackData, artistActualName = result
+    pwh.recordRequest(artistActualName) # counts towards this artist being "hot" for the prewarmer
+    ach.addArtist(artistActualName) # suggested in the slash commands' artist box from now on
+    
+    # most popular first, with the title cleaned up the way people type it ("Song (feat. X)" -> "Song") so genius finds it
+    songTitles = [pwh.cleanTrackTitle(trackName) for trackName, albumName, popularity in sorted(trackData, key=lambda x: x[2], reverse=True)]
+    statusLines = [f"{number}. {songTitle} - ..." for number, songTitle in enumerate(songTitles, 1)] # one line per song, filled in as its lyrics arrive
+    statusMessage = await ctx.send(f"Checking the mood of {artistActualName}'s top tracks...\n\n" + "\n".join(statusLines)) # the one message we keep editing
+    
+    # fetch every song's lyrics at the same time (up to artistMoodParallelism at once), so this takes about as long as
+    # the slowest song instead of all of them added up. the genius rate limiter still paces the actual requests
+    fetchSlots = asyncio.Semaphore(artistMoodParallelism)
+    staleNumbers = set() # songs where genius was too slow and we used the lyrics saved last time
+    async def fetchSongLyrics(number, songTitle):
+        async with fetchSlots:
+            try:
+                songLyrics, lyricsAreStale = await getSongLyrics(artistActualName, songTitle)
+            except (dh.DeadlineExceeded, rl.UpstreamBusyError): # one slow song shouldnt sink the whole answer, it just doesnt count
+                return number, None
+            except Exception as error: # neither should one broken song (a 404 on its genius page, a page we cant read), it shows up as "no lyrics found"
+                print(f"/artistmood: lyrics for {artistActualName} - {songTitle} failed ({error!r})")
+                return number, None
+            if lyricsAreStale:
+                staleNumbers.add(number)
+            return number, songLyrics
+    
+    lyricsByNumber = {}
+    lastEditAt = time.monotonic()
+    with mh.span("artistmood_lyrics"):
+        for finishedFetch in asyncio.as_completed([fetchSongLyrics(number, songTitle) for number, songTitle in enumerate(songTitles, 1)]):
+            number, songLyrics = await finishedFetch
+            lyricsByNumber[number] = songLyrics
+            statusLines[number - 1] = f"{number}. {songTitles[number - 1]} - {'lyrics found' if songLyrics else 'no lyrics found'}"
+            if time.monotonic() - lastEditAt >= progressEditSeconds and len(lyricsByNumber) < len(songTitles): # show progress, but dont spam edits
+                lastEditAt = time.monotonic()
+                await statusMessage.edit(content=f"Checking the mood of {artistActualName}'s top tracks... ({len(lyricsByNumber)}/{len(songTitles)})\n\n" + "\n".join(statusLines))
+    
+    # score every song VADER hasnt seen yet in one batched pass instead of one /sentiment at a time
+    sentimentByNumber = {}
+    for number, songLyrics in lyricsByNumber.items():
+        if songLyrics:
+            sentimentByNumber[number] = await vh.getCachedSentimentAsync(songLyrics)
+            ach.addSong(artistActualName, songTitles[number - 1])
+    unscoredNumbers = [number for number, results in sentimentByNumber.items() if results is None]
+    if unscoredNumbers:
+        with mh.span("vader"):
+            batchResults = await eh.runCPU("vader", vh.analyzeLyricsBatch, [lyricsByNumber[number] for number in unscoredNumbers]) # all of them in the CPU process pool at once
+        for number, sentimentResults in zip(unscoredNumbers, batchResults):
+            sentimentResults.lyrics = lyricsByNumber[number] # point at our copy of the lyrics instead of the one that came back from the worker process
+            await vh.cacheSentimentAsync(lyricsByNumber[number], sentimentResults) # so a /sentiment on one of these songs is instant
+            sentimentByNumber[number] = sentimentResults
+    
+    trackResults = [(songTitle + (" (lyrics saved earlier)" if number in staleNumbers else ""), sentimentByNumber.get(number)) for number, songTitle in enumerate(songTitles, 1)]
+    await statusMessage.edit(content=vh.formatArtistMood(artistActualName, trackResults)) # the same message, now with the scores
+
+
+
+
+# slash commands: the same commands as real discord application commands, with a separate box for the artist and the
+# song title (so no more "+"), and suggestions in those boxes while you type. the artist and title go straight to the
+# part of the command after the "+" splitting (so "Florence + The Machine" stays one artist), wrapped in the same
+# admission limits, metrics and latency budget as the text command, and the rest just hand their box to the text command
+
+def asCommand(commandName, commandBody): # wraps a command body in the same timing, admission limits and budget as the text command commandName
+    async def checkedBody(ctx, *args):
+        return await commandBody(ctx, *args)
+    checkedBody.__name__ = commandName # the decorators go by the name: the metrics label, whether it is expensive, and its budget
+    return mh.timedCommand(ah.admitted(dh.budgeted(checkedBody)))
+
+lyricsBySlash = asCommand("lyrics", sendLyrics)
+sentimentBySlash = asCommand("sentiment", sendSentiment)
+sentimentplotBySlash = asCommand("sentimentplot", sendSentimentPlot)
+
+
+
+async def runSlashCommand(interaction, commandFunction, *args): # runs a command (or a command body) for a slash command interaction
+    ctx = await commands.Context.from_interaction(interaction) # a ctx whose ctx.send answers the interaction
+    await ctx.defer() # "VibeCheck is thinking..." - discord wants an answer within 3 seconds, and a lyrics fetch can take longer
+    await commandFunction(ctx, *args)
+
+
+
+async def artistAutocomplete(interaction, current): # suggestions for the artist box, straight from memory (no API calls, discord only waits 3 seconds)
+    return [app_commands.Choice(name=artistName, value=artistName) for artistName in ach.completeArtists(current)]
+
+
+
+async def titleAutocomplete(interaction, current): # suggestions for the title box, from the songs of the artist typed in the artist box
+    artistName = getattr(interaction.namespace, "artist", None)
+    return [app_commands.Choice(name=songTitle, value=songTitle) for songTitle in ach.completeTitles(current, artistName)]
+
+
+
+@bot.tree.command(name="toptracks", description="Get the top 10 tracks for any artist")
+@app_commands.describe(artist="The artist")
+@app_commands.autocomplete(artist=artistAutocomplete)
+async def toptracksSlash(interaction: discord.Interaction, artist: str):
+    await runSlashCommand(interaction, toptracks.callback, *artist.split())
+
+
+
+@bot.tree.command(name="lyrics", description="Get the lyrics for a song")
+@app_commands.describe(artist="The artist", title="The song title")
+@app_commands.autocomplete(artist=artistAutocomplete, title=titleAutocomplete)
+async def lyricsSlash(interaction: discord.Interaction, artist: str, title: str):
+    await runSlashCommand(interaction, lyricsBySlash, artist.strip(), title.strip())
+
+
+
+@bot.tree.command(name="searchlyrics", description="Search for songs by a lyric snippet")
+@app_commands.describe(snippet="A few words from the song")
+async def searchlyricsSlash(interaction: discord.Interaction, snippet: str):
+    await runSlashCommand(interaction, searchlyrics.callback, *snippet.split())
+
+
+
+@bot.tree.command(name="sentiment", description="Analyze the sentiment of a song's lyrics")
+@app_commands.describe(artist="The artist", title="The song title")
+@app_commands.autocomplete(artist=artistAutocomplete, title=titleAutocomplete)
+async def sentimentSlash(interaction: discord.Interaction, artist: str, title: str):
+    await runSlashCommand(interaction, sentimentBySlash, artist.strip(), title.strip())
+
+
+
+@bot.tree.command(name="sentimentplot", description="Visualize the sentiment throughout a song")
+@app_commands.describe(artist="The artist", title="The song title")
+@app_commands.autocomplete(artist=artistAutocomplete, title=titleAutocomplete)
+async def sentimentplotSlash(interaction: discord.Interaction, artist: str, title: str):
+    await runSlashCommand(interaction, sentimentplotBySlash, artist.strip(), title.strip())
+
+
+
+@bot.tree.command(name="artistmood", description="Get the overall mood of an artist's top tracks")
+@app_commands.describe(artist="The artist")
+@app_commands.autocomplete(artist=artistAutocomplete)
+async def artistmoodSlash(interaction: discord.Interaction, artist: str):
+    await runSlashCommand(interaction, artistmood.callback, *artist.split())
+
+
+
+@bot.tree.error # on_command_error, but for the slash commands
+async def on_app_command_error(interaction, error):
+    originalError = getattr(error, "original", error)
+    if isinstance(originalError, (rl.UpstreamBusyError, dh.DeadlineExceeded)):
+        if isinstance(originalError, dh.DeadlineExceeded):
+            message = deadlineMessage
+        else:
+            message = f"{originalError.api.capitalize()} is getting a lot of requests right now, please try again in a moment!"
+        if interaction.response.is_done(): # we already said "thinking...", so this is a followup
+            await interaction.followup.send(message)
+        else:
+            await interaction.response.send_message(message)
+        return
+    await app_commands.CommandTree.on_error(bot.tree, interaction, error) # anything else: discord.py's normal handling (logs the error)
+
+
+
+async def syncSlashCommands(): # tells discord about the slash commands, but only when they changed (and only from one shard process, see shardHelper.py)
+    # discord rate limits global syncs a lot, and the commands only change when this file does, so most startups skip it
+    if not syncCommands or os.getenv("VIBECHECK_PROCESS_INDEX", "0") != "0":
+        return
+    commandList = json.dumps([command.to_dict(bot.tree) for command in bot.tree.get_commands()], sort_keys=True)
+    fingerprint = hashlib.sha256(f"{bot.application_id}\n{commandList}".encode("utf-8")).hexdigest() # a different bot token is a different command list on discord's side
+    try:
+        with open(syncFingerprintPath, encoding="utf-8") as fingerprintFile:
+            if fingerprintFile.read().strip() == fingerprint:
+                print("Slash commands havent changed since the last sync, not syncing")
+                return
+    except FileNotFoundError: # never synced from this folder before
+        pass
+    syncedCommands = await bot.tree.sync()
+    print(f"Synced {len(syncedCommands)} slash commands")
+    os.makedirs(ch.cacheDirectory, exist_ok=True)
+    with open(syncFingerprintPath, "w", encoding="utf-8") as fingerprintFile:
+        fingerprintFile.write(fingerprint)
 
 
 
 
 # from Dr. Zietz's class bot.py file
 # you have to tell the bot to actually run
-asyncio.run(bot.start(discordToken)) # bot.start() starts the bot using my discord token, asyncio.run() runs it asynchronously
+# the __main__ check matters now: the CPU process pool in executorHelper.py re-imports this file in its worker
+# processes on some systems (like macOS), and we dont want every worker to start its own copy of the bot
+async def main(): # starts the bot and cleans up the shared HTTP connections when it stops
+    try:
+        await mh.startServer() # the /metrics page, only if VIBECHECK_METRICS_PORT is set
+        pwh.start(prewarmSong) # every few minutes, fills the caches for the hottest artists' top tracks
+        await ach.loadSongsAsync(await asyncio.to_thread(lih.listSongs)) # the songs in the lyrics index are the first autocomplete suggestions (added on the loop, where commands add theirs)
+        await bot.login(discordToken) # bot.start() is login() then connect(), split up so the slash commands can be synced in between
+        await syncSlashCommands()
+        await bot.connect() # connects to discord and runs until the bot is stopped
+    finally:
+        await pwh.stop()
+        await mh.stopServer()
+        await hh.closeClient() # closes the pooled spotify/genius connections
+        lih.flush() # writes the songs added since the last merge out as a lyrics index segment
+
+if __name__ == "__main__":
+    if shh.shouldSupervise(): # VIBECHECK_SHARDS with more than one process: this process just starts and watches the shard processes
+        shh.runSupervisor(os.path.abspath(__file__))
+    else:
+        try:
+            asyncio.run(main()) # asyncio.run() runs it asynchronously
+        finally:
+            eh.shutdown() # stops the process pool when the bot exits
 # bot objects have a start method that start up the bot
 # TOKEN authenticates your bot
-# asyncio is running whatever you pass it asynchronously
\ No newline at end of file
+# asyncio is running whatever you pass it asynchronously
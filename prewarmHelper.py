@@ -0,0 +1,190 @@
+'''
+prewarmHelper.py
+
+This helper file fills the caches ahead of time for the artists people ask about the most, so the first person to
+ask about a popular song doesnt have to wait for the whole Genius + VADER + matplotlib trip.
+
+    - every command that finds an artist calls pwh.recordRequest(artistName). each artist has a score that goes up
+      by 1 per request and halves every VIBECHECK_PREWARM_HALF_LIFE seconds, so "hot" means asked about a lot lately
+    - every VIBECHECK_PREWARM_INTERVAL seconds a background task takes the hottest artists, gets their top tracks
+      (the same getTopTracksAsync path /toptracks uses) and hands each track to the warm function musicBot.py gives
+      it, which fetches the lyrics, runs VADER and renders the plot into the caches
+    - it is background work: its Spotify and Genius requests go behind every command in the rate limiters, it waits
+      whenever commands are queued up for an API or a worker pool, and it never makes more than
+      VIBECHECK_PREWARM_CALLS_PER_HOUR upstream requests an hour
+
+Settings in the 3510.env file:
+    VIBECHECK_PREWARM=1                     set to 0 to turn the prewarmer off
+    VIBECHECK_PREWARM_INTERVAL=900          seconds between rounds
+    VIBECHECK_PREWARM_ARTISTS=10            how many of the hottest artists each round
+    VIBECHECK_PREWARM_TRACKS=5              how many of each artist's top tracks
+    VIBECHECK_PREWARM_MIN_REQUESTS=2        an artist has to be this hot (about this many recent requests) to be prewarmed
+    VIBECHECK_PREWARM_CALLS_PER_HOUR=300    the upstream request budget
+    VIBECHECK_PREWARM_HALF_LIFE=21600       how fast old requests stop counting (6 hours)
+'''
+
+import asyncio # the prewarmer is a task on the bot's event loop
+import os # operating system module for accessing environment variables
+import re # cleans spotify track names into the titles people type
+import time # for the decaying scores and the budget
+import cacheHelper as ch # normalized artist keys
+import executorHelper as eh # worker pool queue depths, to tell when commands are waiting
+import metricsHelper as mh # counts warmed songs for the metrics page
+import rateLimitHelper as rl # background priority, and how many requests the prewarmer has made
+import spotifyHelper as shf # the top tracks of each hot artist
+
+prewarmEnabled = os.getenv("VIBECHECK_PREWARM", "1") == "1"
+intervalSeconds = float(os.getenv("VIBECHECK_PREWARM_INTERVAL", "900"))
+artistsPerRound = int(os.getenv("VIBECHECK_PREWARM_ARTISTS", "10"))
+tracksPerArtist = int(os.getenv("VIBECHECK_PREWARM_TRACKS", "5"))
+minimumScore = float(os.getenv("VIBECHECK_PREWARM_MIN_REQUESTS", "2"))
+callsPerHour = float(os.getenv("VIBECHECK_PREWARM_CALLS_PER_HOUR", "300"))
+halfLifeSeconds = float(os.getenv("VIBECHECK_PREWARM_HALF_LIFE", str(6 * 3600)))
+maxTrackedArtists = 5000 # past this many artists, the coldest half are forgotten
+busyPollSeconds = 1.0 # how often we check again while commands are waiting
+
+artistScores = {} # normalized artist name -> [score, when it was last updated, the name as it was typed]
+budget = {'tokens': callsPerHour * intervalSeconds / 3600, 'updatedAt': time.monotonic()} # upstream requests we may still make, refills at callsPerHour
+counters = {'rounds': 0, 'songsWarmed': 0, 'callsUsed': 0, 'waitedForCommands': 0}
+prewarmTask = None # the background task, see start()
+
+
+
+
+def decayedScore(score, seconds): # what a score is worth after `seconds` of no new requests
+    return score * 0.5 ** (seconds / halfLifeSeconds)
+
+
+
+def recordRequest(artistName): # counts one request for an artist (call it when a command found something for them)
+    key = ch.normalizeKey(artistName)
+    if not key:
+        return
+    now = time.time()
+    score, updatedAt, displayName = artistScores.get(key, (0.0, now, artistName))
+    artistScores[key] = [decayedScore(score, now - updatedAt) + 1, now, artistName]
+    if len(artistScores) > maxTrackedArtists: # forget the coldest half so this cant grow forever
+        coldest = sorted(artistScores, key=lambda name: decayedScore(artistScores[name][0], now - artistScores[name][1]))
+        for name in coldest[:len(coldest) // 2]:
+            del artistScores[name]
+
+
+
+def hottestArtists(count): # the names of the `count` artists with the highest scores right now (at least minimumScore)
+    now = time.time()
+    scored = [(decayedScore(score, now - updatedAt), displayName) for score, updatedAt, displayName in artistScores.values()]
+    scored.sort(reverse=True)
+    return [displayName for score, displayName in scored[:count] if round(score, 1) >= minimumScore] # rounded so two requests a minute apart still count as 2
+
+
+
+def cleanTrackTitle(trackName): # spotify's track name -> the title people type, so the caches are keyed the same way
+    '''
+    example:
+        cleanTrackTitle("Sunflower - Spider-Man: Into the Spider-Verse") == "Sunflower"
+        cleanTrackTitle("Fortnight (feat. Post Malone)") == "Fortnight"
+    '''
+    title = re.sub(r"\s*[\(\[](feat|ft|with)\.?\s[^\)\]]*[\)\]]", "", trackName, flags=re.IGNORECASE)
+    return title.split(" - ")[0].strip() or trackName
+
+
+
+def backgroundCallsMade(): # every request the rate limiters have sent at background priority
+    return sum(limiter.counters['backgroundSent'] for limiter in rl.limiters.values())
+
+
+
+def commandsWaiting(): # True while commands are queued for an API or a worker pool, so prewarming should hold off
+    if any(limiter.interactiveWaiting() for limiter in rl.limiters.values()):
+        return True
+    return any(stats['queued'] for stats in eh.getMetrics().values())
+
+
+
+async def waitForTurn(): # waits until there is budget left and no command is waiting on us
+    while True:
+        now = time.monotonic()
+        budgetCap = max(callsPerHour * intervalSeconds / 3600, 1.0) # at most one round's worth saved up
+        budget['tokens'] = min(budgetCap, budget['tokens'] + (now - budget['updatedAt']) * callsPerHour / 3600)
+        budget['updatedAt'] = now
+        if budget['tokens'] < 1:
+            await asyncio.sleep((1 - budget['tokens']) * 3600 / callsPerHour) # until the next request is in the budget
+        elif commandsWaiting():
+            counters['waitedForCommands'] += 1
+            await asyncio.sleep(busyPollSeconds)
+        else:
+            return
+
+
+
+async def spend(awaitable): # runs one step and takes the upstream requests it made out of the budget
+    callsBefore = backgroundCallsMade()
+    try:
+        return await awaitable
+    finally:
+        callsUsed = backgroundCallsMade() - callsBefore # cache hits cost nothing. can go negative, then the next step waits longer
+        budget['tokens'] -= callsUsed
+        counters['callsUsed'] += callsUsed
+
+
+
+async def prewarmOnce(warmSong): # one round: the top tracks of the hottest artists go through warmSong
+    '''
+    args:
+        warmSong (async function): warmSong(artistName, songTitle) fills the caches for one song
+    '''
+    counters['rounds'] += 1
+    with rl.background(): # everything below (and every task it starts) waits behind commands in the rate limiters
+        for artistName in hottestArtists(artistsPerRound):
+            await waitForTurn()
+            try:
+                result = await spend(shf.getTopTracksAsync(artistName))
+            except rl.UpstreamBusyError:
+                return
+            if result is None: # not on spotify after all
+                continue
+            trackData, artistActualName = result
+            for trackName, albumName, popularity in sorted(trackData, key=lambda track: track[2], reverse=True)[:tracksPerArtist]:
+                await waitForTurn()
+                try:
+                    with mh.span("prewarm_song"):
+                        await spend(warmSong(artistActualName, cleanTrackTitle(trackName)))
+                except rl.UpstreamBusyError: # spotify or genius is overloaded, leave the rest of this round for next time
+                    return
+                counters['songsWarmed'] += 1
+                mh.increment("vibecheck_prewarmed_songs_total")
+
+
+
+async def prewarmLoop(warmSong): # runs a round every intervalSeconds until the bot stops
+    while True:
+        await asyncio.sleep(intervalSeconds)
+        try:
+            await prewarmOnce(warmSong)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error: # a failed round shouldnt stop the next one
+            print(f"Prewarm round failed: {error}")
+
+
+
+def start(warmSong): # starts the prewarmer on the running event loop (does nothing if VIBECHECK_PREWARM=0)
+    '''
+    example (inside the bot's async main):
+        pwh.start(prewarmSong)
+    '''
+    global prewarmTask
+    if prewarmEnabled and prewarmTask is None:
+        prewarmTask = asyncio.create_task(prewarmLoop(warmSong))
+
+
+
+async def stop(): # cancels the prewarmer, call this when the bot shuts down
+    global prewarmTask
+    if prewarmTask is not None:
+        prewarmTask.cancel()
+        try:
+            await prewarmTask
+        except asyncio.CancelledError:
+            pass
+        prewarmTask = None
@@ -0,0 +1,318 @@
+'''
+rateLimitHelper.py
+
+This helper file is the one place every request to Spotify and Genius goes through, so the bot stays under
+their rate limits instead of finding out about them the hard way.
+
+Before, when lots of people used the bot at once, Spotify and Genius would start answering with
+"429 Too Many Requests", and the bot just told the user "Could not find artist" or "Could not find lyrics".
+Now each API gets:
+    - a token bucket: the API gets `rate` requests per second, with short bursts of up to `burst` requests.
+      when the bucket is empty, requests wait in line instead of being sent
+    - priorities: commands someone is waiting on (interactive) always get the next token before
+      background work (like refreshing stale top tracks)
+    - retries with backoff: on a 429 (or a 5xx / network error) we wait and try again. if the API sends a
+      Retry-After header we wait exactly that long, and the WHOLE bucket pauses so the other requests in line
+      dont make it worse. otherwise we wait a random amount of time that doubles every attempt
+      (exponential backoff with "full jitter", so a crowd of retries doesnt all come back at the same moment)
+
+So when the bot is busy, commands get a little slower instead of failing. If an API is still refusing after
+every retry, UpstreamBusyError is raised so the bot can say "try again in a moment" instead of "not found".
+
+GET requests are also hedged (a second copy is sent if the first is slower than the API's recent p95, see
+deadlineHelper.py), and a retry is only started if the command's latency budget has time left for it.
+
+Rates can be changed in the 3510.env file:
+    VIBECHECK_RATE_SPOTIFY=8 and VIBECHECK_BURST_SPOTIFY=16 (requests per second, biggest burst)
+    VIBECHECK_RATE_GENIUS=4 and VIBECHECK_BURST_GENIUS=8
+    VIBECHECK_RETRY_ATTEMPTS=4
+
+Token bucket: https://en.wikipedia.org/wiki/Token_bucket
+Backoff and jitter: https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+Retry-After: https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Retry-After
+'''
+
+import asyncio # waiters are asyncio futures so waiting in line doesnt block the event loop
+import contextlib # for the background() context manager
+import contextvars # the priority follows a command through every function it calls (and tasks it starts)
+import email.utils # parses the date form of Retry-After
+import heapq # the line of waiters, sorted by priority then arrival order
+import itertools # a counter that keeps waiters with the same priority first come first served
+import os # operating system module for accessing environment variables
+import random # for the jitter
+import time # for the buckets and Retry-After
+import httpx # the errors that tell us an API is overloaded
+import deadlineHelper as dh # the command's latency budget, and hedged requests
+import httpHelper as hh # its GET functions are the requests that are safe to send twice (hedge)
+
+# priorities, a lower number goes first
+interactivePriority = 0 # someone ran a command and is waiting for the answer
+backgroundPriority = 10 # nobody is waiting (background refreshes, prewarming, bulk jobs)
+
+# the priority of whatever is running right now. commands are interactive by default,
+# background work wraps itself in `with rl.background():`
+currentPriority = contextvars.ContextVar("vibecheckPriority", default=interactivePriority)
+
+retryAttempts = int(os.getenv("VIBECHECK_RETRY_ATTEMPTS", "4")) # total tries per request, including the first one
+backoffBaseSeconds = 0.5 # the first retry waits up to this long, then it doubles
+backoffCapSeconds = 20.0 # never back off longer than this between two tries
+maxRetryAfterSeconds = float(os.getenv("VIBECHECK_MAX_RETRY_AFTER", "60")) # if an API asks us to wait longer than this, give up instead
+retryStatusCodes = {429, 500, 502, 503, 504} # "slow down" and "something broke on our end, try again"
+hedgeableFunctions = {hh.getJSON, hh.getText} # GETs dont change anything, so sending one twice is safe (the spotify token POST isnt hedged)
+
+
+
+
+class UpstreamBusyError(Exception): # raised when an API is still refusing after every retry
+    def __init__(self, api, reason):
+        super().__init__(f"{api} is busy right now ({reason})")
+        self.api = api # "spotify" or "genius"
+
+
+
+class ApiLimiter: # the token bucket and line of waiters for one API
+    '''
+    args:
+        name (str): the API name, used in errors and stats
+        rate (float): requests per second the bucket refills at
+        burst (int): how many tokens the bucket holds, so how many requests can go out back to back
+
+    example:
+        limiter = ApiLimiter("genius", rate=4, burst=8)
+        await limiter.acquire() # waits for a token
+    '''
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst) # starts full
+        self.updatedAt = time.monotonic() # when tokens was last refilled
+        self.pausedUntil = 0.0 # time.monotonic() before which nothing is sent (set by Retry-After)
+        self.waiters = [] # heap of (priority, arrival number, future)
+        self.arrivals = itertools.count()
+        self.wakeTask = None # the task that hands out tokens to the waiters as they refill
+        self.latency = dh.LatencyTracker() # how long recent requests took, the hedge waits for this API's p95
+        self.counters = {'sent': 0, 'backgroundSent': 0, 'queued': 0, 'throttled': 0, 'retries': 0, 'errors': 0, 'gaveUp': 0, 'hedged': 0, 'totalWaitSeconds': 0.0}
+
+
+    def refill(self, now): # adds the tokens earned since the last refill
+        self.tokens = min(self.burst, self.tokens + (now - self.updatedAt) * self.rate)
+        self.updatedAt = now
+
+
+    def tryTake(self): # takes a token if one is ready right now
+        now = time.monotonic()
+        self.refill(now)
+        if now < self.pausedUntil or self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+    def secondsUntilToken(self): # how long until tryTake could work again
+        now = time.monotonic()
+        return max(self.pausedUntil - now, (1 - self.tokens) / self.rate, 0.001)
+
+
+    def pause(self, seconds): # stop sending anything for a while (the API told us to back off)
+        self.pausedUntil = max(self.pausedUntil, time.monotonic() + seconds)
+
+
+    async def acquire(self, priority=None): # waits until this request is allowed to go out
+        if priority is None:
+            priority = currentPriority.get()
+        if not self.waiters and self.tryTake(): # nobody in line and a token is ready, go straight away
+            self.countSent(priority)
+            return
+        queuedAt = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.arrivals), future))
+        self.counters['queued'] += 1
+        if self.wakeTask is None or self.wakeTask.done() or self.wakeTask.get_loop() is not future.get_loop(): # not running (or left over from an old event loop)
+            self.wakeTask = asyncio.create_task(self.handOutTokens())
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled(): # we were given a token right as we got cancelled, put it back
+                self.tokens += 1
+            raise
+        self.countSent(priority)
+        self.counters['totalWaitSeconds'] += time.monotonic() - queuedAt
+
+
+    def countSent(self, priority): # counts a request that got its token
+        self.counters['sent'] += 1
+        if priority >= backgroundPriority: # the prewarmer uses this to stay inside its budget
+            self.counters['backgroundSent'] += 1
+
+
+    def tryHedge(self): # takes a token for a hedge, only if one is free right now and hedges are still a small share of what we send
+        if self.waiters or self.counters['hedged'] >= dh.hedgeFraction * self.counters['sent'] or not self.tryTake():
+            return False # a hedge never waits in line or pushes a command back
+        self.counters['hedged'] += 1
+        self.countSent(currentPriority.get())
+        return True
+
+
+    def interactiveWaiting(self): # True if a command (not background work) is waiting in line
+        return any(priority < backgroundPriority and not future.done() for priority, arrival, future in self.waiters)
+
+
+    async def handOutTokens(self): # gives tokens to the waiters in priority order as the bucket refills
+        while self.waiters:
+            if self.waiters[0][2].done(): # the command waiting here was cancelled, skip it
+                heapq.heappop(self.waiters)
+                continue
+            if self.tryTake():
+                priority, arrival, future = heapq.heappop(self.waiters)
+                future.set_result(None)
+            else:
+                await asyncio.sleep(self.secondsUntilToken())
+
+
+    def stats(self): # returns a copy of the counters plus the current state
+        stats = dict(self.counters)
+        stats['waiting'] = sum(1 for waiter in self.waiters if not waiter[2].done())
+        stats['tokens'] = round(self.tokens, 2)
+        stats['pausedFor'] = round(max(self.pausedUntil - time.monotonic(), 0.0), 2)
+        return stats
+
+
+
+
+# one limiter per API. spotify doesnt publish its limit (it is over a rolling 30 seconds), these are safe defaults
+limiters = {
+    "spotify": ApiLimiter("spotify", float(os.getenv("VIBECHECK_RATE_SPOTIFY", "8")), int(os.getenv("VIBECHECK_BURST_SPOTIFY", "16"))),
+    "genius": ApiLimiter("genius", float(os.getenv("VIBECHECK_RATE_GENIUS", "4")), int(os.getenv("VIBECHECK_BURST_GENIUS", "8"))),
+}
+
+# discord lets a bot send about 5 messages every 5 seconds in one channel. discord.py waits when it gets told off,
+# but pacing ourselves means long lyrics go out smoothly instead of in stop-and-go bursts
+channelRate = float(os.getenv("VIBECHECK_CHANNEL_RATE", "1")) # messages per second per channel
+channelBurst = int(os.getenv("VIBECHECK_CHANNEL_BURST", "5"))
+channelLimiters = {} # channel ID -> ApiLimiter
+maxTrackedChannels = 10000 # past this many channels, the ones with a full bucket (nobody talking there lately) are forgotten
+
+
+
+
+def getChannelLimiter(channelID): # the limiter for sending messages in one discord channel, made the first time the bot talks there
+    limiter = channelLimiters.get(channelID)
+    if limiter is None:
+        if len(channelLimiters) >= maxTrackedChannels:
+            forgetIdleLimiters(channelLimiters)
+        limiter = channelLimiters[channelID] = ApiLimiter(f"channel {channelID}", channelRate, channelBurst)
+    return limiter
+
+
+
+def forgetIdleLimiters(limiters): # drops the limiters that have refilled all the way with nobody waiting, a new one would be the same
+    now = time.monotonic()
+    for key, limiter in list(limiters.items()):
+        limiter.refill(now)
+        if limiter.tokens >= limiter.burst and not limiter.waiters and now >= limiter.pausedUntil:
+            del limiters[key]
+
+
+
+def retryAfterSeconds(response): # reads the Retry-After header, which is either a number of seconds or a date
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError): # not a date either, ignore it
+        return None
+
+
+
+def backoffSeconds(attempt): # full jitter: a random wait between 0 and base * 2^attempt (capped)
+    return random.uniform(0, min(backoffCapSeconds, backoffBaseSeconds * 2 ** attempt))
+
+
+
+@contextlib.contextmanager
+def background(): # marks everything inside as background work, so commands people are waiting on go first
+    '''
+    example:
+        with rl.background():
+            await fetchTopTracksAsync(artistID)
+    '''
+    token = currentPriority.set(backgroundPriority)
+    try:
+        yield
+    finally:
+        currentPriority.reset(token)
+
+
+
+async def call(api, coroutineFunction, *args, **kwargs): # sends one request through the API's bucket, retrying when it is told to slow down
+    '''
+    args:
+        api (str): "spotify" or "genius"
+        coroutineFunction (async function): makes the request, usually hh.getJSON / hh.getText / hh.postJSON
+        *args, **kwargs: passed to coroutineFunction
+
+    returns:
+        whatever coroutineFunction returns. errors that arent worth retrying (like a 404) are raised right away,
+        and UpstreamBusyError is raised if the API is still refusing after every retry
+
+    example:
+        response = await rl.call("genius", hh.getJSON, url, params=params, headers=headers)
+    '''
+    limiter = limiters[api]
+    for attempt in range(retryAttempts):
+        await limiter.acquire()
+        try:
+            if coroutineFunction in hedgeableFunctions:
+                return await dh.hedge(lambda: timedRequest(limiter, coroutineFunction, args, kwargs), limiter.latency.percentile(dh.hedgePercentile), limiter.tryHedge)
+            return await timedRequest(limiter, coroutineFunction, args, kwargs)
+        except httpx.HTTPStatusError as error:
+            limiter.counters['errors'] += 1
+            if error.response.status_code not in retryStatusCodes:
+                raise # 401, 404 and so on wont get better by trying again
+            reason = f"HTTP {error.response.status_code}"
+            waitSeconds = retryAfterSeconds(error.response)
+            if error.response.status_code == 429:
+                limiter.counters['throttled'] += 1
+        except httpx.TransportError as error: # timeouts, dropped connections
+            limiter.counters['errors'] += 1
+            reason = type(error).__name__
+            waitSeconds = None
+
+        if waitSeconds is None:
+            waitSeconds = backoffSeconds(attempt)
+        elif waitSeconds > maxRetryAfterSeconds: # asked to wait longer than anyone will sit in front of a command
+            limiter.pause(waitSeconds)
+            limiter.counters['gaveUp'] += 1
+            raise UpstreamBusyError(api, f"{reason}, retry after {waitSeconds:.0f}s")
+        else:
+            limiter.pause(waitSeconds) # the whole API is overloaded, hold everyone in line, not just this request
+        if attempt == retryAttempts - 1: # that was the last try
+            break
+        if waitSeconds >= dh.remaining(): # the command would run out of time before the retry even starts
+            limiter.counters['gaveUp'] += 1
+            raise UpstreamBusyError(api, f"{reason}, no time left to retry")
+        limiter.counters['retries'] += 1
+        await asyncio.sleep(waitSeconds)
+
+    limiter.counters['gaveUp'] += 1
+    raise UpstreamBusyError(api, f"{reason} after {retryAttempts} tries")
+
+
+
+async def timedRequest(limiter, coroutineFunction, args, kwargs): # one try of a request, timed for the API's latency tracker
+    startedAt = time.monotonic()
+    result = await coroutineFunction(*args, **kwargs)
+    limiter.latency.observe(time.monotonic() - startedAt)
+    return result
+
+
+
+def getStats(): # returns the stats for every API
+    return {api: limiter.stats() for api, limiter in limiters.items()}
@@ -0,0 +1,181 @@
+'''
+shardHelper.py
+
+This helper file lets the bot run as several processes (shards) instead of one.
+
+One python process only really uses one CPU core (the GIL), and one discord gateway connection has to handle every
+server the bot is in. Discord's answer for bigger bots is sharding: the servers are split into shard_count groups
+(a server goes to shard (server ID >> 22) % shard_count) and each shard is its own gateway connection. Here the
+shards are spread over several bot processes that a small supervisor starts (and restarts if one crashes).
+Turn it on in the 3510.env file (or the shell):
+    VIBECHECK_SHARDS=4              total number of discord shards (1 = no sharding, the default)
+    VIBECHECK_SHARD_PROCESSES=2     how many bot processes to spread them over (default: one per core, at most one per shard)
+
+and start the bot the normal way, python musicBot.py. The supervisor gives each process:
+    - its shard IDs (process 0 gets shards 0 and 2, process 1 gets 1 and 3), which it runs with an AutoShardedBot
+    - its share of the CPU workers, the Spotify/Genius rate limits, the prewarm budget and the in-flight command
+      limit, so all of them together stay at the same totals
+    - its own metrics port (VIBECHECK_METRICS_PORT + process number). the lyrics index folder is shared (see
+      lyricsIndexHelper.py), except on windows where each process keeps its own
+    - VIBECHECK_SHARED_CACHE=1, so the lyrics, spotify and sentiment caches are shared through cacheHelper's tier 2
+      (the SQLite files in WAL mode, or a Redis server with VIBECHECK_CACHE_BACKEND=redis) and the single flights
+      take leases in it, so a song that two shards ask for at the same moment still only gets fetched once
+
+Discord sharding: https://discord.com/developers/docs/events/gateway#sharding
+AutoShardedBot: https://discordpy.readthedocs.io/en/stable/ext/commands/api.html#discord.ext.commands.AutoShardedBot
+'''
+
+import os # operating system module for accessing environment variables
+import signal # forwards ctrl+c / stop signals to the shard processes
+import subprocess # starts the shard processes
+import sys # sys.executable is the python running us, the shards use the same one
+import time # restart backoff and startup spacing
+from discord.ext import commands # Bot and AutoShardedBot
+import admissionHelper as ah # the in-flight command limit to share out
+import executorHelper as eh # how many CPU workers there are to share out
+import prewarmHelper as pwh # the prewarm budget to share out
+import rateLimitHelper as rl # the API rate limits to share out
+
+startDelaySeconds = 5.0 # discord only lets a bot connect (IDENTIFY) about one shard every 5 seconds, so the processes start spaced out
+restartBackoffCapSeconds = 60.0 # longest wait before restarting a shard process that keeps crashing
+stopGraceSeconds = 15.0 # how long the shards get to shut down cleanly before they are killed
+
+
+
+
+def getShardCount(): # total discord shards (read when needed so the 3510.env file has been loaded)
+    return max(int(os.getenv("VIBECHECK_SHARDS", "1")), 1)
+
+
+
+def getProcessCount(): # how many bot processes the shards are spread over
+    return max(min(int(os.getenv("VIBECHECK_SHARD_PROCESSES", str(os.cpu_count() or 1))), getShardCount()), 1)
+
+
+
+def getShardIDs(): # the shards this process runs, set by the supervisor (None = all of them)
+    shardIDs = os.getenv("VIBECHECK_SHARD_IDS")
+    if shardIDs is None:
+        return None
+    return [int(shardID) for shardID in shardIDs.split(",")]
+
+
+
+def assignShards(shardCount, processCount): # splits the shard IDs over the processes round robin
+    '''
+    example:
+        assignShards(4, 2) == [[0, 2], [1, 3]]
+    '''
+    return [list(range(processIndex, shardCount, processCount)) for processIndex in range(processCount)]
+
+
+
+def makeBot(**botOptions): # the bot object for musicBot.py, sharded when VIBECHECK_SHARDS is more than 1
+    '''
+    args:
+        **botOptions: passed on to commands.Bot / commands.AutoShardedBot (command_prefix, intents...)
+
+    example:
+        bot = shh.makeBot(command_prefix="/", intents=intents)
+    '''
+    shardCount = getShardCount()
+    if shardCount == 1:
+        return commands.Bot(**botOptions)
+    return commands.AutoShardedBot(shard_count=shardCount, shard_ids=getShardIDs(), **botOptions)
+
+
+
+def shouldSupervise(): # True when this is the process the user started and there are several shard processes to run
+    return getShardIDs() is None and getProcessCount() > 1
+
+
+
+def shardProcessEnvironment(processIndex, shardIDs, processCount): # the environment variables one shard process gets
+    environment = dict(os.environ)
+    environment['VIBECHECK_SHARD_IDS'] = ",".join(str(shardID) for shardID in shardIDs)
+    environment['VIBECHECK_PROCESS_INDEX'] = str(processIndex)
+    environment['VIBECHECK_SHARED_CACHE'] = "1"
+    environment['VIBECHECK_CPU_WORKERS'] = str(max(eh.cpuWorkerCount // processCount, 1)) # VIBECHECK_CPU_WORKERS is the total for the whole bot too
+    for backend, limit in eh.backendLimits.items(): # and so are the vader and plot limits
+        environment[f"VIBECHECK_LIMIT_{backend.upper()}"] = str(max(limit // processCount, 1))
+    for api, limiter in rl.limiters.items(): # each process gets an even slice of every API's rate limit
+        environment[f"VIBECHECK_RATE_{api.upper()}"] = str(limiter.rate / processCount)
+        environment[f"VIBECHECK_BURST_{api.upper()}"] = str(max(limiter.burst // processCount, 1))
+    environment['VIBECHECK_PREWARM_CALLS_PER_HOUR'] = str(pwh.callsPerHour / processCount)
+    environment['VIBECHECK_MAX_INFLIGHT'] = str(max(ah.maxInFlight // processCount, 1)) # a server's commands all land on one process, the per-server buckets dont need splitting
+    metricsPort = int(os.getenv("VIBECHECK_METRICS_PORT", "0"))
+    if metricsPort:
+        environment['VIBECHECK_METRICS_PORT'] = str(metricsPort + processIndex)
+    return environment
+
+
+
+def stopShardProcesses(processes): # asks every shard process to stop, then kills the ones that dont
+    for process in processes:
+        if process.poll() is None:
+            if os.name == "posix":
+                process.send_signal(signal.SIGINT) # same as ctrl+c, so the bot closes its connections and flushes the lyrics index
+            else:
+                process.terminate()
+    stopBy = time.monotonic() + stopGraceSeconds
+    for process in processes:
+        try:
+            process.wait(timeout=max(stopBy - time.monotonic(), 0.1))
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+
+def stopSupervisor(signalNumber, frame): # turns a stop signal into KeyboardInterrupt so runSupervisor cleans up
+    raise KeyboardInterrupt
+
+
+
+def runSupervisor(scriptPath): # starts one bot process per shard group and keeps them running
+    '''
+    args:
+        scriptPath (str): the bot file every shard process runs (musicBot.py passes its own __file__)
+
+    the shards start spaced out by startDelaySeconds per shard. a process that crashes is restarted after a wait
+    that doubles every time (up to restartBackoffCapSeconds), and one that exits cleanly is left stopped.
+    ctrl+c (or a stop signal) stops every shard process.
+    '''
+    shardCount = getShardCount()
+    shardGroups = assignShards(shardCount, getProcessCount())
+    processCount = len(shardGroups)
+    print(f"Starting {shardCount} shards in {processCount} processes: {shardGroups}")
+    signal.signal(signal.SIGTERM, stopSupervisor)
+
+    processes = {} # process index -> subprocess.Popen
+    startedAt = {} # process index -> when it was last started
+    crashCounts = {} # process index -> crashes in a row, for the backoff
+    now = time.monotonic()
+    startAt = {processIndex: now + processIndex * startDelaySeconds * len(shardGroups[0]) for processIndex in range(processCount)} # process index -> when to (re)start it
+    try:
+        while processes or startAt:
+            now = time.monotonic()
+            for processIndex, when in list(startAt.items()):
+                if now >= when:
+                    del startAt[processIndex]
+                    environment = shardProcessEnvironment(processIndex, shardGroups[processIndex], processCount)
+                    processes[processIndex] = subprocess.Popen([sys.executable, scriptPath], env=environment)
+                    startedAt[processIndex] = now
+            for processIndex, process in list(processes.items()):
+                exitCode = process.poll()
+                if exitCode is None: # still running
+                    continue
+                del processes[processIndex]
+                if exitCode == 0:
+                    print(f"Shard process {processIndex} (shards {shardGroups[processIndex]}) stopped")
+                    continue
+                if now - startedAt[processIndex] > restartBackoffCapSeconds: # it ran for a good while, this isnt a crash loop
+                    crashCounts[processIndex] = 0
+                crashCounts[processIndex] = crashCounts.get(processIndex, 0) + 1
+                waitSeconds = min(2 ** crashCounts[processIndex], restartBackoffCapSeconds)
+                print(f"Shard process {processIndex} (shards {shardGroups[processIndex]}) exited with {exitCode}, restarting in {waitSeconds:.0f}s")
+                startAt[processIndex] = now + waitSeconds
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        print("Stopping the shard processes")
+    finally:
+        stopShardProcesses(list(processes.values()))
@@ -0,0 +1,132 @@
+'''
+singleFlightHelper.py
+
+This helper file makes identical requests that happen at the same time share one piece of work.
+
+When a song is trending, a bunch of people run /lyrics or /sentiment on it within a few seconds. The cache
+only helps once the first fetch has finished, so before that every user would start their own Genius
+fetch for the exact same song. With a SingleFlight, the first caller starts the work and everyone else
+who asks for the same key while it is still running just waits for that same result. So a burst costs
+one upstream call per unique song instead of one per user.
+
+When the bot runs as several shard processes, a SingleFlight that is given the cache its work fills also
+covers the other processes: before fetching, it takes a lease on the key in the shared cache. If another
+shard already holds it, we wait for that shard's answer to show up in the cache instead of fetching it again.
+
+The shared work runs in a clean context of its own: it doesnt inherit the deadline of the command that happened
+to start it (so it keeps going after that command gives up, and fills the cache), only its priority. If a command
+joins work that background work started (like the prewarmer), the work is moved up to the command's priority.
+
+Some callers cant use a cached "not found" (None) as the answer: picking a /searchlyrics result goes straight to the
+song page, which can work even when a search by name found nothing. They pass acceptMissing=False, and then neither
+another shard's None in the cache nor a name fetch running in this process counts as their answer.
+
+(the name comes from Go's "singleflight" package which does the same thing: https://pkg.go.dev/golang.org/x/sync/singleflight)
+'''
+
+import asyncio # the shared work is an asyncio task that every waiter awaits
+import contextvars # the shared work gets a clean context, not the first caller's deadline
+import time # for how long we wait on another process
+import cacheHelper as ch # the shared cache the cross-process leases live in
+import rateLimitHelper as rl # the priority the shared work waits in the rate limiters at
+
+leaseSeconds = 30.0 # longest we wait for another process before fetching it ourselves (a shard that died doesnt hold things up for longer)
+pollSeconds = 0.05 # how often we look in the cache while another process is fetching
+
+
+
+
+class SingleFlight: # one of these per kind of work (lyrics fetches, artist lookups, vader runs...)
+    '''
+    args:
+        name (str): a label for this flight group, handy when printing stats
+        cache (TwoTierCache): optional, the cache the work stores its result in under the same key. when the cache is
+                              shared between processes (ch.sharedAcrossProcesses) the flight covers every process
+
+    example:
+        lyricsFlight = SingleFlight("lyrics", cache=lyricsCache)
+        lyrics = await lyricsFlight.do(cacheKey, fetchLyricsAsync, artistName, songTitle)
+    '''
+
+    def __init__(self, name, cache=None):
+        self.name = name
+        self.cache = cache
+        self.inFlight = {} # key -> the asyncio task that is doing the work for that key right now
+        self.contexts = {} # key -> the context that task runs in (so a command joining it can raise its priority)
+        self.counters = {'started': 0, 'shared': 0, 'otherProcess': 0} # started = real upstream calls, shared = callers that piggybacked on one, otherProcess = answers another shard fetched
+
+
+    async def do(self, key, coroutineFunction, *args, acceptMissing=True, **kwargs): # run coroutineFunction(*args, **kwargs) once per key at a time
+        '''
+        args:
+            key (str): identical requests must produce the same key (for example ch.normalizeKey(artist, title))
+            coroutineFunction (async function): the work to do if nobody is doing it yet
+            *args, **kwargs: passed to coroutineFunction
+            acceptMissing (bool): False if a "not found" (None) that another shard put in the cache isnt an answer for
+                                  this caller, so it does the work itself once that shard is done
+
+        returns:
+            whatever coroutineFunction returns. if it raises, every waiter gets the same exception
+        '''
+        flightKey = key if acceptMissing else (key, "found") # work that can end in None isnt shared with callers that need more than that
+        task = self.inFlight.get(flightKey)
+        if task is not None: # someone is already fetching this, wait for their answer
+            self.counters['shared'] += 1
+            self.raisePriority(flightKey)
+        else: # we are the first, start the work
+            if self.cache is not None and ch.sharedAcrossProcesses:
+                work = self.doAcrossProcesses(key, acceptMissing, coroutineFunction, *args, **kwargs)
+            else:
+                self.counters['started'] += 1
+                work = coroutineFunction(*args, **kwargs)
+            # a clean context, so the work doesnt stop when the first caller's latency budget runs out
+            context = contextvars.Context()
+            context.run(rl.currentPriority.set, rl.currentPriority.get())
+            task = asyncio.create_task(work, context=context)
+            self.inFlight[flightKey] = task
+            self.contexts[flightKey] = context
+            task.add_done_callback(lambda finishedTask: self.forget(flightKey, finishedTask)) # the next request after this one finishes starts fresh (and usually hits the cache)
+        # shield so that one user cancelling their command doesnt cancel the work everyone else is waiting on
+        return await asyncio.shield(task)
+
+
+    def raisePriority(self, key): # a command joined work that background work started, so it shouldnt wait behind other commands anymore
+        context = self.contexts.get(key)
+        priority = rl.currentPriority.get()
+        if context is not None and priority < context.run(rl.currentPriority.get):
+            context.run(rl.currentPriority.set, priority) # the work's next requests go out at the command's priority
+
+
+    async def doAcrossProcesses(self, key, acceptMissing, coroutineFunction, *args, **kwargs): # the work, but only if no other process is already doing it
+        giveUpAt = time.monotonic() + leaseSeconds
+        while not await self.cache.claimAsync(key, leaseSeconds): # another shard is fetching this key
+            found, value = await self.cache.peekAsync(key)
+            if found and (acceptMissing or value is not None): # it finished, use its answer
+                self.counters['otherProcess'] += 1
+                return value
+            if time.monotonic() > giveUpAt: # it is taking too long (or that shard died), do it ourselves
+                break
+            await asyncio.sleep(pollSeconds)
+        try:
+            found, value = await self.cache.peekAsync(key) # another shard may have finished it between our caller's cache check and our claim
+            if found and (acceptMissing or value is not None):
+                self.counters['otherProcess'] += 1
+                return value
+            self.counters['started'] += 1
+            return await coroutineFunction(*args, **kwargs)
+        finally:
+            await self.cache.releaseAsync(key)
+
+
+    def forget(self, key, finishedTask): # removes a finished task from inFlight
+        if self.inFlight.get(key) is finishedTask: # only remove it if a newer task hasnt replaced it
+            del self.inFlight[key]
+            del self.contexts[key]
+        if not finishedTask.cancelled():
+            finishedTask.exception() # marks the exception as retrieved so asyncio doesnt warn when nobody was left waiting
+
+
+    def stats(self): # returns a copy of the counters plus how many keys are in flight right now
+        stats = dict(self.counters)
+        stats['inFlight'] = len(self.inFlight)
+        return stats
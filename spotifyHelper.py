@@ -1,17 +1,53 @@
 import os # operating system module for accessing environment variables
 from dotenv import load_dotenv # loads environment variables from .env file
-import spotipy # spotipy library makes Spotify API easier to use
-from spotipy.oauth2 import SpotifyClientCredentials # imports the authentication we neeed for spotify 
+import re # regular expressions for normalizing artist names
+import threading # for refreshing stale top tracks in the background
+import asyncio # for the async versions of the helper functions
+import contextvars # the background refresh runs in a clean context, not the command's
+import time # for knowing when the async spotify token expires
+import cacheHelper as ch # our two tier (memory + disk) cache
+import httpHelper as hh # shared pooled async HTTP client
+import singleFlightHelper as sfh # shares one lookup between identical requests that arrive at the same time
+import metricsHelper as mh # times each spotify request for the latency histograms
+import rateLimitHelper as rl # keeps our requests under spotify's rate limit and retries 429s
+import startupHelper as suh # times the lazy spotipy setup when the startup profile is turned on
 load_dotenv("3510.env") # loads our Spotify credentials from the 3510.env file
 
-# create the authentication manager using our Spotify client ID and secret from the .env file
-clientCredentialManager = SpotifyClientCredentials(
-    client_id=os.getenv("SPOTIFY_CLIENT_ID"), # gets the client ID from environment variables
-    client_secret=os.getenv("SPOTIFY_CLIENT_SECRET") # gets the client secret from environment variables
+# the spotipy client is only made the first time a sync function needs it (see getSpotify below). importing spotipy
+# is slow and the bot's commands use the async functions, so most of the time it never gets made at all
+sp = None
+spLock = threading.Lock() # the executor can call getSpotify from several threads at once
+
+# artist name -> (artist ID, spotify's spelling of the name). artist IDs never change so this can live a long time
+artistIndex = ch.TwoTierCache(
+    "spotify_artists",
+    ttlSeconds=float(os.getenv("SPOTIFY_ARTIST_CACHE_TTL", 90 * 24 * 3600)), # 90 days
+    negativeTtlSeconds=float(os.getenv("SPOTIFY_ARTIST_CACHE_NEGATIVE_TTL", 600)), # "not found" only for 10 minutes in case of a typo fix on spotify's end
+    maxMemoryItems=5000, # tiny entries so we can keep a lot of them in memory
+    maxDiskItems=200000,
+)
+
+# artist ID -> set of top track tuples. popularity changes, so these are only fresh for a few hours, but we keep
+# serving the old list for up to a week while a background thread fetches a new one (stale-while-revalidate)
+topTracksCache = ch.TwoTierCache(
+    "spotify_top_tracks",
+    ttlSeconds=float(os.getenv("SPOTIFY_TOP_TRACKS_CACHE_TTL", 6 * 3600)), # 6 hours
+    staleSeconds=float(os.getenv("SPOTIFY_TOP_TRACKS_STALE_SECONDS", 7 * 24 * 3600)), # 1 week
+    maxMemoryItems=2000,
+    maxDiskItems=50000,
 )
 
-# create the Spotify API client object that we'll use to make all our Spotify requests
-sp = spotipy.Spotify(client_credentials_manager=clientCredentialManager) # this sp object lets us search artists, get tracks, etc.
+refreshingArtistIDs = set() # artist IDs that already have a background refresh running, so we only start one each
+refreshLock = threading.Lock() # guards refreshingArtistIDs since the executor calls us from several threads
+backgroundTasks = set() # async refresh tasks, we hold a reference so python doesnt garbage collect them while they run
+
+# the async functions talk to the Spotify Web API directly through httpHelper instead of through spotipy
+spotifyApiBase = os.getenv("SPOTIFY_API_BASE", "https://api.spotify.com/v1") # can point at a local stand-in for testing
+spotifyTokenUrl = os.getenv("SPOTIFY_TOKEN_URL", "https://accounts.spotify.com/api/token")
+asyncToken = {'accessToken': None, 'expiresAt': 0.0} # client credentials token for the async functions
+asyncTokenLock = None # asyncio.Lock made on first use so only one coroutine fetches a new token at a time
+artistFlight = sfh.SingleFlight("spotify artists", cache=artistIndex) # concurrent searches for the same artist share one request
+topTracksFlight = sfh.SingleFlight("spotify top tracks", cache=topTracksCache) # same for top tracks of the same artist ID
 
 '''
 spotifyHelper.py
@@ -23,30 +59,120 @@ Uses the Spotipy library to simplify Spotify API calls.
 Spotipy documentation: https://spotipy.readthedocs.io/
 '''
 
-# make a function to get the top 10 songs from an artist. 
-def getTopTracks(artistName): # defines a function that takes an artist name as input
-    # get the top tracks for a given artist name
-    # returns a set of tuples containing the track name, album name, and the popularity
-    # search for the artist
-    results = sp.search(q=artistName, type='artist', limit=1) # searches Spotify for the artist, q is the query, type='artist' means only search for artists not songs, limit=1 returns only the best match
-    
+def getSpotify(): # returns the spotipy client, making it the first time
+    '''
+    returns:
+        spotipy.Spotify: the client the sync functions (resolveArtist, fetchTopTracks) use
+    '''
+    global sp # we are changing the module level variable, not making a local one
+    with spLock:
+        if sp is None:
+            with suh.timed("spotipy client"):
+                import spotipy # spotipy library makes Spotify API easier to use
+                from spotipy.oauth2 import SpotifyClientCredentials # imports the authentication we neeed for spotify 
+                # create the authentication manager using our Spotify client ID and secret from the .env file
+                clientCredentialManager = SpotifyClientCredentials(
+                    client_id=os.getenv("SPOTIFY_CLIENT_ID"), # gets the client ID from environment variables
+                    client_secret=os.getenv("SPOTIFY_CLIENT_SECRET") # gets the client secret from environment variables
+                )
+                # create the Spotify API client object that we'll use to make all our Spotify requests
+                sp = spotipy.Spotify(client_credentials_manager=clientCredentialManager) # this sp object lets us search artists, get tracks, etc.
+    return sp
+
+
+
+def normalizeArtistName(artistName): # turns "The Weeknd", "the weeknd!" and "Weeknd" into the same key
+    '''
+    Normalize an artist name for the artist index so it doesnt matter how a user types it.
+    Lowercases, drops accents and punctuation (via ch.normalizeKey), drops a leading "the",
+    and removes spaces so "macmiller" and "Mac Miller" match.
+
+    args:
+        artistName (str): the name the user typed
+
+    returns:
+        str: the key used in artistIndex
+    '''
+    key = ch.normalizeKey(artistName) # lowercase, no accents, no punctuation
+    key = re.sub(r"^the ", "", key) # "the beatles" -> "beatles"
+    return key.replace(" ", "") # "mac miller" -> "macmiller"
+
+
+
+def resolveArtist(artistName): # finds the spotify artist ID for a name, using the artist index first
+    '''
+    Look up an artist's spotify ID and proper name.
+
+    args:
+        artistName (str): the name the user typed
+
+    returns:
+        tuple: (artistID, artistActualName), or None if spotify doesnt know the artist
+    '''
+    key = normalizeArtistName(artistName)
+    found, artist = artistIndex.get(key) # zero API calls if we have seen this artist before
+    if found:
+        return artist # this is None if we already know the artist doesnt exist
+
+    results = getSpotify().search(q=artistName, type='artist', limit=1) # searches Spotify for the artist, q is the query, type='artist' means only search for artists not songs, limit=1 returns only the best match
+    return rememberArtist(key, results)
+
+
+
+def rememberArtist(key, results): # pulls the artist out of a search response and stores it in artistIndex
+    artist = artistFromResults(results)
+    if artist is None:
+        artistIndex.setMissing(key) # remember the miss for a little while
+        return None # returns None so we can check for this error in the main bot file
+    artistIndex.set(key, artist) # remember it under what the user typed
+    artistIndex.set(normalizeArtistName(artist[1]), artist) # and under spotify's spelling so other spellings that normalize to it hit too
+    return artist
+
+
+
+async def rememberArtistAsync(key, results): # async version of rememberArtist (artistIndex's disk tier is written in a thread)
+    artist = artistFromResults(results)
+    if artist is None:
+        await artistIndex.setMissingAsync(key)
+        return None
+    await artistIndex.setAsync(key, artist)
+    await artistIndex.setAsync(normalizeArtistName(artist[1]), artist)
+    return artist
+
+
+
+def artistFromResults(results): # the (artistID, artistActualName) out of a search response, or None (shared by the sync and async versions)
     # now check if the artist was found
     if not results['artists']['items']: # results['artists']['items'] is a list, if it's empty that means no artist was found
-        return None # returns None so we can check for this error in the main bot file
-    
+        return None
+
     # this is how we get the artist id which is needed to ask for the top 10 songs, and since its a bot
     # having this in the function is necessary since i dont just have a database of all artists ID somewhere. 
     # we have to find a way to search for it and how i did that in project 1 as well as in class notes is we have to 
     # sift through the disctionary to get the ID since the only other way is to manually go to the artist's spotify
     # url and grab it from the end but idk how to do that and this works so here we go
+    # (now we do kind of have a database of artist IDs: artistIndex remembers every one we have looked up)
     artistID = results['artists']['items'][0]['id'] # navigates through the nested dictionary: results is a dict, ['artists'] gets the artists section, ['items'] gets the list of artists, [0] gets the first artist, ['id'] gets their unique Spotify ID
     artistActualName = results['artists']['items'][0]['name'] # this is so that it gives us the spotify name, which is cleaner than
     # a name just written in whatever way like "macmiller" or "MACMILLER" or "mac Miller"... it just returns whatever name is in that 
     # spotify artists dictionary, ideally "Mac Miller"
+
+    return (artistID, artistActualName)
+
+
+
+def fetchTopTracks(artistID): # asks spotify for the top tracks of an artist ID and stores them in topTracksCache
     # Get top tracks
     # this literally just takes the ID we just got and named "artistID" and fetches the top 10 songs which is what spotify
     # artist_top_tracks does. we dont need to specify anywhere for only 10 becuase this only gives us the top 10. 
-    topTracks = sp.artist_top_tracks(artistID, country='US') # calls the Spotify API method to get top tracks for this artist ID, US so it gives us US popularity rankings
+    topTracks = getSpotify().artist_top_tracks(artistID, country='US') # calls the Spotify API method to get top tracks for this artist ID, US so it gives us US popularity rankings
+    setOfTrackData = trackDataFromResponse(topTracks)
+    topTracksCache.set(artistID, setOfTrackData) # fresh for the next few hours
+    return setOfTrackData
+
+
+
+def trackDataFromResponse(topTracks): # turns a top tracks response into our set of tuples (shared by the sync and async versions)
     tracks = topTracks['tracks'] # and here we are naming the top tracks that we retrieved as tracks to give us just the tracks list from the response dictionary
     
     # create set to store track data which will contain tuples... this is just like in Dr. Zietz's reverb helper functions py file 
@@ -61,5 +187,159 @@ def getTopTracks(artistName): # defines a function that takes an artist name as
         
         trackDataTuple = (trackName, albumName, popularity) # here is the tuple we will be bundling up and storing in the setOfTrackData set, parentheses create a tuple
         setOfTrackData.add(trackDataTuple) # here is where we add it, .add() is the method for adding items to a set
+
+    return setOfTrackData
+
+
+
+def refreshTopTracksInBackground(artistID): # refetches stale top tracks on a background thread so the user doesnt wait
+    with refreshLock:
+        if artistID in refreshingArtistIDs: # someone already started a refresh for this artist
+            return
+        refreshingArtistIDs.add(artistID)
+
+    def refresh(): # runs on the background thread
+        try:
+            fetchTopTracks(artistID)
+        except Exception as error: # a failed refresh just means we keep serving the stale list a bit longer
+            print(f"Background refresh of top tracks for {artistID} failed: {error}")
+        finally:
+            with refreshLock:
+                refreshingArtistIDs.discard(artistID)
+
+    threading.Thread(target=refresh, daemon=True).start() # daemon=True so this thread never keeps the bot from shutting down
+
+
+
+# make a function to get the top 10 songs from an artist. 
+def getTopTracks(artistName): # defines a function that takes an artist name as input
+    # get the top tracks for a given artist name
+    # returns a set of tuples containing the track name, album name, and the popularity
+    # the artist ID comes from artistIndex and the tracks from topTracksCache when we have them, so a popular artist costs zero API calls
+    artist = resolveArtist(artistName) # finds the artist ID (from the index or a spotify search)
+    
+    # now check if the artist was found
+    if artist is None: # resolveArtist returns None when spotify doesnt know the artist
+        return None # returns None so we can check for this error in the main bot file
+    artistID, artistActualName = artist # unpacks the tuple into the ID and spotify's spelling of the name
+
+    found, setOfTrackData, isStale = topTracksCache.lookup(artistID) # check the cache, stale entries are still returned
+    if not found: # never fetched (or too old even to serve stale), so the user has to wait for spotify
+        setOfTrackData = fetchTopTracks(artistID)
+    elif isStale: # serve the old list right now and refresh it for next time
+        refreshTopTracksInBackground(artistID)
     
-    return setOfTrackData, artistActualName # returns two things: the set of track data and the artist actual name that we got earlier in the code, this is called tuple unpacking
\ No newline at end of file
+    return setOfTrackData, artistActualName # returns two things: the set of track data and the artist actual name that we got earlier in the code, this is called tuple unpacking
+
+
+
+
+
+# ---------------------------------------------------------------------------------------------
+# async versions. same caches and same return values as the functions above, but the requests go
+# through the shared pooled client in httpHelper.py so they dont need a thread each.
+# ---------------------------------------------------------------------------------------------
+
+async def getSpotifyTokenAsync(): # gets (and reuses) a client credentials access token
+    '''
+    Spotify's client credentials flow: POST our client ID and secret, get back a token that lasts an hour.
+    Documented at: https://developer.spotify.com/documentation/web-api/tutorials/client-credentials-flow
+
+    returns:
+        str: the access token
+    '''
+    global asyncTokenLock
+    if asyncTokenLock is None:
+        asyncTokenLock = asyncio.Lock()
+    async with asyncTokenLock: # if 50 commands need a token at once, only the first one actually asks for it
+        if asyncToken['accessToken'] is None or asyncToken['expiresAt'] - 60 < time.time(): # missing or about to expire
+            with mh.span("spotify_token"):
+                tokenInfo = await rl.call(
+                    "spotify",
+                    hh.postJSON,
+                    spotifyTokenUrl,
+                    data={'grant_type': 'client_credentials'},
+                    auth=(os.getenv("SPOTIFY_CLIENT_ID"), os.getenv("SPOTIFY_CLIENT_SECRET")), # basic auth with our client ID and secret
+                )
+            asyncToken['accessToken'] = tokenInfo['access_token']
+            asyncToken['expiresAt'] = time.time() + tokenInfo.get('expires_in', 3600)
+        return asyncToken['accessToken']
+
+
+
+async def spotifyGetAsync(path, params=None): # GET request to the Spotify Web API with our token
+    token = await getSpotifyTokenAsync()
+    return await rl.call("spotify", hh.getJSON, f"{spotifyApiBase}{path}", params=params, headers={'Authorization': f"Bearer {token}"})
+
+
+
+async def resolveArtistAsync(artistName): # async version of resolveArtist
+    key = normalizeArtistName(artistName)
+    found, artist = await artistIndex.getAsync(key)
+    if found:
+        return artist
+    return await artistFlight.do(key, searchArtistAsync, key, artistName)
+
+
+
+async def searchArtistAsync(key, artistName): # the actual spotify search behind resolveArtistAsync
+    with mh.span("spotify_search"):
+        results = await spotifyGetAsync("/search", params={'q': artistName, 'type': 'artist', 'limit': 1}) # same search as sp.search above
+    return await rememberArtistAsync(key, results)
+
+
+
+async def fetchTopTracksAsync(artistID): # async version of fetchTopTracks
+    with mh.span("spotify_top_tracks"):
+        topTracks = await spotifyGetAsync(f"/artists/{artistID}/top-tracks", params={'country': 'US'})
+    setOfTrackData = trackDataFromResponse(topTracks)
+    await topTracksCache.setAsync(artistID, setOfTrackData) # fresh for the next few hours
+    return setOfTrackData
+
+
+
+def refreshTopTracksInBackgroundAsync(artistID): # async version of refreshTopTracksInBackground, runs as a task on the event loop
+    with refreshLock:
+        if artistID in refreshingArtistIDs:
+            return
+        refreshingArtistIDs.add(artistID)
+
+    async def refresh():
+        try:
+            with rl.background(): # nobody is waiting on this, so commands go ahead of it in the rate limiter
+                await topTracksFlight.do(artistID, fetchTopTracksAsync, artistID) # through the flight so only one shard refreshes it
+        except Exception as error:
+            print(f"Background refresh of top tracks for {artistID} failed: {error}")
+        finally:
+            with refreshLock:
+                refreshingArtistIDs.discard(artistID)
+
+    # a clean context: the refresh shouldnt inherit the latency budget of the command that noticed the stale entry
+    task = asyncio.create_task(refresh(), context=contextvars.Context())
+    backgroundTasks.add(task) # keep a reference until it finishes
+    task.add_done_callback(backgroundTasks.discard)
+
+
+
+async def getTopTracksAsync(artistName): # async version of getTopTracks
+    '''
+    Same as getTopTracks, but awaitable and running on the shared pooled HTTP client.
+
+    returns:
+        tuple: (setOfTrackData, artistActualName), or None if the artist wasnt found
+
+    example:
+        result = await shf.getTopTracksAsync("Mac Miller")
+    '''
+    artist = await resolveArtistAsync(artistName)
+    if artist is None:
+        return None
+    artistID, artistActualName = artist
+
+    found, setOfTrackData, isStale = await topTracksCache.lookupAsync(artistID)
+    if not found:
+        setOfTrackData = await topTracksFlight.do(artistID, fetchTopTracksAsync, artistID)
+    elif isStale:
+        refreshTopTracksInBackgroundAsync(artistID)
+
+    return setOfTrackData, artistActualName
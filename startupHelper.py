@@ -0,0 +1,111 @@
+'''
+startupHelper.py
+
+This helper file measures how long the bot takes to start up, so we can see which imports are slow.
+
+Importing musicBot.py used to pull in matplotlib, nltk, spotipy and lyricsgenius, download the vader
+lexicon (a network call!) and build every API client before the bot even logged in. Now the helper files
+only build those things the first time a command needs them, and this file lets us check that it stays fast.
+
+Turn on the profile mode by adding this to the 3510.env file (or the shell):
+    VIBECHECK_PROFILE_IMPORTS=1
+
+and the bot prints a table of the slowest imports (and the lazy setups like the vader lexicon) once it
+connects. You can also profile just the startup without logging in to discord:
+    python startupHelper.py
+
+Python has a built in version of the import part (python -X importtime musicBot.py), but it prints every
+single module. This one only shows the ones that matter and also times our own lazy setups.
+    https://docs.python.org/3/using/cmdline.html#cmdoption-X
+'''
+
+import builtins # __import__ lives here, we wrap it to time each import
+import contextlib # for the timed() context manager
+import os # operating system module for accessing environment variables
+import sys # sys.modules tells us if a module has already been imported
+import time # perf_counter for timing
+
+profileImports = os.getenv("VIBECHECK_PROFILE_IMPORTS", "0") == "1" # set VIBECHECK_PROFILE_IMPORTS=1 to turn on the import table
+
+processStartedAt = time.perf_counter() # roughly when the program started (this file is imported first)
+importTimes = {} # module name -> [total seconds including the modules it imported, seconds spent in just this module]
+setupTimes = {} # lazy setup name (like "vader lexicon") -> seconds it took the first time
+importStack = [] # the imports that are running right now, used to work out each module's own time
+originalImport = builtins.__import__ # the real import function, so we can put it back
+
+
+
+
+def profiledImport(name, *args, **kwargs): # stands in for builtins.__import__ while profiling is on
+    if name in sys.modules: # already imported, this is just a dictionary lookup so dont time it
+        return originalImport(name, *args, **kwargs)
+    importStack.append(0.0) # time spent importing other modules from inside this one goes here
+    startedAt = time.perf_counter()
+    try:
+        return originalImport(name, *args, **kwargs)
+    finally:
+        totalSeconds = time.perf_counter() - startedAt
+        childSeconds = importStack.pop()
+        if importStack: # tell the module that imported us how long we took
+            importStack[-1] += totalSeconds
+        if name not in importTimes: # the first import of a module is the one that does the work
+            importTimes[name] = [totalSeconds, totalSeconds - childSeconds]
+
+
+
+def startImportProfiling(): # starts timing every new import (only does something if VIBECHECK_PROFILE_IMPORTS=1)
+    '''
+    call this before the other imports in musicBot.py so they get timed too.
+    '''
+    if profileImports and builtins.__import__ is originalImport: # only wrap it once
+        builtins.__import__ = profiledImport
+
+
+
+def stopImportProfiling(): # puts the normal import back
+    builtins.__import__ = originalImport
+
+
+
+@contextlib.contextmanager
+def timed(setupName): # times a lazy setup step, like loading the vader lexicon or making the spotify client
+    '''
+    example:
+        with suh.timed("vader lexicon"):
+            analyzer = SentimentIntensityAnalyzer(lexiconFile)
+    '''
+    startedAt = time.perf_counter()
+    try:
+        yield
+    finally:
+        setupTimes[setupName] = setupTimes.get(setupName, 0.0) + time.perf_counter() - startedAt
+
+
+
+def report(limit=15): # builds the startup table as a string
+    '''
+    args:
+        limit (int): how many of the slowest imports to show
+
+    returns:
+        str: the slowest imports (total and own time in milliseconds), every lazy setup that has run so far,
+             and how long it has been since the program started
+    '''
+    lines = [f"startup profile ({(time.perf_counter() - processStartedAt) * 1000:.0f} ms since start)"]
+    slowest = sorted(importTimes.items(), key=lambda item: item[1][0], reverse=True)[:limit] # biggest total time first
+    for name, (totalSeconds, ownSeconds) in slowest:
+        lines.append(f"  import {name:<32} {totalSeconds * 1000:8.1f} ms total {ownSeconds * 1000:8.1f} ms own")
+    for name, seconds in setupTimes.items():
+        lines.append(f"  setup  {name:<32} {seconds * 1000:8.1f} ms")
+    return "\n".join(lines)
+
+
+
+
+
+if __name__ == "__main__": # python startupHelper.py: profile importing the bot without connecting to discord
+    profileImports = True
+    startImportProfiling()
+    import musicBot # noqa: F401 (imported only to time it)
+    stopImportProfiling()
+    print(report(limit=25))
@@ -0,0 +1,20 @@
+'''
+conftest.py
+
+Shared setup for the pytest tests. The helper files read their settings from the environment when they are imported,
+so this runs first: fake API keys (nothing here talks to Spotify or Genius), a throwaway cache folder so the tests
+never see (or fill up) the bot's real cache, and the project folder on the import path.
+
+    python -m pytest -q
+'''
+
+import os # sets the environment variables the helper files read
+import sys # puts the project folder on the import path
+import tempfile # the throwaway cache folder
+
+os.environ.setdefault("SPOTIFY_CLIENT_ID", "test")
+os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "test")
+os.environ.setdefault("GENIUS_CLIENT_ACCESS_TOKEN", "test")
+os.environ["VIBECHECK_CACHE_DIR"] = tempfile.mkdtemp(prefix="vibecheck-tests-")
+os.environ["VIBECHECK_METRICS_PORT"] = "0" # no metrics server
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
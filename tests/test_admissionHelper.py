@@ -0,0 +1,107 @@
+'''
+test_admissionHelper.py
+
+CommandGate: once every slot is taken, commands wait in line and the free slots go round robin by server, so one
+busy server cant starve the others. A command that waits longer than queueSeconds is turned away.
+'''
+
+import asyncio # the gate is async
+import admissionHelper as ah
+
+
+
+
+async def waitInLine(gate, serverKey, name, admittedOrder, positions=None): # one command: enter, note when it got in, stay until leave()
+    async def onQueued(position):
+        if positions is not None:
+            positions[name] = position
+    admitted = await gate.enter(serverKey, onQueued)
+    if admitted:
+        admittedOrder.append(name)
+    return admitted
+
+
+
+async def letEveryoneQueue():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+
+
+def testFreeSlotsGoRoundRobinByServer():
+    async def run():
+        gate = ah.CommandGate(1)
+        admittedOrder = []
+        positions = {}
+        assert await gate.enter("busy server") # takes the only slot
+        waiters = [asyncio.create_task(waitInLine(gate, serverKey, name, admittedOrder, positions))
+                   for serverKey, name in [("busy server", "busy 1"), ("busy server", "busy 2"), ("busy server", "busy 3"),
+                                           ("quiet server", "quiet 1"), ("other server", "other 1")]]
+        await letEveryoneQueue()
+        assert gate.queuedCount() == 5
+        assert positions == {'busy 1': 1, 'busy 2': 2, 'busy 3': 3, 'quiet 1': 2, 'other 1': 3} # where each one was told it is in line
+        for _ in waiters:
+            gate.leave()
+            await letEveryoneQueue()
+        assert all(await asyncio.gather(*waiters))
+        assert admittedOrder == ["busy 1", "quiet 1", "other 1", "busy 2", "busy 3"]
+        assert gate.inFlight == 1 # the slots were handed over, never freed in between
+        gate.leave()
+        assert gate.inFlight == 0 and not gate.lines
+
+    asyncio.run(run())
+
+
+
+def testWaitingTooLongIsTurnedAway(monkeypatch):
+    monkeypatch.setattr(ah, "queueSeconds", 0.05)
+
+    async def run():
+        gate = ah.CommandGate(1)
+        timedOutBefore = ah.counters['timedOut']
+        assert await gate.enter("server")
+        assert not await gate.enter("server") # nobody left in time
+        assert ah.counters['timedOut'] == timedOutBefore + 1
+        assert not gate.lines # it isnt left in line
+        gate.leave()
+        assert gate.inFlight == 0
+        assert await gate.enter("server") # the slot is free again
+
+    asyncio.run(run())
+
+
+
+def testFullLineIsTurnedAway(monkeypatch):
+    monkeypatch.setattr(ah, "maxQueuedPerGuild", 2)
+
+    async def run():
+        gate = ah.CommandGate(1)
+        assert await gate.enter("server")
+        waiters = [asyncio.create_task(gate.enter("server")) for _ in range(2)]
+        await letEveryoneQueue()
+        assert not await gate.enter("server") # this server already has 2 waiting
+        otherServer = asyncio.create_task(gate.enter("other server")) # other servers can still get in line
+        await letEveryoneQueue()
+        assert gate.queuedCount() == 3
+        for _ in range(3):
+            gate.leave()
+        assert all(await asyncio.gather(*waiters, otherServer))
+
+    asyncio.run(run())
+
+
+
+def testCancelledWaiterLeavesTheLine():
+    async def run():
+        gate = ah.CommandGate(1)
+        assert await gate.enter("server")
+        waiter = asyncio.create_task(gate.enter("server"))
+        await letEveryoneQueue()
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert gate.queuedCount() == 0
+        gate.leave()
+        assert gate.inFlight == 0
+
+    asyncio.run(run())
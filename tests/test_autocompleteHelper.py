@@ -0,0 +1,104 @@
+'''
+test_autocompleteHelper.py
+
+PrefixIndex: complete() gives at most the 25 names Discord can show, most asked for first, for prefixes of the
+whole name or of any later word in it. A full index ignores new names completely, and loading the lyrics index's
+songs shares the event loop with the commands adding theirs.
+'''
+
+import asyncio # loading is async
+import random # the order the names are added in
+import autocompleteHelper as ach
+
+
+
+
+def bruteForceTop(weights, prefix, limit=25): # what complete() should say, worked out the slow way
+    prefix = prefix.casefold()
+    matches = [name for name in weights
+               if any(word.startswith(prefix) for word in [" ".join(name.casefold().split()[start:]) for start in range(len(name.split()))])]
+    return sorted(matches, key=lambda name: -weights[name])[:limit]
+
+
+
+
+def testTop25MostAskedForFirst():
+    prefixIndex = ach.PrefixIndex()
+    weights = {f"Artist {number:03d}": number * 3 + 1 for number in range(100)} # every weight is different, so there is one right order
+    names = list(weights)
+    random.Random(0).shuffle(names)
+    for name in names:
+        for _ in range(weights[name]): # one add() per time it was asked for
+            prefixIndex.add(name)
+    for prefix in ("a", "artist", "artist 0", "0", "05", "artist 09"):
+        assert prefixIndex.complete(prefix) == bruteForceTop(weights, prefix), prefix
+    assert len(prefixIndex.complete("art")) == 25
+
+
+
+def testWeightsMoveNamesUp():
+    prefixIndex = ach.PrefixIndex()
+    prefixIndex.add("Mac Miller")
+    prefixIndex.add("Madonna", weight=2)
+    assert prefixIndex.complete("ma") == ["Madonna", "Mac Miller"]
+    prefixIndex.add("mac miller", weight=2) # same name, different spelling
+    assert prefixIndex.complete("ma") == ["Mac Miller", "Madonna"] # shown the way it was first added
+    assert prefixIndex.complete("mill") == ["Mac Miller"]
+
+
+
+def testNameThatFallsOutOfTheTopCanComeBack():
+    prefixIndex = ach.PrefixIndex()
+    for number in range(30):
+        prefixIndex.add(f"Song {number}", weight=10)
+    prefixIndex.add("Song Late")
+    assert "Song Late" not in prefixIndex.complete("song")
+    prefixIndex.add("Song Late", weight=20)
+    assert prefixIndex.complete("song")[0] == "Song Late"
+    assert len(prefixIndex.complete("song")) == 25
+
+
+
+def testLimitAndMisses():
+    prefixIndex = ach.PrefixIndex()
+    for name in ("Radiohead", "Rage Against the Machine", "Ratatat"):
+        prefixIndex.add(name)
+    assert len(prefixIndex.complete("ra", limit=2)) == 2
+    assert prefixIndex.complete("zz") == []
+    assert prefixIndex.complete("machine") == ["Rage Against the Machine"]
+
+
+
+def testFullIndexDoesntRememberNewSpellings(monkeypatch):
+    monkeypatch.setattr(ach, "maxNames", 2)
+    prefixIndex = ach.PrefixIndex()
+    prefixIndex.add("Lorde")
+    prefixIndex.add("Adele")
+    prefixIndex.add("Mac Miller") # no room
+    assert prefixIndex.complete("mac") == [] and len(prefixIndex.displayNames) == 2
+    prefixIndex.add("lorde") # names already in it still count
+    assert prefixIndex.weights["Lorde"] == 2
+
+
+
+def testLoadingSharesTheLoopWithCommands(monkeypatch):
+    monkeypatch.setattr(ach, "loadChunkSize", 10)
+    for indexName in ("artistIndex", "allTitlesIndex"):
+        monkeypatch.setattr(ach, indexName, ach.PrefixIndex())
+    monkeypatch.setattr(ach, "titleIndexes", {})
+    songs = [(f"Song {number}", f"Artist {number % 7}") for number in range(95)]
+    loadedWhenCommandRan = []
+
+    async def command(): # a command finding a song while the load is going
+        await asyncio.sleep(0)
+        loadedWhenCommandRan.append(len(ach.allTitlesIndex))
+        ach.addSong("Artist 3", "Song 3")
+
+    async def run():
+        await asyncio.gather(ach.loadSongsAsync(songs), command())
+
+    asyncio.run(run())
+    assert 0 < loadedWhenCommandRan[0] < len(songs) # it ran in between two chunks
+    assert len(ach.allTitlesIndex) == len(songs)
+    assert ach.completeTitles("song 3", "Artist 3")[0] == "Song 3" # added twice, so it comes first
+    assert ach.completeArtists("artist") == [f"Artist {number}" for number in (3, 0, 1, 2, 4, 5, 6)]
@@ -0,0 +1,119 @@
+'''
+test_bulkScore.py
+
+The output file is also the checkpoint: a run that was stopped leaves a half written last line, which gets cut off,
+and running again only fetches the songs that arent in the output yet (or that failed last time).
+Genius and the CPU process pool are replaced with stand-ins, so nothing here touches the network.
+'''
+
+import argparse # the options main() would get from the command line
+import asyncio # scoreAll is async
+import json # reads the output back
+import pytest
+import bulkScore
+import cacheHelper as ch
+import executorHelper as eh
+import geniusHelper as ghf
+import rateLimitHelper as rl
+
+songs = [("Pearl Jam", "Jeremy"), ("Pearl Jam", "Black"), ("Lorde", "Royals"), ("Adele", "Hello"), ("Drake", "Hotline Bling"),
+         ("Nobody", "Not On Genius"), ("Busy", "Genius Said 429")]
+
+
+
+
+def writeInput(path, rows):
+    with open(path, "w", encoding="utf-8") as inputFile:
+        inputFile.writelines(json.dumps({'artist': artistName, 'title': songTitle}) + "\n" for artistName, songTitle in rows)
+
+
+
+def readOutput(path):
+    with open(path, encoding="utf-8") as outputFile:
+        return [json.loads(line) for line in outputFile]
+
+
+
+def makeRecordLine(artistName, songTitle):
+    return json.dumps(bulkScore.makeRecord(artistName, songTitle, None, False)) + "\n"
+
+
+
+def makeOptions(tmp_path):
+    return argparse.Namespace(input=str(tmp_path / "songs.jsonl"), output=str(tmp_path / "results.jsonl"), artist_field="artist", title_field="title",
+                              concurrency=3, batch_size=2, chunk_size=10, chunks=False)
+
+
+
+@pytest.fixture
+def fetched(monkeypatch): # the songs genius was asked for, in order
+    fetchedSongs = []
+
+    async def fakeGetLyrics(artistName, songTitle):
+        fetchedSongs.append((artistName, songTitle))
+        if artistName == "Nobody":
+            return None # genius doesnt have it
+        if artistName == "Busy":
+            raise rl.UpstreamBusyError("genius", "HTTP 429 after 4 tries")
+        return f"{songTitle} makes me so happy and I love it, never sad, good good good"
+
+    async def runHere(backend, function, *args, **kwargs): # no process pool, just call it
+        return function(*args, **kwargs)
+
+    monkeypatch.setattr(ghf, "getLyricsAsync", fakeGetLyrics)
+    monkeypatch.setattr(eh, "runCPU", runHere)
+    monkeypatch.setattr(bulkScore, "progressSeconds", 3600)
+    return fetchedSongs
+
+
+
+
+def testHalfWrittenLastLineIsCutOff(tmp_path):
+    outputPath = tmp_path / "results.jsonl"
+    goodLines = makeRecordLine("Pearl Jam", "Jeremy") + makeRecordLine("Pearl Jam", "Black")
+    outputPath.write_text(goodLines + makeRecordLine("Lorde", "Royals")[:25], encoding="utf-8")
+    keys = bulkScore.JsonlResults(str(outputPath)).completedKeys()
+    assert keys == {ch.normalizeKey("Pearl Jam", "Jeremy"), ch.normalizeKey("Pearl Jam", "Black")}
+    assert outputPath.read_text(encoding="utf-8") == goodLines # new results start on a fresh line
+
+
+
+def testBrokenLineStopsTheCheckpoint(tmp_path): # everything after a line that isnt JSON is cut off too, those songs get scored again
+    outputPath = tmp_path / "results.jsonl"
+    firstLine = makeRecordLine("Pearl Jam", "Jeremy")
+    outputPath.write_text(firstLine + "not json\n" + makeRecordLine("Lorde", "Royals"), encoding="utf-8")
+    assert bulkScore.JsonlResults(str(outputPath)).completedKeys() == {ch.normalizeKey("Pearl Jam", "Jeremy")}
+    assert outputPath.read_text(encoding="utf-8") == firstLine
+
+
+
+def testMissingOutputIsAFreshStart(tmp_path):
+    assert bulkScore.JsonlResults(str(tmp_path / "results.jsonl")).completedKeys() == set()
+
+
+
+def testResumeOnlyFetchesWhatIsLeft(tmp_path, fetched):
+    options = makeOptions(tmp_path)
+    writeInput(options.input, songs + [("pearl jam", "jeremy")]) # a repeat with different capitals
+    with open(options.output, "w", encoding="utf-8") as outputFile: # the run before was stopped while writing Royals
+        outputFile.write(makeRecordLine("Pearl Jam", "Jeremy") + makeRecordLine("Pearl Jam", "Black") + makeRecordLine("Lorde", "Royals")[:30])
+
+    async def run():
+        results = bulkScore.JsonlResults(options.output)
+        try:
+            return await bulkScore.scoreAll(options, results)
+        finally:
+            results.close()
+
+    counters = asyncio.run(run())
+    assert sorted(fetched) == sorted(songs[2:])
+    assert counters == {'skipped': 3, 'scored': 3, 'notFound': 1, 'failed': 1}
+    records = readOutput(options.output)
+    assert sorted(record['key'] for record in records) == sorted(ch.normalizeKey(*song) for song in songs[:6]) # the failed song isnt written
+    assert all(record['found'] and record['label'] == "Positive" for record in records[2:] if record['artist'] != "Nobody")
+
+    fetched.clear()
+    counters = asyncio.run(run()) # the next run only tries the song that failed
+    assert fetched == [("Busy", "Genius Said 429")]
+    assert counters == {'skipped': 7, 'scored': 0, 'notFound': 0, 'failed': 1}
+    assert len(readOutput(options.output)) == 6
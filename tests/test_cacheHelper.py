@@ -0,0 +1,128 @@
+'''
+test_cacheHelper.py
+
+TwoTierCache: values run out after their TTL, stale values are only handed out by lookup() for staleSeconds
+after that, and the memory tier drops its least recently used entries to stay under the byte budget.
+The clock is a fake one, so nothing here has to sleep.
+'''
+
+import asyncio # the async methods
+import itertools # unique cache names
+import types # the fake time module
+import pytest
+import cacheHelper as ch
+
+cacheNumbers = itertools.count() # every test gets its own SQLite file in the throwaway cache folder
+
+
+
+
+class FakeClock: # stands in for time.time() inside cacheHelper
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fakeClock = FakeClock()
+    monkeypatch.setattr(ch, "time", types.SimpleNamespace(time=fakeClock.time))
+    return fakeClock
+
+
+
+def makeCache(**options):
+    return ch.TwoTierCache(f"test{next(cacheNumbers)}", **options)
+
+
+
+
+def testValuesRunOutAfterTheirTTL(clock):
+    cache = makeCache(ttlSeconds=60, negativeTtlSeconds=10)
+    cache.set("song", "lyrics")
+    cache.setMissing("unknown")
+    assert cache.get("song") == (True, "lyrics")
+    assert cache.get("unknown") == (True, None) # found, and we know it doesnt exist
+    clock.advance(30)
+    assert cache.get("song") == (True, "lyrics")
+    assert cache.get("unknown") == (False, None) # the negative TTL is shorter
+    clock.advance(31)
+    assert cache.get("song") == (False, None)
+    assert cache.stats()['negativeHits'] == 1
+
+
+
+def testStaleValuesOnlyComeFromLookup(clock):
+    cache = makeCache(ttlSeconds=60, staleSeconds=300)
+    cache.set("song", "lyrics")
+    clock.advance(61)
+    assert cache.get("song") == (False, None) # get() only hands out fresh values
+    assert cache.lookup("song") == (True, "lyrics", True)
+    assert cache.peek("song") == (False, None)
+    clock.advance(300)
+    assert cache.lookup("song") == (False, None, False) # too old even to be stale
+    assert cache.stats()['staleHits'] == 2 # get() looked at the stale value too, it just didnt hand it out
+
+
+
+def testStaleValuesComeBackFromTier2(clock):
+    cache = makeCache(ttlSeconds=60, staleSeconds=300)
+    cache.set("song", "lyrics")
+    cache.memory.clear() # like another shard process, or this one after a restart
+    clock.advance(61)
+    assert cache.lookup("song") == (True, "lyrics", True)
+    cache.memory.clear()
+    clock.advance(300)
+    assert cache.lookup("song") == (False, None, False)
+
+
+
+def testMemoryByteBudgetDropsTheLeastRecentlyUsed(clock):
+    cache = makeCache(persist=False, maxMemoryBytes=3000)
+    for key in "abc":
+        cache.set(key, bytes(1000))
+    assert cache.memoryBytes == 3000
+    assert cache.get("a") == (True, bytes(1000)) # "a" is now the most recently used, "b" the least
+    cache.set("d", bytes(1000))
+    assert list(cache.memory) == ["c", "a", "d"]
+    assert cache.get("b") == (False, None)
+    cache.set("e", bytes(2500)) # needs the room of all three
+    assert list(cache.memory) == ["e"]
+    assert cache.memoryBytes == 2500
+    assert cache.stats()['evictions'] == 4
+
+
+
+def testReplacingAValueKeepsTheByteCountRight(clock):
+    cache = makeCache(persist=False, maxMemoryBytes=10000)
+    cache.set("song", bytes(4000))
+    cache.set("song", bytes(1000))
+    assert cache.memoryBytes == 1000
+
+
+
+def testOneValueBiggerThanTheBudgetIsStillKept(clock): # the newest entry is never evicted, even when it is too big on its own
+    cache = makeCache(persist=False, maxMemoryBytes=100)
+    cache.set("big", bytes(500))
+    assert cache.get("big") == (True, bytes(500))
+
+
+
+def testAsyncMethodsSeeTheSameEntries(clock):
+    cache = makeCache(ttlSeconds=60, staleSeconds=300)
+
+    async def run():
+        await cache.setAsync("song", "lyrics")
+        assert await cache.getAsync("song") == (True, "lyrics")
+        cache.memory.clear()
+        clock.advance(61)
+        assert await cache.getAsync("song") == (False, None)
+        assert await cache.lookupAsync("song") == (True, "lyrics", True)
+
+    asyncio.run(run())
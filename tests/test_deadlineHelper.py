@@ -0,0 +1,129 @@
+'''
+test_deadlineHelper.py
+
+within() cuts a step off when the command's budget runs out, a slow request gets a hedge and the first answer
+wins, and /lyrics falls back to the lyrics cached earlier (past their TTL) when genius doesnt answer in time.
+'''
+
+import asyncio # the budgets and hedges are asyncio timeouts and tasks
+import itertools # unique cache names
+import pytest
+import cacheHelper as ch
+import deadlineHelper as dh
+import geniusHelper as ghf
+import musicBot
+
+cacheNumbers = itertools.count()
+
+
+
+
+def makeAttempts(*delays, error=None): # a request whose 1st, 2nd... try takes these many seconds
+    delays = list(delays)
+    started, cancelled = [], []
+
+    def makeAttempt():
+        tryNumber = len(started)
+        started.append(tryNumber)
+
+        async def attempt():
+            try:
+                await asyncio.sleep(delays[tryNumber])
+            except asyncio.CancelledError:
+                cancelled.append(tryNumber)
+                raise
+            if error is not None:
+                raise error(f"try {tryNumber}")
+            return f"try {tryNumber}"
+
+        return attempt()
+
+    return makeAttempt, started, cancelled
+
+
+
+
+def testWithinCutsOffASlowStep():
+    async def run():
+        with dh.deadline(0.05):
+            await dh.within(asyncio.sleep(5), "genius")
+
+    budgetsRunOut = dh.counters['budgetsRunOut']
+    with pytest.raises(dh.DeadlineExceeded, match="genius"):
+        asyncio.run(run())
+    assert dh.counters['budgetsRunOut'] == budgetsRunOut + 1
+
+
+
+def testWithinWaitsWhenTheresTime():
+    async def run():
+        assert await dh.within(asyncio.sleep(0.01, "no deadline"), "genius") == "no deadline" # outside a command there is no limit
+        with dh.deadline(5):
+            assert await dh.within(asyncio.sleep(0.01, "in time"), "genius") == "in time"
+        with dh.deadline(0):
+            return await dh.within(asyncio.sleep(0.01, "local work"), "vader", atLeast=1.0) # the budget is gone, but atLeast still gives it time
+
+    assert asyncio.run(run()) == "local work"
+
+
+
+def testInnerDeadlineCantOutlastTheOuterOne():
+    with dh.deadline(1):
+        with dh.deadline(60):
+            assert dh.remaining() <= 1
+        assert dh.remaining() <= 1
+    assert dh.remaining() == float("inf")
+
+
+
+def testSlowRequestGetsAHedgeThatWins():
+    makeAttempt, started, cancelled = makeAttempts(5, 0.01)
+    hedgesWon = dh.counters['hedgesWon']
+    assert asyncio.run(dh.hedge(makeAttempt, 0.05, lambda: True)) == "try 1"
+    assert started == [0, 1] and cancelled == [0] # the slow first try was cancelled
+    assert dh.counters['hedgesWon'] == hedgesWon + 1
+
+
+
+def testFastRequestIsntHedged():
+    makeAttempt, started, cancelled = makeAttempts(0.01, 0.01)
+    assert asyncio.run(dh.hedge(makeAttempt, 0.2, lambda: True)) == "try 0"
+    assert started == [0]
+
+
+
+def testNoHedgeWithoutAToken():
+    makeAttempt, started, cancelled = makeAttempts(0.1, 0.01)
+    assert asyncio.run(dh.hedge(makeAttempt, 0.05, lambda: False)) == "try 0" # the rate limiter had nothing free, so the first try just keeps going
+    assert started == [0]
+
+
+
+def testBothTriesFailing():
+    makeAttempt, started, cancelled = makeAttempts(0.1, 0.01, error=ValueError)
+    with pytest.raises(ValueError, match="try 1"): # the first error that came back
+        asyncio.run(dh.hedge(makeAttempt, 0.05, lambda: True))
+    assert started == [0, 1]
+
+
+
+def testLyricsFallBackToTheStaleCopy(monkeypatch):
+    lyricsCache = ch.TwoTierCache(f"staleLyrics{next(cacheNumbers)}", ttlSeconds=0, staleSeconds=3600) # everything in it is already past its TTL
+    lyricsCache.set(ch.normalizeKey("Pearl Jam", "Jeremy"), "Jeremy spoke in class today")
+    monkeypatch.setattr(ghf, "lyricsCache", lyricsCache)
+
+    async def slowGenius(artistName, songTitle):
+        await asyncio.sleep(5)
+
+    monkeypatch.setattr(ghf, "getLyricsAsync", slowGenius)
+
+    async def run(artistName, songTitle):
+        with dh.deadline(0.05):
+            return await musicBot.getSongLyrics(artistName, songTitle)
+
+    staleServed = dh.counters['staleServed']
+    lyrics, isStale = asyncio.run(run("Pearl Jam", "Jeremy"))
+    assert lyrics == "Jeremy spoke in class today" and isStale
+    assert dh.counters['staleServed'] == staleServed + 1
+    with pytest.raises(dh.DeadlineExceeded): # nothing saved for this one, so the command says genius is slow
+        asyncio.run(run("Pearl Jam", "Black"))
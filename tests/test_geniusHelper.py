@@ -0,0 +1,106 @@
+'''
+test_geniusHelper.py
+
+iterBundleOffsets has to keep every message inside Discord's embed limits: 4096 characters per embed, 6000 across
+the embeds of one message and 10 embeds per message, without losing any of the lyrics.
+getLyricsByIDAsync goes to the song page even when a search by name cached "not found", with or without shards.
+'''
+
+import asyncio # the lyrics fetches are async
+import random # made up lyrics
+import pytest
+import cacheHelper as ch
+import geniusHelper as ghf
+import rateLimitHelper as rl
+
+
+
+
+def makeLyrics(lineCount, seed=0, longestLine=120): # lines of made up words, some of them very long
+    randomGenerator = random.Random(seed)
+    lines = []
+    for _ in range(lineCount):
+        lineLength = randomGenerator.choice([randomGenerator.randint(5, longestLine), randomGenerator.randint(5, 60)])
+        lines.append(" ".join("la" * randomGenerator.randint(1, 6) for _ in range(lineLength // 8 + 1)))
+    return "\n".join(lines)
+
+
+
+def checkBundles(text, bundles, embedLimit=4096, messageLimit=6000, embedsPerMessage=10, smallestEmbed=500):
+    position = 0
+    for bundle in bundles:
+        assert 1 <= len(bundle) <= embedsPerMessage
+        assert sum(end - start for start, end in bundle) <= messageLimit
+        roomLeft = messageLimit
+        for start, end in bundle:
+            assert 0 < end - start <= embedLimit
+            assert roomLeft == messageLimit or roomLeft >= smallestEmbed # no tiny sliver of an embed at the end of a message
+            assert text[position:start].strip() == "" # only line breaks and spaces are skipped between pages
+            assert text[start] not in "\n " and text[end - 1] not in "\n "
+            roomLeft -= end - start
+            position = end
+    assert text[position:].strip() == "" # nothing left over at the end
+
+
+
+
+@pytest.mark.parametrize("lineCount", [1, 40, 400, 3000])
+def testBundlesStayInsideDiscordLimits(lineCount):
+    text = makeLyrics(lineCount, seed=lineCount)
+    checkBundles(text, list(ghf.iterBundleOffsets(text)))
+
+
+
+def testSmallerLimits(): # lots of messages, with embeds that fill up after a few lines
+    text = makeLyrics(500, seed=7)
+    bundles = list(ghf.iterBundleOffsets(text, embedLimit=300, messageLimit=1000, embedsPerMessage=3, smallestEmbed=100))
+    assert len(bundles) > 10
+    checkBundles(text, bundles, embedLimit=300, messageLimit=1000, embedsPerMessage=3, smallestEmbed=100)
+
+
+
+def testPagesEndAtLineBreaks():
+    text = makeLyrics(800, seed=3)
+    for bundle in ghf.iterBundleOffsets(text):
+        for start, end in bundle:
+            assert end == len(text) or text[end] == "\n" # every line here fits in an embed, so no page cuts a line
+
+
+
+def testOneHugeLineIsCutBetweenWords():
+    text = " ".join(["word"] * 3000) # 14999 characters and no line breaks
+    bundles = list(ghf.iterBundleOffsets(text))
+    checkBundles(text, bundles)
+    assert all(text[end] == " " for bundle in bundles for start, end in bundle if end < len(text))
+
+
+
+def testNormalizedLyricsGiveTheSameBundles(): # the token stream's line ends give the same answer as searching for line breaks
+    text = makeLyrics(600, seed=5)
+    lyrics = ghf.normalizeLyrics(text)
+    assert lyrics == text # made up lyrics have nothing to clean up
+    assert list(ghf.iterBundleOffsets(lyrics)) == list(ghf.iterBundleOffsets(text))
+
+
+
+def testEmptyText():
+    assert list(ghf.iterBundleOffsets("")) == []
+    assert list(ghf.iterBundleOffsets("\n\n  \n")) == []
+
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def testPickedSongSkipsTheCachedNegative(monkeypatch, shared):
+    monkeypatch.setattr(ch, "sharedAcrossProcesses", shared) # with shards, the lyrics flight looks in the shared cache first
+    requestedUrls = []
+
+    async def fakeCall(api, coroutineFunction, url, **kwargs): # the song page, no network
+        requestedUrls.append(url)
+        return '<html><body><div data-lyrics-container="true">[Verse 1]<br/>Jeremy spoke in class today</div></body></html>'
+
+    monkeypatch.setattr(rl, "call", fakeCall)
+    artistName, songTitle = "Pearl Jam", f"Jeremy {shared}"
+    ghf.lyricsCache.setMissing(ch.normalizeKey(artistName, songTitle)) # an earlier /lyrics by name didnt find it
+    lyrics = asyncio.run(ghf.getLyricsByIDAsync(2366 + shared, artistName, songTitle, "https://genius.com/Pearl-jam-jeremy-lyrics"))
+    assert lyrics == "Jeremy spoke in class today"
+    assert requestedUrls == ["https://genius.com/Pearl-jam-jeremy-lyrics"]
@@ -0,0 +1,66 @@
+'''
+test_lyricsIndexHelper.py
+
+The lyrics index: phrase matches rank first, merging only writes the new songs (segments that grow like a binary
+counter), and two LyricsIndex objects on the same folder (like two shard processes) see each other's songs.
+'''
+
+import math # the log2 bound on the number of segments
+import os # lists the index folder
+import random # made up lyrics
+import lyricsIndexHelper as lih
+
+words = [f"word{number}" for number in range(200)]
+
+
+
+
+def makeLyrics(number): # made up lyrics, always the same ones for the same number, with a word no other song has
+    randomGenerator = random.Random(number)
+    return " ".join(randomGenerator.choice(words) for _ in range(randomGenerator.randint(20, 120))) + f" only{number}"
+
+
+
+
+def testPhraseMatchesComeFirst(tmp_path):
+    lyricsIndex = lih.LyricsIndex(str(tmp_path))
+    lyricsIndex.addSong("Pearl Jam", "Jeremy", "jeremy spoke in class today")
+    lyricsIndex.addSong("Somebody", "Class Today", "today in class jeremy spoke spoke spoke") # the same words, not in order
+    assert lyricsIndex.search("Jeremy spoke in class today") == [("Jeremy", "Pearl Jam"), ("Class Today", "Somebody")]
+    assert lyricsIndex.search("nothing like this") == []
+
+
+
+def testMergesOnlyWriteTheNewSongs(tmp_path, monkeypatch):
+    monkeypatch.setattr(lih, "mergeEvery", 4)
+    lyricsIndex = lih.LyricsIndex(str(tmp_path))
+    segmentSizes = []
+    for number in range(100):
+        lyricsIndex.addSong(f"Artist {number}", f"Song {number}", makeLyrics(number))
+        segmentSizes.append([len(segment.songs) for segment in lyricsIndex.segments])
+    assert segmentSizes[3] == [4] # the 4th song was merged into the first segment
+    assert segmentSizes[7] == [8] # the next 4 made a segment as big as it, so the two were combined
+    assert segmentSizes[11] == [8, 4] # but the next 4 are left on their own
+    assert len(lyricsIndex.segments) <= math.log2(100 / 4) + 1
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith(".bin")) == sorted(f"{segment.name}.bin" for segment in lyricsIndex.segments) # merged away segments are deleted
+    for number in range(100):
+        assert lyricsIndex.search(f"only{number}") == [(f"Song {number}", f"Artist {number}")]
+
+
+
+def testTwoIndexesOnOneFolderShareSongs(tmp_path, monkeypatch):
+    monkeypatch.setattr(lih, "mergeEvery", 5)
+    first = lih.LyricsIndex(str(tmp_path)) # like two shard processes
+    second = lih.LyricsIndex(str(tmp_path))
+    for number in range(23):
+        (first if number % 2 else second).addSong(f"Artist {number}", f"Song {number}", makeLyrics(number))
+    second.addSong("Artist 3", "Song 3", makeLyrics(3)) # the other one already added it
+    for lyricsIndex in (first, second):
+        assert lyricsIndex.search("only3") == [("Song 3", "Artist 3")]
+        assert lyricsIndex.search("only22") == [("Song 22", "Artist 22")] # still in the journal, not merged yet
+    assert first.songs == second.songs # the same song IDs in both
+    first.flush()
+    second.flush() # nothing left for it to merge
+    reopened = lih.LyricsIndex(str(tmp_path))
+    assert reopened.stats()['songs'] == 23 and reopened.stats()['deltaSongs'] == 0
+    assert reopened.search("only22") == [("Song 22", "Artist 22")]
@@ -0,0 +1,86 @@
+'''
+test_metricsHelper.py
+
+renderPrometheus gives the Prometheus text format: one "# TYPE" line per metric before its first sample, histogram
+buckets that add up (the +Inf bucket is the count), and the counters other helper files keep as gauges/counters.
+'''
+
+import asyncio # timedCommand wraps async commands
+import re # picks the samples out of the page
+import pytest
+import metricsHelper as mh
+
+samplePattern = re.compile(r'^([a-z_]+)(\{[^}]*\})? (\S+)$') # name, {labels} and value of one sample line
+
+
+
+
+@pytest.fixture(autouse=True)
+def freshMetrics(monkeypatch): # empty histograms and counters for every test
+    monkeypatch.setattr(mh, "histograms", {})
+    monkeypatch.setattr(mh, "counters", {})
+
+
+
+def parsePage(page): # the page -> ({metric name: type}, [(name, labels, value)])
+    types, samples = {}, []
+    assert page.endswith("\n")
+    for line in page.splitlines():
+        if line.startswith("# TYPE "):
+            name, metricType = line[len("# TYPE "):].split(" ")
+            assert name not in types # only one TYPE line per metric
+            types[name] = metricType
+            continue
+        match = samplePattern.match(line)
+        assert match, line
+        samples.append((match.group(1), match.group(2) or "", float(match.group(3))))
+    return types, samples
+
+
+
+
+def testHistogramBucketsAddUp():
+    for seconds in (0.0005, 0.003, 0.003, 0.2, 45.0):
+        mh.observe("vibecheck_stage_seconds", seconds, stage="vader")
+    mh.observe("vibecheck_stage_seconds", 1.5, stage="plot")
+    types, samples = parsePage(mh.renderPrometheus())
+    assert types["vibecheck_stage_seconds"] == "histogram"
+    buckets = [(labels, value) for name, labels, value in samples if name == "vibecheck_stage_seconds_bucket" and 'stage="vader"' in labels]
+    assert len(buckets) == len(mh.bucketBounds) + 1
+    assert buckets[0] == ('{stage="vader",le="0.001"}', 1)
+    assert dict(buckets)['{stage="vader",le="0.005"}'] == 3
+    assert dict(buckets)['{stage="vader",le="30.0"}'] == 4 # the 45 second one is only in +Inf
+    assert buckets[-1] == ('{stage="vader",le="+Inf"}', 5)
+    assert [value for labels, value in buckets] == sorted(value for labels, value in buckets) # cumulative
+    assert ("vibecheck_stage_seconds_count", '{stage="vader"}', 5) in samples
+    assert ("vibecheck_stage_seconds_sum", '{stage="vader"}', pytest.approx(45.2065)) in samples
+
+
+
+def testCountersAndTheOtherHelpersStats():
+    mh.increment("vibecheck_prewarmed_songs_total")
+    mh.increment("vibecheck_prewarmed_songs_total", 2)
+    types, samples = parsePage(mh.renderPrometheus())
+    assert ("vibecheck_prewarmed_songs_total", "", 3) in samples
+    assert types["vibecheck_prewarmed_songs_total"] == "counter"
+    assert types["vibecheck_upstream_waiting"] == "gauge" and types["vibecheck_upstream_events_total"] == "counter"
+    assert ("vibecheck_upstream_events_total", '{api="genius",event="retries"}') in {(name, labels) for name, labels, value in samples}
+    assert "vibecheck_admission_in_flight" in types and "vibecheck_deadline_events_total" in types
+
+
+
+def testTimedCommandCountsOutcomes():
+    @mh.timedCommand
+    async def lyrics(fail):
+        with mh.span("genius_search"):
+            if fail:
+                raise ValueError("genius broke")
+
+    asyncio.run(lyrics(False))
+    with pytest.raises(ValueError):
+        asyncio.run(lyrics(True))
+    types, samples = parsePage(mh.renderPrometheus())
+    assert ("vibecheck_commands_total", '{command="lyrics",outcome="ok"}', 1) in samples
+    assert ("vibecheck_commands_total", '{command="lyrics",outcome="error"}', 1) in samples
+    assert ("vibecheck_command_seconds_count", '{command="lyrics"}', 2) in samples
+    assert ("vibecheck_stage_errors_total", '{stage="genius_search"}', 1) in samples
@@ -0,0 +1,116 @@
+'''
+test_musicBot.py
+
+parseSongInput: "artist + song title", or the number of one of the channel's recent /searchlyrics results, which
+picks that result (with its genius song ID, so the lyrics can be fetched without searching again).
+/artistmood: one song that fails shows up as "no lyrics found" instead of sinking the whole answer.
+'''
+
+import asyncio # the commands are async
+import collections # a fresh recentResults for every test
+import types # fake discord contexts
+import httpx # the 404 a missing genius page gives
+import pytest
+import benchmark # its fake discord context
+import executorHelper as eh
+import geniusHelper as ghf
+import musicBot
+import spotifyHelper as shf
+
+
+
+
+def contextIn(channelID): # the only part of ctx that parseSongInput looks at
+    return types.SimpleNamespace(channel=types.SimpleNamespace(id=channelID))
+
+
+
+@pytest.fixture(autouse=True)
+def freshResults(monkeypatch):
+    monkeypatch.setattr(musicBot, "recentResults", collections.OrderedDict())
+
+
+
+searchResults = [ghf.SongHit("Jeremy", "Pearl Jam", 2366, "https://genius.com/Pearl-jam-jeremy-lyrics"), ("Black", "Pearl Jam")] # a genius hit and a local index hit
+
+
+
+
+def testArtistPlusTitle():
+    assert musicBot.parseSongInput(contextIn(1), "Mac Miller + Blue World") == ("Mac Miller", "Blue World", None)
+    assert musicBot.parseSongInput(contextIn(1), "  Lorde+Royals ") == ("Lorde", "Royals", None)
+    assert musicBot.parseSongInput(contextIn(1), "Mac Miller Blue World") is None # no way to tell where the title starts
+
+
+
+def testPickingAResultByNumber():
+    ctx = contextIn(1)
+    musicBot.rememberResults(ctx, searchResults)
+    artistName, songTitle, pickedResult = musicBot.parseSongInput(ctx, "1")
+    assert (artistName, songTitle) == ("Pearl Jam", "Jeremy")
+    assert pickedResult.songID == 2366 and pickedResult.url.endswith("jeremy-lyrics") # so the lyrics come straight from the song page
+    assert musicBot.parseSongInput(ctx, " 2 ") == ("Pearl Jam", "Black", ("Black", "Pearl Jam"))
+
+
+
+def testNumbersThatDontPickAnything():
+    ctx = contextIn(1)
+    assert musicBot.parseSongInput(ctx, "1") is None # no /searchlyrics in this channel yet
+    musicBot.rememberResults(ctx, searchResults)
+    assert musicBot.parseSongInput(ctx, "0") is None
+    assert musicBot.parseSongInput(ctx, "3") is None
+    assert musicBot.parseSongInput(contextIn(2), "1") is None # another channel's results
+
+
+
+def testNewerSearchReplacesTheResults():
+    ctx = contextIn(1)
+    musicBot.rememberResults(ctx, searchResults)
+    musicBot.rememberResults(ctx, [("Royals", "Lorde")])
+    assert musicBot.parseSongInput(ctx, "1") == ("Lorde", "Royals", ("Royals", "Lorde"))
+    assert musicBot.parseSongInput(ctx, "2") is None
+
+
+
+def testResultsRunOut(monkeypatch):
+    ctx = contextIn(1)
+    monkeypatch.setattr(musicBot, "recentResultsSeconds", -1.0) # already past
+    musicBot.rememberResults(ctx, searchResults)
+    assert musicBot.parseSongInput(ctx, "1") is None
+
+
+
+def testOldestChannelsAreForgotten(monkeypatch):
+    monkeypatch.setattr(musicBot, "maxRecentChannels", 2)
+    for channelID in (1, 2, 3):
+        musicBot.rememberResults(contextIn(channelID), searchResults)
+    assert musicBot.parseSongInput(contextIn(1), "1") is None
+    assert musicBot.parseSongInput(contextIn(3), "1") is not None
+
+
+
+def testArtistMoodSurvivesABrokenSong(monkeypatch):
+    trackData = [(f"Track {number}", "Album", 90 - number) for number in range(4)]
+
+    async def fakeTopTracks(artistName):
+        return trackData, "Some Artist"
+
+    async def fakeSongLyrics(artistName, songTitle, pickedResult=None):
+        if songTitle == "Track 1":
+            request = httpx.Request("GET", "https://genius.com/songs/1")
+            raise httpx.HTTPStatusError("404 Not Found", request=request, response=httpx.Response(404, request=request))
+        if songTitle == "Track 2":
+            await asyncio.sleep(0.05) # still fetching when Track 1 fails
+        return f"{songTitle} makes me so happy, I love it", False
+
+    async def runHere(backend, function, *args, **kwargs): # no process pool, just call it
+        return function(*args, **kwargs)
+
+    monkeypatch.setattr(shf, "getTopTracksAsync", fakeTopTracks)
+    monkeypatch.setattr(musicBot, "getSongLyrics", fakeSongLyrics)
+    monkeypatch.setattr(eh, "runCPU", runHere)
+    ctx = benchmark.FakeContext("artistmood", userID=11, guildID=11, channelID=11)
+    asyncio.run(musicBot.artistmood.callback(ctx, "Some", "Artist"))
+    answer = ctx.sent[-1][0]
+    assert answer.count("Track") == 4 # every song is still in the answer
+    assert "Track 2" in answer and "Track 0" in answer
@@ -0,0 +1,112 @@
+'''
+test_prewarmHelper.py
+
+The prewarmer only warms artists people asked about lately, stays inside its hourly request budget, and holds off
+while a command is waiting for an API or a worker pool. Spotify and the warm function are stand-ins that count
+one background request each, like a cache miss would.
+'''
+
+import asyncio # the prewarmer is async
+import time # how long a round took
+import pytest
+import executorHelper as eh
+import prewarmHelper as pwh
+import rateLimitHelper as rl
+import spotifyHelper as shf
+
+
+
+
+@pytest.fixture
+def spotify(monkeypatch): # a fresh prewarmer whose spotify and genius are made up
+    limiter = rl.ApiLimiter("spotify", rate=1000, burst=100)
+    monkeypatch.setattr(rl, "limiters", {"spotify": limiter})
+    monkeypatch.setattr(pwh, "artistScores", {})
+    monkeypatch.setattr(pwh, "counters", dict.fromkeys(pwh.counters, 0))
+    monkeypatch.setattr(pwh, "tracksPerArtist", 2)
+    monkeypatch.setattr(pwh, "busyPollSeconds", 0.01)
+    calls = []
+
+    async def fakeTopTracks(artistName):
+        calls.append((time.monotonic(), artistName, None))
+        limiter.countSent(rl.currentPriority.get()) # one upstream request
+        return [(f"{artistName} Song {number}", "Album", 90 - number) for number in range(5)], artistName
+
+    monkeypatch.setattr(shf, "getTopTracksAsync", fakeTopTracks)
+    return calls
+
+
+
+def makeWarmSong(calls): # the warm function, one upstream request per song
+    async def warmSong(artistName, songTitle):
+        calls.append((time.monotonic(), artistName, songTitle))
+        rl.limiters["spotify"].countSent(rl.currentPriority.get())
+    return warmSong
+
+
+
+def setBudget(monkeypatch, callsPerHour, intervalSeconds):
+    monkeypatch.setattr(pwh, "callsPerHour", callsPerHour)
+    monkeypatch.setattr(pwh, "intervalSeconds", intervalSeconds)
+    monkeypatch.setattr(pwh, "budget", {'tokens': callsPerHour * intervalSeconds / 3600, 'updatedAt': time.monotonic()})
+
+
+
+
+def testOnlyHotArtistsAreWarmed(spotify, monkeypatch):
+    setBudget(monkeypatch, 3600 * 100, 1)
+    for artistName in ["Lorde", "Lorde", "Lorde", "Adele", "Adele", "Drake"]: # Drake was only asked about once
+        pwh.recordRequest(artistName)
+    asyncio.run(pwh.prewarmOnce(makeWarmSong(spotify)))
+    assert [(artistName, songTitle) for calledAt, artistName, songTitle in spotify] == [
+        ("Lorde", None), ("Lorde", "Lorde Song 0"), ("Lorde", "Lorde Song 1"), ("Adele", None), ("Adele", "Adele Song 0"), ("Adele", "Adele Song 1")]
+    assert pwh.counters['songsWarmed'] == 4 and pwh.counters['callsUsed'] == 6
+    assert rl.limiters["spotify"].counters['backgroundSent'] == 6 # all of it at background priority
+
+
+
+def testStaysInsideTheHourlyBudget(spotify, monkeypatch):
+    setBudget(monkeypatch, 3600 * 20, 0.15) # 20 requests a second, at most 3 saved up
+    for artistName in ["Lorde", "Adele"] * 2:
+        pwh.recordRequest(artistName)
+    startedAt = time.monotonic()
+    asyncio.run(pwh.prewarmOnce(makeWarmSong(spotify)))
+    assert len(spotify) == 6
+    for calledAt, artistName, songTitle in spotify: # never more than the 3 saved up plus what the budget earned since
+        callsSoFar = sum(1 for otherCalledAt, *rest in spotify if otherCalledAt <= calledAt)
+        assert callsSoFar <= 3 + (calledAt - startedAt) * 20 + 0.5
+    assert spotify[-1][0] - startedAt >= 0.1 # the last 3 had to wait for the budget to refill
+
+
+
+def testWaitsWhileCommandsAreWaiting(spotify, monkeypatch):
+    setBudget(monkeypatch, 3600 * 100, 1)
+    pwh.recordRequest("Lorde")
+    pwh.recordRequest("Lorde")
+    monkeypatch.setattr(eh, "backendStats", {"vader": dict(eh.newStats(), queued=1)}) # a /sentiment is waiting for a worker
+
+    async def run():
+        prewarming = asyncio.create_task(pwh.prewarmOnce(makeWarmSong(spotify)))
+        await asyncio.sleep(0.05)
+        assert spotify == [] and pwh.counters['waitedForCommands'] > 0
+        eh.backendStats["vader"]['queued'] = 0 # it got its worker
+        await prewarming
+
+    asyncio.run(run())
+    assert len(spotify) == 3
+
+
+
+def testACommandWaitingForATokenCounts(monkeypatch):
+    limiter = rl.ApiLimiter("genius", rate=1, burst=1)
+    monkeypatch.setattr(rl, "limiters", {"genius": limiter})
+    monkeypatch.setattr(eh, "backendStats", {})
+
+    async def run():
+        future = asyncio.get_running_loop().create_future()
+        limiter.waiters.append((rl.backgroundPriority, 0, future))
+        assert not pwh.commandsWaiting() # only background work in line
+        limiter.waiters.append((rl.interactivePriority, 1, future))
+        assert pwh.commandsWaiting()
+
+    asyncio.run(run())
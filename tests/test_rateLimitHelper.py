@@ -0,0 +1,156 @@
+'''
+test_rateLimitHelper.py
+
+The per channel limiters are forgotten once a channel has been quiet long enough for its bucket to fill back up,
+so a bot in lots of servers doesnt keep one for every channel it ever talked in.
+call() retries 429s and 5xx after what Retry-After says (or a backoff), gives up with UpstreamBusyError, and
+commands waiting for a token always go before background work.
+'''
+
+import asyncio # acquire and call are async
+import email.utils # Retry-After as a date
+import time # how long the retries waited
+import httpx # the errors the APIs answer with
+import pytest
+import rateLimitHelper as rl
+
+
+
+
+@pytest.fixture
+def channels(monkeypatch): # a fresh set of channel limiters, with room for 3
+    monkeypatch.setattr(rl, "channelLimiters", {})
+    monkeypatch.setattr(rl, "maxTrackedChannels", 3)
+    return rl.channelLimiters
+
+
+
+
+def testQuietChannelsAreForgotten(channels):
+    for channelID in (1, 2, 3):
+        rl.getChannelLimiter(channelID)
+    rl.getChannelLimiter(2).tokens = 0 # a message just went out in channel 2
+    rl.getChannelLimiter(4) # the cap is reached, the full (quiet) buckets are dropped
+    assert sorted(channels) == [2, 4]
+
+
+
+def testChannelsWithSomeoneWaitingAreKept(channels):
+    async def run():
+        busy = rl.getChannelLimiter(1)
+        busy.tokens = 0
+        waiter = asyncio.create_task(busy.acquire())
+        await asyncio.sleep(0) # now it is waiting in line
+        busy.tokens = busy.burst # even with a full bucket, it isnt dropped while someone waits
+        rl.getChannelLimiter(2)
+        rl.getChannelLimiter(3)
+        rl.getChannelLimiter(4)
+        assert 1 in channels and rl.getChannelLimiter(1) is busy
+        await waiter
+
+    asyncio.run(run())
+
+
+
+def testSameChannelGetsTheSameLimiter(channels):
+    assert rl.getChannelLimiter(7) is rl.getChannelLimiter(7)
+    assert rl.getChannelLimiter(7).burst == rl.channelBurst
+
+
+
+@pytest.fixture
+def genius(monkeypatch): # a fresh, fast limiter for call() to use
+    limiter = rl.ApiLimiter("genius", rate=1000, burst=10)
+    monkeypatch.setattr(rl, "limiters", {"genius": limiter})
+    monkeypatch.setattr(rl, "backoffBaseSeconds", 0.001)
+    return limiter
+
+
+
+def makeResponses(*statusCodes, headers=None): # a fake request that answers with these status codes in turn (then 200)
+    answers = list(statusCodes)
+    calls = []
+
+    async def request(url):
+        calls.append(url)
+        if answers:
+            statusCode = answers.pop(0)
+            httpRequest = httpx.Request("GET", url)
+            raise httpx.HTTPStatusError(f"HTTP {statusCode}", request=httpRequest, response=httpx.Response(statusCode, headers=headers, request=httpRequest))
+        return "ok"
+
+    return request, calls
+
+
+
+def testRetriesAfterWhatRetryAfterSays(genius):
+    request, calls = makeResponses(429, 429, headers={"Retry-After": "0.05"})
+    startedAt = time.monotonic()
+    assert asyncio.run(rl.call("genius", request, "https://genius.com")) == "ok"
+    assert time.monotonic() - startedAt >= 0.1 # waited the 0.05 seconds it asked for, twice
+    assert len(calls) == 3
+    assert genius.counters['throttled'] == 2 and genius.counters['retries'] == 2 and genius.counters['gaveUp'] == 0
+
+
+
+def testErrorsThatWontGetBetterArentRetried(genius):
+    request, calls = makeResponses(404)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(rl.call("genius", request, "https://genius.com"))
+    assert len(calls) == 1 and genius.counters['retries'] == 0
+
+
+
+def testGivesUpAfterEveryTry(genius, monkeypatch):
+    monkeypatch.setattr(rl, "retryAttempts", 3)
+    request, calls = makeResponses(503, 503, 503, 503)
+    with pytest.raises(rl.UpstreamBusyError, match="HTTP 503 after 3 tries"):
+        asyncio.run(rl.call("genius", request, "https://genius.com"))
+    assert len(calls) == 3 and genius.counters['gaveUp'] == 1
+
+
+
+def testTooLongARetryAfterGivesUpRightAway(genius):
+    request, calls = makeResponses(429, headers={"Retry-After": str(rl.maxRetryAfterSeconds + 60)})
+    with pytest.raises(rl.UpstreamBusyError):
+        asyncio.run(rl.call("genius", request, "https://genius.com"))
+    assert len(calls) == 1
+    assert genius.stats()['pausedFor'] > rl.maxRetryAfterSeconds # and everything else holds off too
+
+
+
+def testRetryAfterAsADate():
+    response = httpx.Response(429, headers={"Retry-After": email.utils.formatdate(time.time() + 30, usegmt=True)})
+    assert 25 <= rl.retryAfterSeconds(response) <= 30
+    assert rl.retryAfterSeconds(httpx.Response(429, headers={"Retry-After": "soon"})) is None
+
+
+
+def testCommandsGoBeforeBackgroundWork():
+    limiter = rl.ApiLimiter("test", rate=20, burst=1)
+    order = []
+
+    async def take(name, priority):
+        await limiter.acquire(priority)
+        order.append(name)
+
+    async def run():
+        limiter.tokens = 0 # everyone has to wait in line
+        waiters = [asyncio.create_task(take("background 1", rl.backgroundPriority)), asyncio.create_task(take("background 2", rl.backgroundPriority))]
+        await asyncio.sleep(0)
+        waiters.append(asyncio.create_task(take("command", rl.interactivePriority))) # came last, goes first
+        await asyncio.sleep(0)
+        assert limiter.interactiveWaiting()
+        await asyncio.gather(*waiters)
+
+    asyncio.run(run())
+    assert order == ["command", "background 1", "background 2"]
+    assert limiter.counters['backgroundSent'] == 2
+
+
+
+def testBackgroundSetsThePriority():
+    assert rl.currentPriority.get() == rl.interactivePriority
+    with rl.background():
+        assert rl.currentPriority.get() == rl.backgroundPriority
+    assert rl.currentPriority.get() == rl.interactivePriority
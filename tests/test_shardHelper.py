@@ -0,0 +1,46 @@
+'''
+test_shardHelper.py
+
+Every total the shard processes share (CPU workers, API rates, the prewarm budget, the in-flight limit) is split
+evenly over the processes, so together they stay at the totals from the 3510.env file.
+'''
+
+import admissionHelper as ah
+import executorHelper as eh
+import prewarmHelper as pwh
+import rateLimitHelper as rl
+import shardHelper as shh
+
+
+
+
+def testShardsAreSplitRoundRobin():
+    assert shh.assignShards(4, 2) == [[0, 2], [1, 3]]
+    assert shh.assignShards(5, 3) == [[0, 3], [1, 4], [2]]
+
+
+
+def testTotalsAreSplitOverTheProcesses(monkeypatch):
+    monkeypatch.setenv("VIBECHECK_CPU_WORKERS", "8") # set by the user, it is still the total for the whole bot
+    monkeypatch.setattr(eh, "cpuWorkerCount", 8)
+    monkeypatch.setattr(eh, "backendLimits", {"vader": 8, "plot": 6})
+    monkeypatch.setattr(rl, "limiters", {"genius": rl.ApiLimiter("genius", 4.0, 8)})
+    monkeypatch.setattr(pwh, "callsPerHour", 600.0)
+    monkeypatch.setattr(ah, "maxInFlight", 64)
+    monkeypatch.setenv("VIBECHECK_METRICS_PORT", "9100")
+    environment = shh.shardProcessEnvironment(1, [1, 3], 2)
+    assert environment['VIBECHECK_SHARD_IDS'] == "1,3" and environment['VIBECHECK_SHARED_CACHE'] == "1"
+    assert environment['VIBECHECK_CPU_WORKERS'] == "4"
+    assert environment['VIBECHECK_LIMIT_VADER'] == "4" and environment['VIBECHECK_LIMIT_PLOT'] == "3"
+    assert float(environment['VIBECHECK_RATE_GENIUS']) == 2.0 and environment['VIBECHECK_BURST_GENIUS'] == "4"
+    assert float(environment['VIBECHECK_PREWARM_CALLS_PER_HOUR']) == 300.0
+    assert environment['VIBECHECK_MAX_INFLIGHT'] == "32"
+    assert environment['VIBECHECK_METRICS_PORT'] == "9101" # its own port
+
+
+
+def testEveryProcessGetsAtLeastOne(monkeypatch):
+    monkeypatch.setattr(eh, "cpuWorkerCount", 2)
+    monkeypatch.setattr(eh, "backendLimits", {"vader": 2})
+    environment = shh.shardProcessEnvironment(2, [2], 3)
+    assert environment['VIBECHECK_CPU_WORKERS'] == "1" and environment['VIBECHECK_LIMIT_VADER'] == "1"
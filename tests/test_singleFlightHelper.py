@@ -0,0 +1,188 @@
+'''
+test_singleFlightHelper.py
+
+SingleFlight: callers asking for the same key at the same time share one run of the work, which isnt cancelled when
+one of them gives up and moves up to a command's priority when a command joins background work.
+Across shard processes, a key another shard already filled is answered from the shared cache, except that a cached
+"not found" isnt an answer for callers that pass acceptMissing=False (picking a /searchlyrics result).
+'''
+
+import asyncio # the flights are async
+import itertools # unique cache names
+import pytest
+import cacheHelper as ch
+import deadlineHelper as dh
+import rateLimitHelper as rl
+import singleFlightHelper as sfh
+
+cacheNumbers = itertools.count()
+
+
+
+
+@pytest.fixture
+def sharedCache(monkeypatch): # a cache the flight treats as shared with other shard processes
+    monkeypatch.setattr(ch, "sharedAcrossProcesses", True)
+    return ch.TwoTierCache(f"flight{next(cacheNumbers)}")
+
+
+
+def makeFetch(calls, answer="lyrics"): # the work, counting how often it really ran
+    async def fetch():
+        calls.append(answer)
+        return answer
+    return fetch
+
+
+
+
+def testSameKeySharesOneRun():
+    calls = []
+    flight = sfh.SingleFlight("test")
+
+    async def fetch(songTitle):
+        calls.append(songTitle)
+        await asyncio.sleep(0.05)
+        return f"lyrics of {songTitle}"
+
+    async def run():
+        answers = await asyncio.gather(*(flight.do(songTitle, fetch, songTitle) for songTitle in ["Jeremy"] * 5 + ["Black"]))
+        assert flight.stats()['inFlight'] == 0
+        answers.append(await flight.do("Jeremy", fetch, "Jeremy")) # finished work isnt shared, the next one starts fresh
+        return answers
+
+    assert asyncio.run(run()) == ["lyrics of Jeremy"] * 5 + ["lyrics of Black", "lyrics of Jeremy"]
+    assert calls == ["Jeremy", "Black", "Jeremy"]
+    assert flight.counters['started'] == 3 and flight.counters['shared'] == 4
+
+
+
+def testEveryWaiterGetsTheError():
+    flight = sfh.SingleFlight("test")
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise ValueError("genius broke")
+
+    async def run():
+        return await asyncio.gather(flight.do("song", fetch), flight.do("song", fetch), return_exceptions=True)
+
+    errors = asyncio.run(run())
+    assert [str(error) for error in errors] == ["genius broke"] * 2 and flight.counters['started'] == 1
+
+
+
+def testOneCallerGivingUpDoesntCancelTheWork():
+    calls = []
+    flight = sfh.SingleFlight("test")
+
+    async def fetch():
+        calls.append("fetch")
+        await asyncio.sleep(0.05)
+        return "lyrics"
+
+    async def run():
+        impatient = asyncio.create_task(flight.do("song", fetch))
+        patient = asyncio.create_task(flight.do("song", fetch))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        with dh.deadline(0.01): # the work doesnt get this deadline either
+            assert await flight.do("song", fetch) == "lyrics"
+        return await patient, impatient.cancelled()
+
+    assert asyncio.run(run()) == ("lyrics", True)
+    assert calls == ["fetch"]
+
+
+
+def testWorkDoesntInheritTheDeadline():
+    flight = sfh.SingleFlight("test")
+
+    async def fetch():
+        return dh.currentDeadline.get(), rl.currentPriority.get()
+
+    async def run():
+        with dh.deadline(5), rl.background():
+            return await flight.do("song", fetch)
+
+    assert asyncio.run(run()) == (None, rl.backgroundPriority) # the priority is kept, the deadline isnt
+
+
+
+def testCommandJoiningBackgroundWorkRaisesItsPriority():
+    flight = sfh.SingleFlight("test")
+    priorities = []
+
+    async def fetch():
+        priorities.append(rl.currentPriority.get())
+        await asyncio.sleep(0.05) # the prewarmer's fetch is waiting on something when the command shows up
+        priorities.append(rl.currentPriority.get())
+        return "top tracks"
+
+    async def prewarm():
+        with rl.background():
+            return await flight.do("artist", fetch)
+
+    async def run():
+        prewarming = asyncio.create_task(prewarm())
+        await asyncio.sleep(0.01)
+        assert await flight.do("artist", fetch) == "top tracks" # a command asks for the same artist
+        return await prewarming
+
+    assert asyncio.run(run()) == "top tracks"
+    assert priorities == [rl.backgroundPriority, rl.interactivePriority]
+
+
+
+def testCachedNegativeIsAnAnswerByDefault(sharedCache):
+    calls = []
+    sharedCache.setMissing("song")
+    flight = sfh.SingleFlight("test", cache=sharedCache)
+    assert asyncio.run(flight.do("song", makeFetch(calls))) is None # another shard already found out it doesnt exist
+    assert calls == [] and flight.counters['otherProcess'] == 1
+
+
+
+def testCachedNegativeIsNotAnAnswerWithAcceptMissingFalse(sharedCache):
+    calls = []
+    sharedCache.setMissing("song")
+    flight = sfh.SingleFlight("test", cache=sharedCache)
+    assert asyncio.run(flight.do("song", makeFetch(calls), acceptMissing=False)) == "lyrics"
+    assert calls == ["lyrics"] and flight.counters['started'] == 1
+
+
+
+def testWaitsForTheOtherShardThenFetches(sharedCache, monkeypatch):
+    monkeypatch.setattr(sfh, "pollSeconds", 0.01)
+    calls = []
+    flight = sfh.SingleFlight("test", cache=sharedCache)
+
+    async def run():
+        assert sharedCache.backend.claim("song", "other shard", 30) # another shard is searching for it by name
+        waiter = asyncio.create_task(flight.do("song", makeFetch(calls), acceptMissing=False))
+        await asyncio.sleep(0.05)
+        sharedCache.setMissing("song") # its search found nothing
+        await asyncio.sleep(0.05)
+        assert not waiter.done() and calls == [] # the None isnt our answer, and the other shard still holds the lease
+        sharedCache.backend.release("song", "other shard")
+        return await waiter
+
+    assert asyncio.run(run()) == "lyrics"
+    assert calls == ["lyrics"]
+
+
+
+def testFoundValueFromTheOtherShardIsUsed(sharedCache, monkeypatch):
+    monkeypatch.setattr(sfh, "pollSeconds", 0.01)
+    calls = []
+    flight = sfh.SingleFlight("test", cache=sharedCache)
+
+    async def run():
+        assert sharedCache.backend.claim("song", "other shard", 30)
+        waiter = asyncio.create_task(flight.do("song", makeFetch(calls), acceptMissing=False))
+        await asyncio.sleep(0.05)
+        sharedCache.set("song", "their lyrics")
+        return await waiter
+
+    assert asyncio.run(run()) == "their lyrics"
+    assert calls == []
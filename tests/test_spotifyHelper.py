@@ -0,0 +1,76 @@
+'''
+test_spotifyHelper.py
+
+The async Spotify functions: one token is shared by every request until it is about to expire, and stale top
+tracks are answered right away while one background refresh (at background priority) fetches new ones.
+Spotify is a stand-in for rl.call, so nothing here touches the network.
+'''
+
+import asyncio # the async functions
+import itertools # unique cache names
+import pytest
+import cacheHelper as ch
+import httpHelper as hh
+import rateLimitHelper as rl
+import singleFlightHelper as sfh
+import spotifyHelper as shf
+
+cacheNumbers = itertools.count()
+
+
+
+
+@pytest.fixture
+def spotify(monkeypatch): # fresh caches and token, and a fake spotify that counts what it was asked for
+    cacheNumber = next(cacheNumbers)
+    topTracksCache = ch.TwoTierCache(f"topTracks{cacheNumber}", ttlSeconds=0, staleSeconds=3600) # everything is stale as soon as it is stored
+    monkeypatch.setattr(shf, "artistIndex", ch.TwoTierCache(f"artists{cacheNumber}"))
+    monkeypatch.setattr(shf, "topTracksCache", topTracksCache)
+    monkeypatch.setattr(shf, "artistFlight", sfh.SingleFlight("spotify artists"))
+    monkeypatch.setattr(shf, "topTracksFlight", sfh.SingleFlight("spotify top tracks", cache=topTracksCache))
+    monkeypatch.setattr(shf, "asyncToken", {'accessToken': None, 'expiresAt': 0.0})
+    monkeypatch.setattr(shf, "asyncTokenLock", None) # the lock belongs to the event loop of the test that made it
+    requests = []
+
+    async def fakeCall(api, coroutineFunction, url, **kwargs):
+        requests.append((url.rsplit("/", 1)[-1], rl.currentPriority.get()))
+        await asyncio.sleep(0.01)
+        if coroutineFunction is hh.postJSON:
+            return {'access_token': f"token {len(requests)}", 'expires_in': 3600}
+        if url.endswith("/search"):
+            return {'artists': {'items': [{'id': "4LLpKhyESsyAXpc4laK94U", 'name': "Mac Miller"}]}}
+        popularity = sum(1 for path, priority in requests if path == "top-tracks") # goes up every time, so a refreshed list is different
+        return {'tracks': [{'name': "Blue World", 'album': {'name': "Circles"}, 'popularity': popularity}]}
+
+    monkeypatch.setattr(rl, "call", fakeCall)
+    return requests
+
+
+
+
+def testOneTokenForEveryRequest(spotify):
+    async def run():
+        return await asyncio.gather(*(shf.getSpotifyTokenAsync() for _ in range(20)))
+
+    assert asyncio.run(run()) == ["token 1"] * 20
+    assert len(spotify) == 1
+    shf.asyncToken['expiresAt'] = shf.time.time() + 30 # less than a minute left, get a new one
+    assert asyncio.run(shf.getSpotifyTokenAsync()) == "token 2"
+
+
+
+def testStaleTopTracksAreRefreshedInTheBackground(spotify):
+    async def run():
+        first = await shf.getTopTracksAsync("mac miller")
+        stale = await asyncio.gather(shf.getTopTracksAsync("Mac Miller"), shf.getTopTracksAsync("MAC MILLER")) # answered right away from the cache
+        await asyncio.gather(*shf.backgroundTasks)
+        refreshed = await shf.getTopTracksAsync("macmiller")
+        await asyncio.gather(*shf.backgroundTasks)
+        return first, stale, refreshed
+
+    first, stale, refreshed = asyncio.run(run())
+    assert first == ({("Blue World", "Circles", 1)}, "Mac Miller")
+    assert stale == [first, first]
+    assert refreshed == ({("Blue World", "Circles", 2)}, "Mac Miller") # the one background refresh filled the cache
+    assert [path for path, priority in spotify] == ["token", "search", "top-tracks", "top-tracks", "top-tracks"] # one search, and one refresh per stale answer
+    assert [priority for path, priority in spotify if path == "top-tracks"] == [rl.interactivePriority, rl.backgroundPriority, rl.backgroundPriority]
@@ -0,0 +1,91 @@
+'''
+test_vaderBatchHelper.py
+
+The batch engine has to give the same scores as calling VADER's polarity_scores on every chunk, including the
+chunks where the positive and negative sums tie (then neither side gets the ! and ? emphasis), and down to the last
+rounded digit when a score lands right on a half.
+'''
+
+import random # made up lyrics
+import pytest
+import vaderHelper as vh # builds the batch engine from the bundled lexicon
+
+# words with every kind of VADER rule: lexicon words, negations, boosters, "but", "kind of", ALL CAPS, and slang that ties
+testWords = ("love hate happy sad good bad cry smile lonely free broken never not don't can't very so but kind of LOVE GREAT "
+             "awful yeah the a i you and ntmu tmi btdt").split()
+tiedLyrics = ["ntmu tmi btdt!", "good bad!", "happy sad?? yeah", "love hate!!"] # the positive and negative sums cancel out
+
+
+
+
+def makeSongs(count, seed=0): # made up songs with punctuation and line breaks mixed in
+    randomGenerator = random.Random(seed)
+    return [" ".join(randomGenerator.choice(testWords) + randomGenerator.choice(["", "", "", "!", "?", "\n"]) for _ in range(randomGenerator.randint(1, 60)))
+            for _ in range(count)]
+
+
+
+def assertSameAsVader(analyzer, result): # every chunk's scores match polarity_scores of that chunk's text
+    for chunk, scores in zip(result['chunks'], result['chunkScores']):
+        expected = analyzer.polarity_scores(chunk)
+        for name in ('neg', 'neu', 'pos', 'compound'):
+            assert scores[name] == expected[name], (chunk, name)
+
+
+
+@pytest.fixture(scope="module")
+def engine():
+    return vh.getVaderEngine()
+
+
+
+
+def testAnalyzeManyMatchesVader(engine):
+    songs = makeSongs(200) + tiedLyrics
+    for result in engine.analyzeMany(songs):
+        assertSameAsVader(engine.analyzer, result)
+
+
+
+def testTiesMatchVader(engine):
+    for lyrics in tiedLyrics:
+        expected = engine.analyzer.polarity_scores(lyrics)
+        assert expected['pos'] > 0 and expected['neg'] > 0 # really a tie, not just a neutral line
+        assertSameAsVader(engine.analyzer, engine.analyzeMany([lyrics])[0])
+        assertSameAsVader(engine.analyzer, engine.analyzeWindows(lyrics, window=10))
+
+
+
+def testAnalyzeWindowsMatchesVader(engine):
+    for lyrics in makeSongs(50, seed=1) + tiedLyrics:
+        for window, stride in ((10, 10), (10, 3), (4, 1)):
+            assertSameAsVader(engine.analyzer, engine.analyzeWindows(lyrics, window=window, stride=stride))
+
+
+
+@pytest.mark.parametrize("lyrics", ["free good\n lonely? the sad", "free? hate\n so", "ntmu smile\n cry"])
+def testScoresOnAHalfRoundLikeVader(engine, lyrics): # neg or pos is (almost) exactly x.xxx5 here
+    assertSameAsVader(engine.analyzer, engine.analyzeMany([lyrics])[0])
+    assertSameAsVader(engine.analyzer, engine.analyzeWindows(lyrics, window=10))
+
+
+
+def testWindowsMatchVaderExactly(engine): # lots of songs, so some windows land on a half
+    for lyrics in makeSongs(100, seed=6) + makeSongs(100, seed=20):
+        assertSameAsVader(engine.analyzer, engine.analyzeWindows(lyrics, window=10, stride=10))
+
+
+
+def testWindowsWithoutOverlapAreTheChunks(engine):
+    for lyrics in makeSongs(50, seed=2):
+        chunks = engine.analyzeMany([lyrics])[0]
+        windows = engine.analyzeWindows(lyrics, window=10)
+        if len(lyrics.split()) > 10: # a short song is one chunk of the whole string, but one window of just its words
+            assert windows['chunks'] == chunks['chunks']
+        assert windows['chunkScores'] == chunks['chunkScores']
+
+
+
+def testEmptyLyrics(engine):
+    assert engine.analyzeMany([None, ""]) == [None, None]
+    assert engine.analyzeWindows("") is None
@@ -0,0 +1,516 @@
+'''
+vaderBatchHelper.py
+
+This helper file is a faster way to get the same per-chunk VADER scores that vaderHelper.analyzeLyrics
+used to get by calling vaderSIA.polarity_scores on every 10 word chunk in a loop.
+
+polarity_scores re-tokenizes each chunk and builds a bunch of lists and dictionaries every call. Here we
+split the lyrics once, look each word up once in a NumPy array of lexicon valences, and then score every
+chunk (of every song in the batch) at the same time with NumPy sums.
+
+How it stays the same as VADER:
+    For most chunks, VADER's score is just the lexicon valence of each word plus a bonus for ! and ?,
+    squashed into -1..1. That part is done with NumPy.
+    VADER also has rules that look at neighboring words: negations ("not", "don't"), boosters ("very"),
+    "but", "least", "never so", ALL CAPS words, idioms like "kiss of death". Negations and boosters only
+    change anything when a lexicon word comes within the next 3 words, so a chunk is only handed to
+    vaderSIA.polarity_scores (like before) when one of these rules could actually change its score.
+    Those chunks come out exactly the same as always.
+    The scores end up the same as the old loop (give or take float rounding in the last digit).
+
+The results come back as a SentimentResult: one float32 array of scores and one array of (start, end)
+positions in the lyrics, instead of a dictionary and a copy of the text for every chunk. It still reads like
+the old dictionary (result['chunkScores'], result['chunks'], result['averageCompound']), and toBytes() makes
+the small copy the sentiment cache in vaderHelper.py stores.
+
+NumPy documentation for bincount (which does the per-chunk sums): https://numpy.org/doc/stable/reference/generated/numpy.bincount.html
+VADER source we are matching: https://www.nltk.org/_modules/nltk/sentiment/vader.html
+'''
+
+import re # finds each word and where it is in the lyrics
+import struct # packs the small header of SentimentResult.toBytes
+import numpy as np # vectorized math over every word at once
+
+# what kind of VADER rule a word can switch on (see BatchEngine.describeWord)
+plainWord = 0 # no rules, just its lexicon valence
+modifierWord = 1 # changes lexicon words in the next 3 tokens (negations, boosters, "never", "so", "this", "least")
+alwaysContextWord = 2 # always needs VADER's own scoring ("but", "kind of", idioms, ALL CAPS sentiment words)
+
+valenceScale = 10000 # analyzeWindows keeps valences as whole numbers (valence * 10000) so running sums stay exact
+
+wordPattern = re.compile(r"\S+") # a word is anything between whitespace, same as str.split() but we also get where it is
+scoreNames = ('neg', 'neu', 'pos', 'compound') # the columns of SentimentResult.scores, in this order
+scoreDigits = (3, 3, 3, 4) # polarity_scores rounds neg/neu/pos to 3 digits and compound to 4
+unitCodes = {None: 0, "words": 1, "lines": 2} # how SentimentResult.toBytes stores the window unit
+headerFormat = "<4sIdIIB" # magic, chunk count, averageCompound, window, stride, unit code
+headerSize = struct.calcsize(headerFormat)
+halfTolerance = 1e-9 # how close to a ...5 a score has to be before numpy's rounding (or our exact sums) might not agree with VADER's
+
+
+
+
+def wordSpans(lyrics): # (start, end) of every word, from the lyrics' token stream if they have one (see geniusHelper.normalizeLyrics)
+    if hasattr(lyrics, "spans"):
+        return lyrics.spans()
+    return [match.span() for match in wordPattern.finditer(lyrics)]
+
+
+
+
+def isNearHalf(values, digits): # True where a score is (almost) exactly halfway between two rounded values
+    scaled = values * 10 ** digits
+    return np.abs(scaled - np.floor(scaled) - 0.5) < halfTolerance * 10 ** digits
+
+
+
+def roundLikeVader(values, digits): # np.round, but the scores next to a half use python's round like polarity_scores does
+    rounded = np.round(values, digits) # numpy multiplies by 10 ** digits first, which can push 0.46249999... up to 462.5
+    for position in np.flatnonzero(isNearHalf(values, digits)).tolist():
+        rounded[position] = round(float(values[position]), digits)
+    return rounded
+
+
+
+class SentimentResult: # what analyzeLyrics returns: every chunk's scores in one small numpy block instead of a dictionary per chunk
+    '''
+    The old result was a list with a dictionary per chunk plus a copy of every chunk's text, which is a few
+    hundred bytes of python objects per chunk. This keeps:
+        scores: one float32 array with a row per chunk and the columns neg, neu, pos, compound (16 bytes a chunk)
+        offsets: one uint32 array with a (start, end) row per chunk, where the chunk is in the lyrics (8 bytes a chunk)
+        lyrics: the lyrics string itself (the same string object the lyrics cache already has, not a copy)
+
+    It still works like the old dictionary, so formatSentimentResults, sentimentViz and anything else that does
+    result['chunkScores'], result['chunks'] or result['averageCompound'] keeps working. Those lists are built
+    when someone asks for them.
+
+    toBytes() / fromBytes() turn it into about 24 bytes per chunk for the sentiment cache.
+
+    example:
+        result = vh.analyzeLyrics(lyrics)
+        result['averageCompound'] # -0.21
+        result.scores[:, 3] # every chunk's compound score as an array
+    '''
+
+    __slots__ = ('scores', 'offsets', 'lyrics', 'averageCompound', 'window', 'stride', 'unit') # no per-object __dict__
+
+    def __init__(self, scores, offsets, lyrics, averageCompound, window=None, stride=None, unit=None):
+        self.scores = np.ascontiguousarray(scores, dtype=np.float32)
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.uint32)
+        self.lyrics = lyrics
+        self.averageCompound = averageCompound
+        self.window = window
+        self.stride = stride
+        self.unit = unit
+
+
+    def keys(self): # the keys the old dictionary had
+        if self.window is None:
+            return ['chunkScores', 'chunks', 'averageCompound']
+        return ['chunkScores', 'chunks', 'averageCompound', 'window', 'stride', 'unit']
+
+
+    def __getitem__(self, key): # result['chunkScores'] and friends, like the old dictionary
+        if key == 'chunkScores':
+            return self.chunkScores()
+        if key == 'chunks':
+            return self.chunks()
+        if key in self.keys():
+            return getattr(self, key)
+        raise KeyError(key)
+
+
+    def get(self, key, default=None):
+        return self[key] if key in self.keys() else default
+
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+    def __len__(self): # number of chunks
+        return len(self.scores)
+
+
+    def __bool__(self): # a result is always something, even if it only has one chunk
+        return True
+
+
+    def chunkScores(self): # the old list of {'neg', 'neu', 'pos', 'compound'} dictionaries
+        rows = self.scores.tolist()
+        return [{name: round(value, digits) for name, value, digits in zip(scoreNames, row, scoreDigits)} for row in rows] # round() undoes float32's extra digits
+
+
+    def compoundScores(self): # just the compound column, which is all the plot needs
+        return [round(value, 4) for value in self.scores[:, 3].tolist()]
+
+
+    def chunks(self): # the text of every chunk, sliced out of the lyrics (empty if the lyrics werent kept)
+        if self.lyrics is None:
+            return []
+        return [self.lyrics[start:end] for start, end in self.offsets.tolist()]
+
+
+    def toBytes(self): # a compact copy for the cache (the lyrics arent included, the lyrics cache has them)
+        header = struct.pack(headerFormat, b"VSR1", len(self.scores), self.averageCompound, self.window or 0, self.stride or 0, unitCodes[self.unit])
+        return header + self.scores.tobytes() + self.offsets.tobytes()
+
+
+    @classmethod
+    def fromBytes(cls, data, lyrics=None): # undoes toBytes, pass the lyrics back in if you need result['chunks']
+        magic, count, averageCompound, window, stride, unitCode = struct.unpack_from(headerFormat, data)
+        if magic != b"VSR1":
+            raise ValueError("not a SentimentResult")
+        scores = np.frombuffer(data, dtype=np.float32, count=count * 4, offset=headerSize).reshape(count, 4)
+        offsets = np.frombuffer(data, dtype=np.uint32, count=count * 2, offset=headerSize + count * 16).reshape(count, 2)
+        unit = {code: name for name, code in unitCodes.items()}[unitCode]
+        return cls(scores, offsets, lyrics, averageCompound, window or None, stride or None, unit)
+
+
+    def __reduce__(self): # pickling (like sending it back from a worker process) goes through toBytes too
+        return (restoreSentimentResult, (self.toBytes(), self.lyrics))
+
+
+    def __repr__(self):
+        return f"SentimentResult(chunks={len(self)}, averageCompound={self.averageCompound:.4f})"
+
+
+
+
+def restoreSentimentResult(data, lyrics): # used by SentimentResult.__reduce__ (pickle needs a module level function)
+    return SentimentResult.fromBytes(data, lyrics)
+
+
+
+
+class BatchEngine: # one of these is built from vaderHelper's SentimentIntensityAnalyzer
+    '''
+    args:
+        analyzer (SentimentIntensityAnalyzer): the nltk VADER analyzer, we use its lexicon and constants
+            and fall back to its polarity_scores for chunks that need VADER's context rules
+
+    example:
+        engine = BatchEngine(vaderSIA)
+        resultsForEachSong = engine.analyzeMany([lyricsOne, lyricsTwo], chunkSize=10)
+    '''
+
+    maxRememberedWords = 200000 # the word info memo is cleared if it ever gets bigger than this
+
+
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+        constants = analyzer.constants
+
+        # the "vocabulary": every lexicon word gets a row number, and valences[row] is its score.
+        # the extra last row is 0.0 for words that arent in the lexicon (and for 1 letter words, which VADER skips)
+        self.vocabulary = {word: row for row, word in enumerate(analyzer.lexicon)}
+        self.valences = np.array(list(analyzer.lexicon.values()) + [0.0], dtype=np.float64)
+        self.missingRow = len(self.valences) - 1
+
+        self.puncList = constants.PUNC_LIST # punctuation VADER strips off the front or back of a word
+        self.removePunctuation = constants.REGEX_REMOVE_PUNCTUATION
+        self.boosterWords = set(constants.BOOSTER_DICT)
+
+        # modifier words only change the score of a lexicon word up to 3 words after them (negations, boosters, never-check, least-check)
+        self.modifierWords = set(constants.NEGATE) | self.boosterWords | {"least", "never", "so", "this"}
+        # these switch on a rule no matter what comes after them, so a chunk with one always goes to polarity_scores
+        self.contextWords = {"but", "kind"} # but-check and "kind of"
+        self.contextWords |= {phrase.split()[-1] for phrase in constants.SPECIAL_CASE_IDIOMS} # an idiom can only match if its last word is there
+        self.contextWords |= {phrase.split()[-1] for phrase in constants.BOOSTER_DICT if " " in phrase} # same for "sort of", "just enough"...
+
+        self.wordInfo = {} # raw word -> (vocabulary row, counts as a VADER token, rule kind, number of !, number of ?)
+
+
+    def vaderForm(self, word): # the token VADER would turn this word into (it strips ONE punctuation mark off the front or back)
+        for punctuation in self.puncList:
+            if word.endswith(punctuation):
+                stripped = word[:-len(punctuation)]
+            elif word.startswith(punctuation):
+                stripped = word[len(punctuation):]
+            else:
+                continue
+            # VADER only strips it if what is left is a real word with no punctuation of its own
+            if len(stripped) > 1 and self.removePunctuation.sub("", stripped) == stripped:
+                return stripped
+        return word
+
+
+    def describeWord(self, word): # works out everything we need to know about one raw word, memoized since songs repeat words a lot
+        info = self.wordInfo.get(word)
+        if info is None:
+            isToken = len(word) > 1 # VADER ignores single characters like "a" or "I"
+            token = self.vaderForm(word) if isToken else word
+            lowered = token.lower()
+            row = self.vocabulary.get(lowered, self.missingRow) if isToken else self.missingRow
+            ruleKind = plainWord
+            if not isToken:
+                pass
+            elif lowered in self.contextWords or (token.isupper() and (row != self.missingRow or lowered in self.boosterWords)): # ALL CAPS emphasis too
+                ruleKind = alwaysContextWord
+            elif lowered in self.modifierWords or "n't" in lowered: # VADER counts anything with n't as a negation
+                ruleKind = modifierWord
+            info = (row, isToken, ruleKind, word.count("!"), word.count("?"))
+            if len(self.wordInfo) >= self.maxRememberedWords:
+                self.wordInfo.clear()
+            self.wordInfo[word] = info
+        return info
+
+
+    def analyzeMany(self, listOfLyrics, chunkSize=10): # scores every chunk of every song in one vectorized pass
+        '''
+        args:
+            listOfLyrics (list of str): the songs to analyze
+            chunkSize (int): number of words per chunk, same as analyzeLyrics
+
+        returns:
+            list: one SentimentResult per song (it works like the old 'chunkScores', 'chunks', 'averageCompound'
+                  dictionary), or None for songs whose lyrics are None or empty
+        '''
+        chunkTexts = [] # the text of every chunk of every song, in order (only used for chunks VADER has to score itself)
+        chunkOffsets = [] # (start, end) of every chunk in its song's lyrics
+        chunkRanges = [] # (first chunk, last chunk + 1) for each song
+        rows, isTokens, ruleKinds, bangs, questions, chunkIds = [], [], [], [], [], []
+
+        for lyrics in listOfLyrics:
+            if not lyrics: # same check as analyzeLyrics
+                chunkRanges.append(None)
+                continue
+            spans = wordSpans(lyrics) # the song's token stream (or, for plain strings, the one and only time this song gets tokenized)
+            words = [lyrics[start:end] for start, end in spans]
+            firstChunk = len(chunkTexts)
+            if len(words) <= chunkSize: # short song: the whole lyrics string is the one chunk, like analyzeLyrics does
+                chunkOffsets.append((0, len(lyrics)))
+            else:
+                # a chunk runs from the start of its first word to the end of its last word. its text is the lyrics
+                # between those (with the original line breaks), which VADER splits into exactly the same words
+                chunkOffsets.extend((spans[i][0], spans[min(i + chunkSize, len(spans)) - 1][1]) for i in range(0, len(words), chunkSize))
+            chunkTexts.extend(lyrics[start:end] for start, end in chunkOffsets[firstChunk:])
+            for position, word in enumerate(words):
+                row, isToken, ruleKind, bangCount, questionCount = self.describeWord(word)
+                rows.append(row)
+                isTokens.append(isToken)
+                ruleKinds.append(ruleKind)
+                bangs.append(bangCount)
+                questions.append(questionCount)
+                chunkIds.append(firstChunk + position // chunkSize)
+            chunkRanges.append((firstChunk, len(chunkTexts)))
+
+        chunkCount = len(chunkTexts)
+        rows, isTokens, ruleKinds = np.array(rows, dtype=np.int64), np.array(isTokens, dtype=bool), np.array(ruleKinds, dtype=np.int8)
+        chunkIds = np.array(chunkIds, dtype=np.int64)
+        valence = self.valences[rows] # every word's lexicon score in one lookup
+        sumBy = lambda weights: np.bincount(chunkIds, weights=weights, minlength=chunkCount) # per-chunk sum of anything
+
+        neg, neu, pos, compound = self.scoresFromSums(
+            sumBy(valence),
+            sumBy(np.where(valence > 0, valence + 1, 0.0)), # VADER adds 1 to each positive word to balance the neutral count
+            sumBy(np.where(valence < 0, valence - 1, 0.0)),
+            sumBy((isTokens & (valence == 0)).astype(np.float64)),
+            sumBy(isTokens.astype(np.float64)),
+            sumBy(np.array(bangs, dtype=np.float64)),
+            sumBy(np.array(questions, dtype=np.float64)),
+        )
+        needsExact = self.findContextChunks(rows, isTokens, ruleKinds, chunkIds, chunkCount)
+        chunkScores = self.scoreArray(neg, neu, pos, compound, needsExact, chunkTexts)
+
+        results = []
+        songLyrics = iter([lyrics for lyrics in listOfLyrics if lyrics])
+        for chunkRange in chunkRanges:
+            if chunkRange is None:
+                results.append(None)
+                continue
+            first, last = chunkRange
+            songCompounds = chunkScores[first:last, 3].tolist()
+            results.append(SentimentResult(
+                chunkScores[first:last],
+                chunkOffsets[first:last],
+                next(songLyrics),
+                sum(songCompounds) / len(songCompounds), # same python float sum as always, so the average doesnt change
+            ))
+        return results
+
+
+    def analyzeWindows(self, lyrics, window=10, stride=None, unit="words"): # overlapping windows in O(n) with running sums
+        '''
+        Score a window that slides along the song. With stride == window (and unit "words") this gives
+        the same chunks and scores as analyzeMany, smaller strides give overlapping windows and a smoother curve.
+
+        Instead of re-scoring every window from scratch (window words each time), we keep running totals
+        (prefix sums) of every word's contribution, so each window's totals are just end total - start total.
+        The valences are stored as whole numbers (times 10000) so the subtraction is exact and a window
+        with nothing in it really sums to 0.
+
+        args:
+            lyrics (str): the song lyrics
+            window (int): window size, in words or lines
+            stride (int): how far the window moves each step (defaults to window, so no overlap)
+            unit (str): "words" or "lines"
+
+        returns:
+            SentimentResult: same as analyzeLyrics plus 'window', 'stride' and 'unit', or None if lyrics is None or empty
+        '''
+        if not lyrics:
+            return None
+        stride = stride or window
+        if window < 1 or stride < 1:
+            raise ValueError("window and stride have to be at least 1")
+
+        spans = wordSpans(lyrics) # every word and where it is
+        words = [lyrics[start:end] for start, end in spans]
+        if unit == "lines": # each window is a number of (non-blank) lines
+            if hasattr(lyrics, "lineEnds"): # the token stream knows where the lines end, count the words before each one
+                wordStarts = np.array([start for start, end in spans], dtype=np.int64)
+                boundaries = np.concatenate(([0], np.searchsorted(wordStarts, np.array(lyrics.lineEnds, dtype=np.int64))))
+            else:
+                lineWordCounts = [len(line.split()) for line in lyrics.splitlines() if line.strip()]
+                boundaries = np.cumsum([0] + lineWordCounts) # word position where each line starts
+        elif unit == "words":
+            boundaries = np.arange(len(words) + 1)
+        else:
+            raise ValueError('unit has to be "words" or "lines"')
+
+        # window starts and ends in units, then in words. the last window is the first one that reaches the end
+        unitCount = len(boundaries) - 1
+        unitStarts = []
+        for unitStart in range(0, max(unitCount, 1), stride):
+            unitStarts.append(unitStart)
+            if unitStart + window >= unitCount:
+                break
+        unitStarts = np.array(unitStarts, dtype=np.int64)
+        starts = boundaries[unitStarts]
+        ends = boundaries[np.minimum(unitStarts + window, unitCount)]
+
+        # one entry per word, same as analyzeMany
+        wordInfo = [self.describeWord(word) for word in words]
+        rows = np.array([info[0] for info in wordInfo], dtype=np.int64)
+        isTokens = np.array([info[1] for info in wordInfo], dtype=bool)
+        ruleKinds = np.array([info[2] for info in wordInfo], dtype=np.int8)
+        scaledValence = np.rint(self.valences[rows] * valenceScale).astype(np.int64)
+
+        def windowSums(values): # running totals, then end minus start for every window at once
+            prefix = np.concatenate(([0], np.cumsum(values)))
+            return prefix[ends] - prefix[starts]
+
+        valenceSums = windowSums(scaledValence)
+        positiveSums = windowSums(np.where(scaledValence > 0, scaledValence + valenceScale, 0))
+        negativeSums = windowSums(np.where(scaledValence < 0, scaledValence - valenceScale, 0))
+        bangCounts = windowSums(np.array([info[3] for info in wordInfo], dtype=np.int64))
+        questionCounts = windowSums(np.array([info[4] for info in wordInfo], dtype=np.int64))
+        neg, neu, pos, compound = self.scoresFromSums(
+            valenceSums / valenceScale,
+            positiveSums / valenceScale,
+            negativeSums / valenceScale,
+            windowSums(isTokens & (scaledValence == 0)).astype(np.float64),
+            windowSums(isTokens).astype(np.float64),
+            bangCounts.astype(np.float64),
+            questionCounts.astype(np.float64),
+        )
+        needsExact = self.findContextWindows(rows, isTokens, ruleKinds, starts, ends)
+        # when the valences cancel out to exactly 0, VADER's own float sum comes out as a tiny bit above or below 0,
+        # and with ! or ? in the window that decides which way the emphasis goes. the same goes for the positive and
+        # negative sums being a tie (that decides whether pos or neg gets the emphasis). let VADER score those rare windows
+        hasSentiment = windowSums(scaledValence != 0) > 0
+        isTie = (valenceSums == 0) | ((positiveSums == -negativeSums) & (positiveSums > 0))
+        needsExact |= isTie & hasSentiment & ((bangCounts > 0) | (questionCounts > 1))
+        # our sums are exact, VADER's float sums are off by a hair. that only matters when a score is right on a half
+        # (like neg = 7/16 = 0.4375), where the hair decides whether it rounds up or down
+        for values, digits in zip((neg, neu, pos, compound), scoreDigits):
+            needsExact |= isNearHalf(values, digits)
+        if not words: # whitespace only, one empty window like before
+            windowOffsets = [(0, 0)] * len(starts)
+        else:
+            windowOffsets = [(spans[start][0], spans[end - 1][1]) if end > start else (spans[min(start, len(spans) - 1)][0],) * 2 for start, end in zip(starts.tolist(), ends.tolist())]
+        windowTexts = [lyrics[start:end] for start, end in windowOffsets]
+        windowScores = self.scoreArray(neg, neu, pos, compound, needsExact, windowTexts)
+        windowCompounds = windowScores[:, 3].tolist()
+
+        return SentimentResult(windowScores, windowOffsets, lyrics, sum(windowCompounds) / len(windowCompounds), window, stride, unit)
+
+
+    def scoresFromSums(self, sumS, posSum, negSum, neuCount, tokenCount, bangCount, questionCount): # the vectorized part of VADER's score_valence
+        '''
+        Every argument is an array with one entry per chunk (or window): the sum of the valences, the sum of
+        (valence + 1) for positive words, the sum of (valence - 1) for negative words, the number of neutral
+        tokens, the number of tokens, and the number of ! and ? marks.
+
+        returns:
+            tuple: (neg, neu, pos, compound) arrays with one entry per chunk
+        '''
+        # punctuation emphasis: up to 4 ! add 0.292 each, 2 or 3 ? add 0.18 each, more than 3 ? add 0.96
+        bangCount = np.minimum(bangCount, 4)
+        amplifier = bangCount * 0.292 + np.where(questionCount > 1, np.where(questionCount <= 3, questionCount * 0.18, 0.96), 0.0)
+
+        sumS = np.where(sumS > 0, sumS + amplifier, np.where(sumS < 0, sumS - amplifier, sumS))
+        compound = sumS / np.sqrt(sumS * sumS + 15) # VaderConstants.normalize with alpha=15
+
+        posWins = posSum > np.abs(negSum) # the emphasis goes to whichever side is bigger
+        negWins = posSum < np.abs(negSum)
+        posSum = np.where(posWins, posSum + amplifier, posSum)
+        negSum = np.where(negWins, negSum - amplifier, negSum)
+        total = posSum + np.abs(negSum) + neuCount
+        safeTotal = np.where(total > 0, total, 1.0) # chunks with no tokens score all zeros, this just avoids dividing by zero
+
+        hasTokens = tokenCount > 0
+        neg = np.where(hasTokens, np.abs(negSum / safeTotal), 0.0)
+        neu = np.where(hasTokens, np.abs(neuCount / safeTotal), 0.0)
+        pos = np.where(hasTokens, np.abs(posSum / safeTotal), 0.0)
+        compound = np.where(hasTokens, compound, 0.0)
+        return neg, neu, pos, compound
+
+
+    def scoreArray(self, neg, neu, pos, compound, needsExact, texts): # the final (chunks x 4) score array, rounded like polarity_scores
+        scores = np.column_stack([roundLikeVader(values, digits) for values, digits in zip((neg, neu, pos, compound), scoreDigits)])
+        for chunkId in np.flatnonzero(needsExact).tolist(): # these chunks use one of VADER's context rules, let VADER score them the normal way
+            exactScores = self.analyzer.polarity_scores(texts[chunkId])
+            scores[chunkId] = [exactScores[name] for name in scoreNames]
+        return scores
+
+
+    def modifierPairs(self, rows, isTokens, ruleKinds): # word positions of every (modifier, lexicon word up to 3 tokens later) pair
+        tokenPositions = np.flatnonzero(isTokens) # VADER skips 1 letter words, so "the next 3 words" means the next 3 tokens
+        isLexiconWord = rows[tokenPositions] != self.missingRow
+        isModifier = ruleKinds[tokenPositions] == modifierWord
+        pairStarts, pairEnds = [], []
+        for distance in (1, 2, 3):
+            if len(tokenPositions) <= distance:
+                break
+            hit = isModifier[:-distance] & isLexiconWord[distance:]
+            pairStarts.append(tokenPositions[:-distance][hit])
+            pairEnds.append(tokenPositions[distance:][hit])
+        if not pairStarts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(pairStarts), np.concatenate(pairEnds)
+
+
+    def findContextWindows(self, rows, isTokens, ruleKinds, starts, ends): # findContextChunks for windows that can overlap
+        '''
+        returns:
+            array: True for each window [start, end) where one of VADER's context rules could change the score
+        '''
+        alwaysCount = np.concatenate(([0], np.cumsum(ruleKinds == alwaysContextWord)))
+        needsExact = (alwaysCount[ends] - alwaysCount[starts]) > 0
+
+        # a window needs VADER if it holds a whole modifier pair. for every start position, find the earliest
+        # pair end among the pairs that start at or after it (a running minimum from the back), then compare to the window end
+        pairStarts, pairEnds = self.modifierPairs(rows, isTokens, ruleKinds)
+        wordCount = len(rows)
+        earliestEnd = np.full(wordCount + 1, wordCount + 1, dtype=np.int64)
+        np.minimum.at(earliestEnd, pairStarts, pairEnds)
+        earliestEnd = np.minimum.accumulate(earliestEnd[::-1])[::-1]
+        return needsExact | (earliestEnd[starts] < ends)
+
+
+    def findContextChunks(self, rows, isTokens, ruleKinds, chunkIds, chunkCount): # which chunks have to be scored by polarity_scores
+        '''
+        returns:
+            array: True for each chunk where one of VADER's context rules could change the score
+        '''
+        needsExact = np.bincount(chunkIds[ruleKinds == alwaysContextWord], minlength=chunkCount) > 0
+
+        pairStarts, pairEnds = self.modifierPairs(rows, isTokens, ruleKinds) # a modifier with a lexicon word 1, 2 or 3 tokens later
+        sameChunk = chunkIds[pairStarts] == chunkIds[pairEnds] # only counts if both words are in the same chunk
+        needsExact[chunkIds[pairStarts[sameChunk]]] = True
+        return needsExact
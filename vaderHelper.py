@@ -12,15 +12,89 @@ all at once, I have grouped the song up into 10 words per chunk and will be doin
 descrption of the function ***
 '''
 
-import nltk # natural language toolkit, an NLP library for text processing
-from nltk.sentiment.vader import SentimentIntensityAnalyzer # imports the vader sentiment analyzer from nltk
-import matplotlib.pyplot as plt # for creating plots and visualizations
+import io # BytesIO lets us save the plot PNG into memory instead of a file
+import hashlib # for content-addressed plot cache keys
+import os # operating system module for accessing environment variables
+import cacheHelper as ch # our two tier (memory + disk) cache, used for rendered plots
+import startupHelper as suh # times the lazy setup below when the startup profile is turned on
 
-# Download vader lexicon (only needs to happen once, but safe to run multiple times)
-nltk.download("vader_lexicon", quiet=True) # downloads the vader dictionary of words and their sentiment scores, quiet=True suppresses the download messages
+# nltk, numpy (through vaderBatchHelper) and matplotlib are slow to import, so they are imported inside the functions
+# that use them instead of up here. importing this file (and so starting the bot) stays fast, and the bot only pays
+# for them the first time someone runs a sentiment command
 
-# Initialize the vader sentiment analyzer
-vaderSIA = SentimentIntensityAnalyzer() # creates the sentiment analyzer object that we'll use to analyze text
+# the vader lexicon ships with this project in data/sentiment/vader_lexicon/vader_lexicon.txt (it is MIT licensed,
+# from https://github.com/cjhutto/vaderSentiment) so we dont need nltk.download and a network connection every startup.
+# the data folder is laid out like an nltk_data folder, VADER_DATA_DIR in the 3510.env file can point at a different one
+lexiconDataDirectory = os.getenv("VADER_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+bundledLexicon = "sentiment/vader_lexicon/vader_lexicon.txt" # the lexicon file inside lexiconDataDirectory
+allowLexiconDownload = os.getenv("VADER_ALLOW_DOWNLOAD", "1") == "1" # last resort if the file is missing, set to 0 to never touch the network
+
+vaderSIA = None # the SentimentIntensityAnalyzer, made by getVaderEngine the first time it is needed
+vaderEngine = None # the batch engine scores every chunk at once with NumPy instead of calling vaderSIA.polarity_scores once per chunk
+
+
+
+
+def getVaderEngine(): # returns the batch engine, loading the lexicon the first time
+    '''
+    build the vader analyzer and batch engine on first use. the lexicon comes from lexiconDataDirectory, then from
+    nltk's own data folders if it was downloaded before, and only then (if allowed) from nltk.download.
+    
+    returns:
+        vaderBatchHelper.BatchEngine: the engine that analyzeLyrics uses
+    '''
+    global vaderSIA, vaderEngine # we are changing the module level variables, not making local ones
+    if vaderEngine is None: # first sentiment request in this process
+        with suh.timed("vader lexicon"):
+            import nltk # natural language toolkit, an NLP library for text processing
+            from nltk.sentiment.vader import SentimentIntensityAnalyzer # imports the vader sentiment analyzer from nltk
+            import vaderBatchHelper as vbh # vectorized version of the per-chunk polarity_scores loop
+            
+            if os.path.exists(os.path.join(lexiconDataDirectory, bundledLexicon)): # the bundled copy, no network needed
+                if lexiconDataDirectory not in nltk.data.path:
+                    nltk.data.path.insert(0, lexiconDataDirectory) # nltk only opens files inside its data folders, so add ours to the list
+                vaderSIA = SentimentIntensityAnalyzer(lexicon_file=bundledLexicon)
+            else:
+                try:
+                    nltk.data.find("sentiment/vader_lexicon.zip") # downloaded before, somewhere in nltk's data folders
+                except LookupError:
+                    if not allowLexiconDownload:
+                        raise LookupError(f"vader lexicon not found in {lexiconDataDirectory} and VADER_ALLOW_DOWNLOAD=0")
+                    nltk.download("vader_lexicon", quiet=True) # the old way, only happens once per machine
+                vaderSIA = SentimentIntensityAnalyzer() # creates the sentiment analyzer object that we'll use to analyze text
+            vaderEngine = vbh.BatchEngine(vaderSIA)
+    return vaderEngine
+
+# bump this whenever renderSentimentPlot draws something different, so old cached PNGs stop being used
+plotRendererVersion = 1
+
+# rendered PNGs, keyed on a hash of (artist, song, chunk size, renderer version). rendering is the most CPU heavy
+# thing the bot does, so a repeat /sentimentplot just uploads these bytes. the limits are in bytes since PNGs are big
+plotCache = ch.TwoTierCache(
+    "plots",
+    ttlSeconds=float(os.getenv("PLOT_CACHE_TTL", 30 * 24 * 3600)), # 30 days, same as the lyrics
+    maxMemoryItems=100000, # the byte budget below is the real limit
+    maxDiskItems=100000,
+    maxMemoryBytes=int(os.getenv("PLOT_CACHE_MEMORY_BYTES", 64 * 1024 * 1024)), # 64 MB, roughly 2500 plots
+    maxDiskBytes=int(os.getenv("PLOT_CACHE_DISK_BYTES", 512 * 1024 * 1024)), # 512 MB
+    persist=os.getenv("PLOT_CACHE_PERSIST", "1") == "1", # set PLOT_CACHE_PERSIST=0 for a memory only plot cache
+)
+
+# bump this whenever the scores analyzeLyrics gives back change, so old cached results stop being used
+sentimentScorerVersion = 1
+
+# analyzeLyrics results as SentimentResult.toBytes(), about 24 bytes per chunk (the old dictionaries were a few hundred).
+# keyed on a hash of the lyrics themselves, so if the lyrics cache gets newer lyrics for a song the old scores arent used
+sentimentCache = ch.TwoTierCache(
+    "sentiment",
+    ttlSeconds=float(os.getenv("SENTIMENT_CACHE_TTL", 30 * 24 * 3600)), # 30 days, same as the lyrics
+    maxMemoryItems=100000, # the byte budget below is the real limit
+    maxDiskItems=500000,
+    maxMemoryBytes=int(os.getenv("SENTIMENT_CACHE_MEMORY_BYTES", 16 * 1024 * 1024)), # 16 MB, roughly 20000 songs
+    maxDiskBytes=int(os.getenv("SENTIMENT_CACHE_DISK_BYTES", 256 * 1024 * 1024)),
+    persist=os.getenv("SENTIMENT_CACHE_PERSIST", "1") == "1",
+    staleSeconds=float(os.getenv("SENTIMENT_CACHE_STALE_SECONDS", 60 * 24 * 3600)), # same lyrics + same scorer = same scores, so an old entry is still right (getStaleSentimentAsync)
+)
 
 
 
@@ -35,53 +109,67 @@ def analyzeLyrics(lyrics, chunkSize=10): # defines function that takes lyrics an
         chunkSize (int): Number of words per chunk (10)
     
     returns:
-        dict: dictionary containing:
+        SentimentResult: works like a dictionary containing:
             - 'chunkScores': list of dictionaries with sentiment scores for each chunk
-            - 'chunks': list of text chunks
+            - 'chunks': list of text chunks (sliced out of the lyrics, so they keep the song's line breaks)
             - 'averageCompound': average compound score across all chunks
+        the scores are stored in one small numpy array (result.scores, a row of neg/neu/pos/compound per chunk)
+        and the chunks as (start, end) positions in the lyrics (result.offsets), see vaderBatchHelper.py
         Returns None if lyrics is None or empty
     '''
     # Check if lyrics exist
     if not lyrics: # checks if lyrics is None or empty string
         return None # returns None so we can handle this error in the main bot file
     
-    # split lyrics into words
-    words = lyrics.split() # splits the lyrics string into a list of words using spaces as the delimiter
+    # the old version split the lyrics, then looped over each 10 word chunk calling vaderSIA.polarity_scores,
+    # which re-tokenized every chunk. the batch engine (vaderBatchHelper.py) splits the lyrics once and scores all
+    # the chunks together, and gives back a SentimentResult that reads like the dictionary this function always returned
+    return getVaderEngine().analyzeMany([lyrics], chunkSize)[0] # analyzeMany takes a list of songs, we just have one
+
+
+
+def analyzeLyricsBatch(listOfLyrics, chunkSize=10): # analyzeLyrics for a whole list of songs at once (like an album)
+    '''
+    analyze sentiment of many songs in one pass. much cheaper than calling analyzeLyrics in a loop
+    because all the chunks of all the songs get scored together.
     
-    # if there are fewer words than chunk size, just analyze the whole thing
-    if len(words) <= chunkSize: # if the song has 10 or fewer words, no need to chunk it
-        overallScores = vaderSIA.polarity_scores(lyrics) # analyzes the entire lyrics at once, returns a dict with neg, neu, pos, and compound scores
-        return { # returns a dictionary with the results
-            'chunkScores': [overallScores], # puts the single score in a list for consistency with the multi-chunk format
-            'chunks': [lyrics], # puts the entire lyrics in a list
-            'averageCompound': overallScores['compound'] # the compound score is already the overall score since there's only one chunk
-        }
+    args:
+        listOfLyrics (list): list of lyrics strings
+        chunkSize (int): Number of words per chunk (10)
+    
+    returns:
+        list: one analyzeLyrics() result per song, in the same order (None for songs with no lyrics)
     
-    # initialize lists to store chunk data
-    chunkScores = [] # creates empty list to store sentiment scores for each chunk
-    chunks = [] # creates empty list to store the actual text of each chunk
+    Example:
+        results = analyzeLyricsBatch([lyricsOne, lyricsTwo, lyricsThree])
+    '''
+    return getVaderEngine().analyzeMany(listOfLyrics, chunkSize)
+
+
+
+
+
+def analyzeLyricsWindowed(lyrics, window=10, stride=5, unit="words"): # sliding window version of analyzeLyrics for smoother curves
+    '''
+    analyze sentiment with a window that slides along the song instead of fixed chunks that dont overlap.
+    windows that overlap give a smoother line in sentimentViz. the work is done with running totals,
+    so small strides dont mean re-analyzing the whole window every step.
     
-    # break lyrics into chunks
-    for i in range(0, len(words), chunkSize): # loops through words in steps of 10, so i=0, 10, 20, 30, etc.
-        # Get the next chunk of words
-        chunk = " ".join(words[i:i + chunkSize]) # takes a slice of 10 words starting at position i and joins them back into a string
-        
-        # get sentiment scores for this chunk
-        scores = vaderSIA.polarity_scores(chunk) # analyzes sentiment of this 10 word chunk, returns dict like {'neg': 0.0, 'neu': 0.5, 'pos': 0.5, 'compound': 0.4}
-        
-        # store the chunk and its scores
-        chunks.append(chunk) # adds the chunk text to our chunks list
-        chunkScores.append(scores) # adds the sentiment scores to our chunkScores list
+    args:
+        lyrics (str): The song lyrics to analyze
+        window (int): how many words (or lines) are in each window (10)
+        stride (int): how many words (or lines) the window moves each step (5, so each window overlaps the last one by half)
+        unit (str): "words" or "lines", lines are nice because lyrics are already written in lines
     
-    # calculate average compound score across all chunks
-    compoundScores = [score['compound'] for score in chunkScores] # list comprehension that extracts just the compound score from each chunk's score dictionary
-    averageCompound = sum(compoundScores) / len(compoundScores) # calculates the average by adding all compound scores and dividing by the number of chunks
+    returns:
+        SentimentResult: same keys as analyzeLyrics() ('chunkScores', 'chunks', 'averageCompound') plus 'window', 'stride' and 'unit',
+              so it can go straight into formatSentimentResults() and sentimentViz(). None if lyrics is None or empty
     
-    return { # returns a dictionary with all the analysis results
-        'chunkScores': chunkScores, # list of all the score dictionaries
-        'chunks': chunks, # list of all the text chunks
-        'averageCompound': averageCompound # the average compound score for the whole song
-    }
+    Example:
+        sentimentResults = analyzeLyricsWindowed(lyrics, window=4, stride=1, unit="lines")
+        sentimentViz(sentimentResults, artistName, songTitle)
+    '''
+    return getVaderEngine().analyzeWindows(lyrics, window, stride, unit)
 
 
 
@@ -132,6 +220,35 @@ def formatSentimentResults(sentimentResults): # defines function that takes the
 
 
 
+def formatArtistMood(artistName, trackResults): # turns the per-track results of /artistmood into one message
+    '''
+    format an artist's overall mood (the average of their top tracks' scores) for discord.
+    
+    args:
+        artistName (str): the artist's name
+        trackResults (list): (song title, analyzeLyrics() result or None) for each track, in the order to show them
+    
+    returns:
+        str: the artist's overall label and score, then one line per track
+    '''
+    scoredTracks = [(songTitle, results) for songTitle, results in trackResults if results]
+    if not scoredTracks: # none of the lyrics were found
+        return f"Could not find lyrics for any of {artistName}'s top tracks."
+    
+    artistAverage = sum(results['averageCompound'] for songTitle, results in scoredTracks) / len(scoredTracks) # every song counts the same
+    message = f"**Mood of {artistName}'s top tracks**\n\n"
+    message += f"Overall: **{getSentimentLabel(artistAverage)}** (Score: {artistAverage:.3f}, from {len(scoredTracks)} of {len(trackResults)} songs)\n\n"
+    for number, (songTitle, results) in enumerate(trackResults, 1):
+        if results:
+            message += f"{number}. {songTitle} - {getSentimentLabel(results['averageCompound'])} ({results['averageCompound']:.3f})\n"
+        else:
+            message += f"{number}. {songTitle} - no lyrics found\n"
+    return message
+
+
+
+
+
 def sentimentViz(sentimentResults, artistName, songTitle, filename="sentiment_plot.png"): # defines function that creates a visualization, filename has a default value
    
     '''
@@ -182,26 +299,159 @@ for i in range(1, total_chunks + 1):
 
     '''
     
+    if not sentimentResults: # checks if sentimentResults is None or empty
+        return None # returns None to indicate failure
+    
+    # the drawing now happens in renderSentimentPlot, which gives back the PNG as bytes. this function
+    # just writes those bytes to a file for anyone (like the notebook) who still wants a file on disk
+    pngBytes = renderSentimentPlot(sentimentResults, artistName, songTitle) # draws the plot in memory
+    with open(filename, "wb") as plotFile: # "wb" = write bytes
+        plotFile.write(pngBytes) # saves the plot as a PNG file with the given filename
+    
+    return filename # returns the filename so the bot knows where to find the saved image
+
+
+
+
+
+def renderSentimentPlot(sentimentResults, artistName, songTitle): # draws the same plot as sentimentViz but returns the PNG bytes instead of saving a file
+    '''
+    create the sentiment line graph in memory and return it as PNG bytes.
+    
+    sentimentViz used to draw with pyplot (plt.plot, plt.savefig), which keeps ONE global figure for the
+    whole program and always saved to the same sentiment_plot.png. two /sentimentplot commands at the
+    same time could draw on top of each other or overwrite each other's file. here every call makes its
+    own Figure and saves it into a BytesIO (a file that lives in memory), so calls can run side by side
+    in the worker pool and nothing touches the disk. the bytes go straight into discord.File.
+    
+    args:
+        sentimentResults (dict): Results from analyzeLyrics() containing chunk data
+        artistName (str): Name of the artist
+        songTitle (str): Title of the song
+    
+    returns:
+        bytes: the PNG image, or None if there are no results
+    
+    Example:
+        pngBytes = renderSentimentPlot(sentimentResults, "Pearl Jam", "Black")
+        discordFile = discord.File(io.BytesIO(pngBytes), filename="sentiment_plot.png")
+    '''
     if not sentimentResults: # checks if sentimentResults is None or empty
         return None # returns None to indicate failure
     
     # Extract compound scores from each chunk
-    # following 3 lines adapted from claude code. the full prompt and result is linked above in the docstrings.
+    # following 3 lines adapted from claude code. the full prompt and result is linked in the sentimentViz docstring.
     compoundScores = [score['compound'] for score in sentimentResults['chunkScores']] # list comprehension that extracts just the compound score from each chunk
     
     # create x-axis values (chunk numbers: 1, 2, 3, 4...)
     chunkNumbers = list(range(1, len(compoundScores) + 1)) # creates a list [1, 2, 3, 4, ...] for the x-axis, +1 because range stops before the end number
     
-    # create the plot
-    plt.plot(chunkNumbers, compoundScores) # creates a line graph with chunk numbers on x-axis and sentiment scores on y-axis
+    # matplotlib is only imported the first time a plot is drawn (in the worker process), see the top of this file
+    from matplotlib.figure import Figure # object oriented matplotlib: every plot gets its own Figure instead of sharing pyplot's global one
+    from matplotlib.backends.backend_agg import FigureCanvasAgg # the Agg canvas draws a Figure to PNG without needing a screen
+    
+    # create the plot on its own figure (this used to be plt.plot)
+    figure = Figure() # a brand new figure just for this call, nothing shared with any other plot
+    FigureCanvasAgg(figure) # attaches the Agg canvas that knows how to turn the figure into a PNG
+    axes = figure.add_subplot() # the area inside the figure that we draw the line on
+    axes.plot(chunkNumbers, compoundScores) # creates a line graph with chunk numbers on x-axis and sentiment scores on y-axis
     
     # add labels and title
-    plt.xlabel('Song Progression') # sets the x-axis label which is for each chunk of 10 words 
-    plt.ylabel('Sentiment Score') # sets the y-axis label
-    plt.title(f'{songTitle} by {artistName}') # sets the title of the plot using an f-string
+    axes.set_xlabel('Song Progression') # sets the x-axis label which is for each chunk of 10 words 
+    axes.set_ylabel('Sentiment Score') # sets the y-axis label
+    axes.set_title(f'{songTitle} by {artistName}') # sets the title of the plot using an f-string
     
-    # save the plot
-    plt.savefig(filename) # saves the plot as a PNG file with the given filename
-    plt.clf() # "clear figure" - clears the plot so the next plot doesn't overlap with this one
+    # save the plot into memory instead of a file
+    pngBuffer = io.BytesIO() # an empty in-memory file
+    figure.savefig(pngBuffer, format="png") # writes the PNG into the buffer
+    # no plt.clf() needed anymore: the figure isnt shared, python just throws it away when we return
     
-    return filename # returns the filename so the bot knows where to find the saved image
\ No newline at end of file
+    return pngBuffer.getvalue() # the PNG as bytes
+
+
+
+
+
+def plotCacheKey(artistName, songTitle, chunkSize=10): # the content address of a rendered plot
+    '''
+    build the plot cache key: a sha256 hash of everything that changes what the plot looks like.
+    
+    args:
+        artistName (str): Name of the artist
+        songTitle (str): Title of the song
+        chunkSize (int): words per chunk used for the sentiment analysis
+    
+    returns:
+        str: hex digest used as the key in plotCache
+    '''
+    description = f"{ch.normalizeKey(artistName, songTitle)}|chunkSize={chunkSize}|renderer={plotRendererVersion}"
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+
+
+def getCachedPlot(artistName, songTitle, chunkSize=10): # returns the cached PNG bytes for a song, or None
+    found, pngBytes = plotCache.get(plotCacheKey(artistName, songTitle, chunkSize))
+    return pngBytes if found else None
+
+
+
+async def getCachedPlotAsync(artistName, songTitle, chunkSize=10): # async version of getCachedPlot, for the bot's event loop (the disk tier is read in a thread)
+    found, pngBytes = await plotCache.getAsync(plotCacheKey(artistName, songTitle, chunkSize))
+    return pngBytes if found else None
+
+
+
+def cachePlot(artistName, songTitle, pngBytes, chunkSize=10): # stores rendered PNG bytes for next time
+    if pngBytes:
+        plotCache.set(plotCacheKey(artistName, songTitle, chunkSize), pngBytes)
+
+
+
+async def cachePlotAsync(artistName, songTitle, pngBytes, chunkSize=10): # async version of cachePlot
+    if pngBytes:
+        await plotCache.setAsync(plotCacheKey(artistName, songTitle, chunkSize), pngBytes)
+
+
+
+def sentimentCacheKey(lyrics, chunkSize=10): # the content address of a sentiment result
+    description = f"{lyrics}|chunkSize={chunkSize}|scorer={sentimentScorerVersion}"
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+
+
+def getCachedSentiment(lyrics, chunkSize=10): # returns the cached analyzeLyrics result for these lyrics, or None
+    found, resultBytes = sentimentCache.get(sentimentCacheKey(lyrics, chunkSize))
+    if not found:
+        return None
+    import vaderBatchHelper as vbh # numpy again, only once someone actually asks for sentiment
+    return vbh.SentimentResult.fromBytes(resultBytes, lyrics) # the lyrics go back in so result['chunks'] still works
+
+
+
+async def getCachedSentimentAsync(lyrics, chunkSize=10): # async version of getCachedSentiment, for the bot's event loop
+    found, resultBytes = await sentimentCache.getAsync(sentimentCacheKey(lyrics, chunkSize))
+    if not found:
+        return None
+    import vaderBatchHelper as vbh
+    return vbh.SentimentResult.fromBytes(resultBytes, lyrics)
+
+
+
+async def getStaleSentimentAsync(lyrics, chunkSize=10): # getCachedSentimentAsync, but past its TTL is fine too (for when VADER is too backed up to wait for)
+    found, resultBytes, isStale = await sentimentCache.lookupAsync(sentimentCacheKey(lyrics, chunkSize))
+    if not found:
+        return None
+    import vaderBatchHelper as vbh
+    return vbh.SentimentResult.fromBytes(resultBytes, lyrics)
+
+
+
+def cacheSentiment(lyrics, sentimentResults, chunkSize=10): # stores an analyzeLyrics result for next time
+    if sentimentResults:
+        sentimentCache.set(sentimentCacheKey(lyrics, chunkSize), sentimentResults.toBytes())
+
+
+
+async def cacheSentimentAsync(lyrics, sentimentResults, chunkSize=10): # async version of cacheSentiment
+    if sentimentResults:
+        await sentimentCache.setAsync(sentimentCacheKey(lyrics, chunkSize), sentimentResults.toBytes())